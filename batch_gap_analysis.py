@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Script to run gap analyses headlessly for many documents and regulations
+
+Every (document, regulation) pair is analyzed with the same pipeline as the
+Streamlit page and written to one Excel or Parquet file. All pairs share one
+worker pool for the per-article LLM calls, so --workers bounds the total
+number of concurrent requests regardless of how many pairs run at once.
+
+Example:
+    python batch_gap_analysis.py --documents "Data/docs/*.docx" --regulations finma-2017-1 finma-2013-8
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from modules.gap_analyzer_claude import DEFAULT_MAX_WORKERS, run_gap_analysis
+from modules.progress import ConsoleProgressReporter
+from modules.regulation_store import REGULATION_FILES, REGULATION_IDS
+
+
+def resolve_regulations(values):
+    """
+    Map regulation IDs or full names to (id, name, file) tuples
+
+    Args:
+        values: Regulation IDs (e.g. finma-2017-1) or UI names; empty means all
+
+    Returns:
+        List of (regulation id, regulation name, regulation file)
+    """
+    names_to_ids = {name: regulation_id for regulation_id, name in REGULATION_IDS.items()}
+    resolved = []
+    for value in values or list(REGULATION_IDS):
+        if value in REGULATION_IDS:
+            regulation_id, name = value, REGULATION_IDS[value]
+        elif value in names_to_ids:
+            regulation_id, name = names_to_ids[value], value
+        else:
+            raise ValueError(f"Unknown regulation '{value}' (known IDs: {', '.join(REGULATION_IDS)})")
+        resolved.append((regulation_id, name, REGULATION_FILES[name]))
+    return resolved
+
+
+def resolve_documents(patterns):
+    """
+    Expand document globs into a sorted, de-duplicated list of .docx files
+    """
+    paths = set()
+    for pattern in patterns:
+        paths.update(path for path in glob.glob(pattern, recursive=True) if path.lower().endswith('.docx'))
+    return sorted(paths)
+
+
+def output_path(output_dir, document_path, regulation_id, output_format):
+    """Output file for one (document, regulation) pair"""
+    return os.path.join(output_dir, f"{Path(document_path).stem}__{regulation_id}.{output_format}")
+
+
+def write_results(df_results, path, output_format):
+    """
+    Write gap analysis results to Excel (same formatting as the web download) or Parquet
+    """
+    if output_format == 'xlsx':
+        # Imported lazily - openpyxl is only needed for Excel output
+        from modules.design_excel import write_to_excel
+        with open(path, 'wb') as f:
+            f.write(write_to_excel(df_results).getvalue())
+    else:
+        df_results.to_parquet(path, index=False)
+
+
+def analyze_pair(document_path, regulation, output_dir, output_format, executor, execution_mode, use_chroma,
+                 resume, batch_articles, response_format=None, similarity_gate=None, gate_verify_percent=None,
+                 rerank=None):
+    """
+    Run one (document, regulation) pair and write its output file
+
+    Returns:
+        Tuple (output path, number of result rows, seconds)
+    """
+    regulation_id, regulation_name, regulation_file = regulation
+    path = output_path(output_dir, document_path, regulation_id, output_format)
+    progress = ConsoleProgressReporter(prefix=f"   [{Path(document_path).name} | {regulation_id}] ")
+
+    start = time.perf_counter()
+    df_results = run_gap_analysis(
+        document_path, regulation_file, regulation_name, progress=progress,
+        execution_mode=execution_mode, use_chroma=use_chroma, executor=executor, resume=resume,
+        batch_articles=batch_articles, output_format=response_format, similarity_gate=similarity_gate,
+        gate_verify_percent=gate_verify_percent, rerank=rerank
+    )
+    write_results(df_results, path, output_format)
+    return path, len(df_results), time.perf_counter() - start
+
+
+def main(argv=None):
+    """
+    Run the gap analysis for every (document, regulation) pair
+    """
+    parser = argparse.ArgumentParser(description="Headless batch gap analysis")
+    parser.add_argument('--documents', nargs='+', required=True,
+                        help="Glob patterns of company documents (.docx)")
+    parser.add_argument('--regulations', nargs='*', default=None,
+                        help=f"Regulation IDs or names (default: all - {', '.join(REGULATION_IDS)})")
+    parser.add_argument('--output-dir', default='Results/batch', help="Directory for the result files")
+    parser.add_argument('--format', dest='output_format', choices=['xlsx', 'parquet'], default='xlsx',
+                        help="Output file format")
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS,
+                        help="Size of the shared worker pool for article analysis")
+    parser.add_argument('--parallel-pairs', type=int, default=1,
+                        help="Number of (document, regulation) pairs processed at once")
+    parser.add_argument('--execution-mode', choices=['threads', 'async'], default='threads',
+                        help="threads uses the shared worker pool; async runs one event loop per pair")
+    parser.add_argument('--use-chroma', action='store_true', help="Use managed Chroma indexes for retrieval")
+    parser.add_argument('--batch-articles', action='store_true',
+                        help="Pack consecutive short articles under the same heading into one LLM request")
+    parser.add_argument('--response-format', choices=['table', 'json'], default=None,
+                        help="LLM answer format: pipe-delimited table or validated JSON via tool use "
+                             "(default: GAP_OUTPUT_FORMAT)")
+    parser.add_argument('--similarity-gate', type=float, default=None,
+                        help="Answer articles whose best chunk similarity is below this value with a templated "
+                             "'No' row instead of an LLM call (default: GAP_SIMILARITY_GATE, 0 = off)")
+    parser.add_argument('--gate-verify-percent', type=float, default=None,
+                        help="Percentage of gated articles sent to the LLM anyway to estimate the gate's error rate "
+                             "(default: GAP_GATE_VERIFY_PERCENT)")
+    parser.add_argument('--rerank', action='store_true',
+                        help="Rerank the top GAP_RERANK_CANDIDATES retrieved chunks with a cross-encoder")
+    parser.add_argument('--no-resume', action='store_true',
+                        help="Ignore checkpoints of interrupted earlier runs and analyze every article again")
+    parser.add_argument('--skip-existing', action='store_true', help="Skip pairs whose output file already exists")
+    args = parser.parse_args(argv)
+
+    try:
+        regulations = resolve_regulations(args.regulations)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+
+    documents = resolve_documents(args.documents)
+    if not documents:
+        print("⚠️  No .docx documents matched the given patterns")
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    pairs = [(document, regulation) for document in documents for regulation in regulations]
+    if args.skip_existing:
+        pairs = [
+            (document, regulation) for document, regulation in pairs
+            if not os.path.exists(output_path(args.output_dir, document, regulation[0], args.output_format))
+        ]
+
+    print(f"🚀 Running {len(pairs)} gap analyses ({len(documents)} documents x {len(regulations)} regulations)...")
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as article_pool, \
+            ThreadPoolExecutor(max_workers=max(1, args.parallel_pairs)) as pair_pool:
+        futures = {
+            pair_pool.submit(
+                analyze_pair, document, regulation, args.output_dir, args.output_format,
+                article_pool, args.execution_mode, args.use_chroma, not args.no_resume,
+                args.batch_articles or None, args.response_format, args.similarity_gate, args.gate_verify_percent,
+                args.rerank or None
+            ): (document, regulation[0])
+            for document, regulation in pairs
+        }
+        for future in as_completed(futures):
+            document, regulation_id = futures[future]
+            try:
+                path, rows, seconds = future.result()
+                print(f"   ✅ {path} ({rows} rows, {seconds:.1f}s)")
+            except Exception as e:
+                failures += 1
+                print(f"   ❌ Error analyzing {document} against {regulation_id}: {e}")
+
+    print(f"\n🎉 Batch gap analysis completed ({len(pairs) - failures}/{len(pairs)} succeeded)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
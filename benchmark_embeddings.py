@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Script to benchmark embedding throughput on the regulation articles
+
+Encodes the articles of the regulation files in-process and with 1..N worker
+processes (modules/parallel_embed.py), and prints articles/sec and the speedup
+over the single-process run. Model load time is excluded (workers are warmed
+up before timing).
+
+--onnx compares the ONNX Runtime backend (float32 and int8 graphs) with the
+vectors stored in the *_open_source_embeddings.xlsx files: speed, cosine
+similarity to the stored vector of the same article, and how many of each
+article's top-k nearest articles stay the same.
+
+    python benchmark_embeddings.py                      # 1, 2, 4, ... up to all cores
+    python benchmark_embeddings.py --processes 1 2 4 8 --repeat 4
+    python benchmark_embeddings.py --onnx --processes 1
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from modules.embed_open_source import build_article_texts
+from modules.model.open_source_llm import EMBEDDING_MODEL, create_embeddings
+from modules.parallel_embed import MultiProcessEncoder, default_processes
+from modules.regulation_store import embeddings_to_matrix
+
+SOURCE_FILES = [
+    'Data/Finma_EN/splitted/finma2017.xlsx',
+    'Data/Finma_EN/splitted/finma2023.xlsx',
+    'Data/Finma_EN/splitted/finma2008.xlsx',
+    'Data/Finma_EN/splitted/finma_optional.xlsx'
+]
+# Embedding files holding the article texts together with their torch vectors
+REFERENCE_FILES = [
+    'Data/Finma_EN/splitted/finma2017_open_source_embeddings.xlsx',
+    'Data/Finma_EN/splitted/finma2023_open_source_embeddings.xlsx',
+    'Data/Finma_EN/splitted/finma_optional_open_source_embeddings.xlsx'
+]
+NEIGHBOURS = 5
+
+
+def load_texts(paths, repeat=1):
+    """Article texts of all regulation files (repeated to get a longer run)"""
+    texts = []
+    for file_path in paths:
+        if os.path.exists(file_path):
+            texts.extend(build_article_texts(pd.read_excel(file_path)))
+        else:
+            print(f"⚠️  File not found: {file_path}")
+    return texts * repeat
+
+
+def process_counts(maximum):
+    """1, 2, 4, ... up to maximum (maximum always included)"""
+    counts, count = [], 1
+    while count < maximum:
+        counts.append(count)
+        count *= 2
+    counts.append(maximum)
+    return counts
+
+
+def time_encode(encode, texts):
+    """Seconds for one encode call"""
+    start = time.perf_counter()
+    encode(texts)
+    return time.perf_counter() - start
+
+
+def load_reference(paths):
+    """Article texts and stored embedding matrices of the reference files (rows without a vector dropped)"""
+    references = []
+    for file_path in paths:
+        if not os.path.exists(file_path):
+            print(f"⚠️  File not found: {file_path}")
+            continue
+        df = pd.read_excel(file_path)
+        matrix = embeddings_to_matrix(df['Embedding'])
+        valid = ~np.isnan(matrix).any(axis=1)
+        texts = [text for text, keep in zip(build_article_texts(df), valid) if keep]
+        references.append((file_path, texts, matrix[valid]))
+    return references
+
+
+def _normalize(matrix):
+    """L2-normalize rows"""
+    return matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+
+def neighbour_overlap(reference, candidate, k=NEIGHBOURS):
+    """Mean share of each row's top-k nearest rows (cosine, self excluded) found by both matrices"""
+    k = min(k, len(reference) - 1)
+    if k < 1:
+        return 1.0
+    overlaps = []
+    for matrix in (reference, candidate):
+        similarities = _normalize(matrix) @ _normalize(matrix).T
+        np.fill_diagonal(similarities, -np.inf)
+        overlaps.append(np.argsort(-similarities, axis=1)[:, :k])
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(*overlaps)]))
+
+
+def compare_onnx(references):
+    """Print speed and agreement with the stored vectors for the ONNX float32 and int8 graphs"""
+    from modules.model.onnx_embeddings import OnnxEmbeddings
+
+    texts = [text for _, file_texts, _ in references for text in file_texts]
+    print(f"\n🔬 ONNX backend vs stored vectors ({len(texts)} articles, top-{NEIGHBOURS} neighbours)")
+    for label, quantized in (("onnx float32", False), ("onnx int8", True)):
+        embeddings = OnnxEmbeddings(EMBEDDING_MODEL, quantized=quantized)
+        embeddings.encode_batched(texts[:8])  # warm up
+        seconds = time_encode(lambda batch: embeddings.encode_batched(batch, precision="float32"), texts)
+
+        cosines, overlaps = [], []
+        for _, file_texts, stored in references:
+            vectors = embeddings.encode_batched(file_texts, precision="float32")
+            cosines.append(np.sum(_normalize(vectors) * _normalize(stored), axis=1))
+            overlaps.append(neighbour_overlap(stored, vectors))
+        cosines = np.concatenate(cosines)
+        print(f"   {label:14s} {len(texts) / seconds:8.1f} articles/sec   cosine mean {cosines.mean():.4f} "
+              f"min {cosines.min():.4f}   neighbours kept {np.mean(overlaps):.1%}")
+
+
+def main(argv=None):
+    """
+    Run the scaling benchmark and print one line per configuration
+    """
+    parser = argparse.ArgumentParser(description="Benchmark embedding throughput")
+    parser.add_argument('--processes', type=int, nargs='+', help="Process counts to test (default 1, 2, 4, ... all cores)")
+    parser.add_argument('--repeat', type=int, default=1, help="Repeat the article texts to lengthen the run")
+    parser.add_argument('--onnx', action='store_true', help="Also compare the ONNX backend with the stored vectors")
+    args = parser.parse_args(argv)
+
+    texts = load_texts(SOURCE_FILES, args.repeat)
+    if not texts:
+        print("❌ No regulation articles found")
+        return
+
+    cores = default_processes()
+    print(f"🚀 Benchmarking {EMBEDDING_MODEL} on {len(texts)} articles ({cores} cores)")
+
+    embeddings = create_embeddings(EMBEDDING_MODEL, backend="torch")
+    embeddings.encode_batched(texts[:8])  # warm up
+    baseline = time_encode(embeddings.encode_batched, texts)
+    print(f"   in-process (torch)  {len(texts) / baseline:8.1f} articles/sec")
+
+    single = None
+    for processes in args.processes or process_counts(cores):
+        with MultiProcessEncoder(processes=processes, model_name=EMBEDDING_MODEL) as encoder:
+            encoder.warm_up()
+            seconds = time_encode(encoder.encode, texts)
+        single = single or seconds
+        print(f"   {processes:2d} proc x {encoder.threads_per_process:2d} threads "
+              f"{len(texts) / seconds:8.1f} articles/sec   speedup {single / seconds:4.2f}x")
+
+    if args.onnx:
+        compare_onnx(load_reference(REFERENCE_FILES))
+
+    print("\n🎉 Benchmark completed!")
+
+
+if __name__ == "__main__":
+    main()
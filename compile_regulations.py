@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Script to convert regulation Excel files into the compiled regulation format
+(Parquet metadata + memory-mappable float32 embedding matrix)
+"""
+
+import glob
+import sys
+from modules.regulation_store import REGULATION_FILES, compile_regulation, is_compiled
+
+
+def main(paths=None):
+    """
+    Compile the given regulation files, or every known one when none are given
+    """
+    if not paths:
+        paths = sorted(set(REGULATION_FILES.values()) | set(glob.glob('Data/Finma_EN/splitted/*_embeddings.xlsx')))
+
+    print("🚀 Compiling regulation files...")
+
+    for file_path in paths:
+        if is_compiled(file_path):
+            print(f"   ⏭️  {file_path} is up to date")
+            continue
+
+        try:
+            output_dir = compile_regulation(file_path)
+            print(f"   ✅ {file_path} -> {output_dir}")
+        except Exception as e:
+            print(f"   ❌ Error compiling {file_path}: {e}")
+
+    print("\n🎉 Compilation completed!")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,19 +1,71 @@
 #!/usr/bin/env python3
 """
 Script to generate embeddings for FINMA regulations using open source sentence transformers
+
+Re-runs are incremental: a manifest next to every output file stores one hash
+per article (Title/SubTitle/Sub_Subtitle/Text + embedding model), and only new
+or changed articles are embedded again. Use --force to re-embed everything,
+and --processes N to spread the encoding over N worker processes.
 """
 
+import argparse
+import json
 import os
 import sys
+import time
 import pandas as pd
-from modules.embed_open_source import embed_articles
+from modules.embed_open_source import embed_articles_incremental
+from modules.model.onnx_embeddings import onnx_model_name
+from modules.model.open_source_llm import EMBEDDING_MODEL, EMBEDDINGS_BACKEND
+from modules.parallel_embed import MultiProcessEncoder
+from modules.regulation_store import embeddings_to_matrix, manifest_path
 
-def main():
+def load_previous(output_file, model_name):
+    """
+    Article hashes and embedding matrix of the previous run
+    
+    Returns:
+        Tuple (hashes, matrix), or (None, None) when there is no usable previous run
+    """
+    manifest_file = manifest_path(output_file)
+    if not os.path.exists(manifest_file) or not os.path.exists(output_file):
+        return None, None
+    with open(manifest_file, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("model") != model_name:
+        return None, None
+    
+    previous_df = pd.read_excel(output_file)
+    if 'Embedding' not in previous_df.columns:
+        return None, None
+    return manifest.get("articles"), embeddings_to_matrix(previous_df['Embedding'])
+
+def main(argv=None):
     """
     Generate embeddings for all FINMA regulation files
     """
+    parser = argparse.ArgumentParser(description="Generate regulation embeddings")
+    parser.add_argument('--force', action='store_true', help="Re-embed every article, ignoring the manifests")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="Worker processes with one model each (1 = embed in this process)")
+    args = parser.parse_args(argv)
+    if args.processes > 1 and EMBEDDINGS_BACKEND != "torch":
+        # Worker processes run the torch model; mixing its vectors with the ONNX ones would
+        # leave the regulation and the document chunks in slightly different embedding spaces
+        parser.error("--processes needs EMBEDDINGS_BACKEND=torch")
+    
     print("🚀 Starting embedding generation with open source models...")
     
+    # One pool for all files, so every worker loads the model only once
+    encoder = None
+    model_name = EMBEDDING_MODEL
+    if args.processes > 1:
+        encoder = MultiProcessEncoder(processes=args.processes, model_name=EMBEDDING_MODEL)
+        print(f"⚙️  {encoder.processes} worker processes x {encoder.threads_per_process} threads")
+    elif EMBEDDINGS_BACKEND == "onnx":
+        # ONNX vectors differ slightly from the torch ones, so they get their own manifest model name
+        model_name = onnx_model_name(EMBEDDING_MODEL)
+    
     # List of regulation files to process
     regulation_files = [
         'Data/Finma_EN/splitted/finma2017.xlsx',
@@ -31,12 +83,29 @@ def main():
                 df = pd.read_excel(file_path)
                 print(f"   Loaded {len(df)} rows")
                 
-                # Generate embeddings
-                embeddings_df = embed_articles(df)
-                
-                # Save embeddings
                 output_file = file_path.replace('.xlsx', '_open_source_embeddings.xlsx')
-                embeddings_df.to_excel(output_file, index=False)
+                previous_hashes, previous_matrix = (None, None) if args.force else load_previous(output_file, model_name)
+                
+                # Generate embeddings for new or changed articles (batched, one model call per EMBED_BATCH_SIZE articles)
+                start = time.perf_counter()
+                matrix, hashes, report = embed_articles_incremental(
+                    df, model_name, previous_hashes=previous_hashes, previous_matrix=previous_matrix,
+                    encoder=encoder
+                )
+                seconds = time.perf_counter() - start
+                print(f"   ♻️  {report['reused']} unchanged, {report['embedded']} new or changed, "
+                      f"{report['removed']} removed ({seconds:.1f}s)")
+                
+                if report['embedded'] == 0 and report['removed'] == 0 and hashes == previous_hashes:
+                    print(f"   ⏭️  {output_file} is up to date")
+                    continue
+                
+                # Save the articles with their embeddings (written once), then the manifest
+                output_df = df.copy()
+                output_df['Embedding'] = matrix.tolist()
+                output_df.to_excel(output_file, index=False)
+                with open(manifest_path(output_file), "w", encoding="utf-8") as f:
+                    json.dump({"model": model_name, "source": file_path, "articles": hashes}, f, indent=2)
                 print(f"   ✅ Saved embeddings to {output_file}")
                 
             except Exception as e:
@@ -44,6 +113,9 @@ def main():
         else:
             print(f"⚠️  File not found: {file_path}")
     
+    if encoder is not None:
+        encoder.close()
+    
     print("\n🎉 Embedding generation completed!")
     print("\n📝 Next steps:")
     print("1. Update your analyzer to use the new embedding files")
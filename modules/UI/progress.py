@@ -0,0 +1,36 @@
+import pandas as pd
+import streamlit as st
+from modules.progress import ProgressReporter
+
+
+class StreamlitProgressReporter(ProgressReporter):
+    """
+    Shows gap analysis progress with a Streamlit progress bar, status line and a live results table
+    """
+    # Columns of the live table (the article content excerpt is left out)
+    TABLE_COLUMNS = ['Article', 'Requirement', 'Covered', 'Reference in Document', 'Comment']
+
+    def __init__(self):
+        self.progress_bar = st.progress(0)
+        self.status_text = st.empty()
+        self.table = st.empty()
+
+    def update(self, percent, message):
+        self.progress_bar.progress(min(max(int(percent), 0), 100))
+        self.status_text.text(message)
+
+    def warning(self, message):
+        st.warning(message)
+
+    def rows(self, rows, columns):
+        if not rows:
+            return
+        df_rows = pd.DataFrame(rows, columns=columns)
+        self.table.dataframe(
+            df_rows[[column for column in self.TABLE_COLUMNS if column in df_rows.columns]],
+            hide_index=True, use_container_width=True
+        )
+
+    def finish(self):
+        self.status_text.empty()
+        self.progress_bar.empty()
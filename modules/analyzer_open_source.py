@@ -7,14 +7,17 @@ import numpy as np
 from openpyxl import Workbook
 from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
 from langchain_chroma import Chroma
-from modules.model.open_source_llm import create_embeddings, create_openai_llm, create_anthropic_llm
+from modules.model.open_source_llm import create_openai_llm, create_anthropic_llm
 from modules.prompts.gap_finder_prompt import build_gap_prompt, build_table_prompt
+from modules.resources import registry, get_embeddings
 from langchain.schema.document import Document
 
-# Initialize open source components
-embeddings = create_embeddings()
-# You can choose between OpenAI or Anthropic
-llm = create_openai_llm()  # or create_anthropic_llm()
+def get_analyzer_llm():
+    """
+    LLM used by this analyzer, created once per process on first use
+    """
+    # You can choose between OpenAI or Anthropic
+    return registry.get("openai_llm", create_openai_llm)  # or create_anthropic_llm
 
 def parse_embedding(embedding_str):
     """
@@ -86,14 +89,14 @@ def create_vectorstore(db_directory, split_content):
         os.makedirs(db_directory)
         vectorstore = Chroma(
             collection_name="collection_document",
-            embedding_function=embeddings,
+            embedding_function=get_embeddings(),
             persist_directory=db_directory,
         )
         vectorstore.add_documents(to_embed_docs)
     else: 
         vectorstore = Chroma(
             collection_name="collection_document",
-            embedding_function=embeddings,
+            embedding_function=get_embeddings(),
             persist_directory=db_directory,
         )
     
@@ -250,11 +253,11 @@ def run_gap_analysis():
 
             # Generate gap analysis
             gap_prompt = build_gap_prompt(results, full_text)
-            response = llm.ask_llm(gap_prompt, temperature=0.6)
+            response = get_analyzer_llm().ask_llm(gap_prompt, temperature=0.6)
 
             # Generate table
             table_prompt = build_table_prompt(response)   
-            table_response = llm.ask_llm(table_prompt, temperature=0.1) 
+            table_response = get_analyzer_llm().ask_llm(table_prompt, temperature=0.1) 
 
             # Store results
             new_row = [{
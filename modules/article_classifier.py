@@ -0,0 +1,205 @@
+"""
+Regulation article classifier
+
+Tags every regulation row as one of:
+
+    requirement - an obligation the company document has to cover (sent to the LLM)
+    definition  - terms and definitions ("... is understood to mean ...")
+    scope       - subject matter, purpose and scope of application
+    abrogated   - repealed margins ("Abrogated", "Repealed")
+
+Rules come first: the row text (abrogated, definitional and scope phrasing)
+and the section headings (e.g. "II. Terms", "III. Scope of application").
+Rows the rules leave undecided are requirements, unless the optional
+embedding check (ARTICLE_CLASSIFIER_EMBEDDINGS=true) finds them clearly
+closer to the labeled definition/scope examples than to the requirement
+examples. The article embeddings are the ones already stored with the
+regulation, so the check only embeds the handful of labeled examples.
+
+The category is stored in the Category column of the compiled regulation.
+"""
+
+import os
+import re
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+CATEGORIES = ("requirement", "definition", "scope", "abrogated")
+
+# Bump when the rules or examples change, so compiled regulations are rebuilt
+CLASSIFIER_VERSION = 1
+
+# Reclassify rule-undecided rows by similarity to the labeled examples
+ARTICLE_CLASSIFIER_EMBEDDINGS = os.getenv("ARTICLE_CLASSIFIER_EMBEDDINGS", "false").lower() == "true"
+# Minimum cosine similarity to a definition/scope example ...
+CLASSIFIER_MIN_SIMILARITY = float(os.getenv("ARTICLE_CLASSIFIER_MIN_SIMILARITY", "0.75"))
+# ... and minimum lead over the closest requirement example
+CLASSIFIER_MIN_MARGIN = float(os.getenv("ARTICLE_CLASSIFIER_MIN_MARGIN", "0.05"))
+
+# Texts of repealed margins (compared after stripping punctuation)
+ABROGATED_TEXTS = {"abrogated", "repealed", "deleted", "aufgehoben", "abrogé", "abrogée"}
+
+DEFINITION_HEADING = re.compile(r"\b(terms|definitions?|glossary|abbreviations)\b", re.IGNORECASE)
+SCOPE_HEADING = re.compile(r"\b(subject matter|purpose|topic|scope( of application)?)\b", re.IGNORECASE)
+
+DEFINITION_TEXT = re.compile(
+    r'\b(is|are) (understood to mean|defined as)\b|\brefers? to\b|\bthe term ["“]|'
+    r"\bfor the purpose of (this circular|these rules)\b|\breferred to (below|hereinafter) as\b",
+    re.IGNORECASE
+)
+SCOPE_TEXT = re.compile(
+    r"^(this circular|sections? [ivx\-–]+ of this circular) (applies|apply|sets out|substantiates)\b",
+    re.IGNORECASE
+)
+# Obligation wording overrides definitional headings and phrasing
+OBLIGATION_TEXT = re.compile(
+    r"\b(must|shall|are required to|is required to|(is|are) to be|have to|has to)\b", re.IGNORECASE
+)
+
+# Labeled examples for the embedding check (FINMA-Circ. 2017/1 and 2013/8 wording)
+LABELED_EXAMPLES = {
+    "definition": [
+        "Corporate governance is understood to mean the principles and structures on the basis of which "
+        "an institution is directed and controlled by its governing bodies.",
+        "Risk tolerance comprises quantitative and qualitative considerations regarding the key risks which "
+        "an institution is prepared to take to achieve its strategic business objectives.",
+        "Compliance is understood to mean abiding by the relevant statutory, regulatory and internal rules "
+        "and observing generally accepted market standards and codes of conduct.",
+        "Information refers to facts including firm intentions, as yet unrealised plans and prospects.",
+    ],
+    "scope": [
+        "This circular sets out the requirements to be met by the corporate governance, risk management, "
+        "internal control system and internal audit at banks, securities firms and financial groups.",
+        "This circular applies to all institutions as defined in margin no. 1. The requirements are to be "
+        "implemented on a case-by-case basis, giving due consideration to the size and risk profile.",
+        "Sections III-V of this Circular apply to all individuals and legal entities acting as market participants.",
+    ],
+    "requirement": [
+        "The board of directors is responsible for establishing an appropriate business organisation and "
+        "issues the regulations required for its implementation.",
+        "Institutions in supervisory categories 1 to 3 must establish an audit committee and a risk committee.",
+        "Supervised institutions must take measures for the surveillance of employee transactions.",
+        "The compensation system for independent control bodies must not create incentives which could "
+        "lead to conflicts of interest.",
+    ],
+}
+
+
+def _clean(value) -> str:
+    """Cell value as text ('' for empty/NaN cells)"""
+    text = str(value).strip() if value is not None else ''
+    return '' if text in ('None', 'nan') else text
+
+
+def classify_by_rules(title, sub_title, sub_subtitle, text) -> Optional[str]:
+    """
+    Classify one regulation row with the text and heading rules
+
+    Args:
+        title, sub_title, sub_subtitle: Section headings of the row
+        text: Article text
+
+    Returns:
+        Category, or None when no rule applies
+    """
+    text = _clean(text)
+    if re.sub(r"[\s\.\*\-–()\[\]]", "", text).lower() in ABROGATED_TEXTS:
+        return "abrogated"
+
+    if SCOPE_TEXT.search(text):
+        return "scope"
+    # Obligations under a terms/scope heading are still requirements
+    # (e.g. "Supervised institutions must assess ..." under "A. Scope")
+    if OBLIGATION_TEXT.search(text):
+        return None
+
+    # The most specific heading decides (e.g. "A. Scope" under "VII. Organisational requirements")
+    heading = next((value for value in map(_clean, (sub_subtitle, sub_title, title)) if value), '')
+    if DEFINITION_HEADING.search(heading):
+        return "definition"
+    if SCOPE_HEADING.search(heading):
+        return "scope"
+    if DEFINITION_TEXT.search(text):
+        return "definition"
+    return None
+
+
+def _normalize(matrix):
+    """L2-normalize rows (zero rows stay zero)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def classify_by_similarity(embeddings, example_embeddings: Dict[str, np.ndarray],
+                           min_similarity: float = CLASSIFIER_MIN_SIMILARITY,
+                           min_margin: float = CLASSIFIER_MIN_MARGIN) -> List[str]:
+    """
+    Classify article embeddings by their closest labeled example
+
+    A row becomes definition/scope only when its best example of that category
+    reaches min_similarity and beats the best requirement example by min_margin;
+    everything else is a requirement.
+
+    Args:
+        embeddings: Article embedding matrix (NaN rows count as requirements)
+        example_embeddings: Category -> embedding matrix of its labeled examples
+        min_similarity: Minimum cosine similarity to a non-requirement example
+        min_margin: Minimum lead over the closest requirement example
+
+    Returns:
+        Category per row
+    """
+    articles = _normalize(np.nan_to_num(np.asarray(embeddings, dtype=np.float32)))
+    best = {
+        category: (articles @ _normalize(examples).T).max(axis=1)
+        for category, examples in example_embeddings.items()
+    }
+    requirement_best = best.get("requirement", np.zeros(len(articles), dtype=np.float32))
+
+    categories = []
+    for position in range(len(articles)):
+        category, score = "requirement", min_similarity
+        for candidate in ("definition", "scope"):
+            if candidate in best and best[candidate][position] >= score \
+                    and best[candidate][position] - requirement_best[position] >= min_margin:
+                category, score = candidate, best[candidate][position]
+        categories.append(category)
+    return categories
+
+
+def classify_articles(df, embeddings=None, embed_texts: Optional[Callable] = None,
+                      use_embeddings: Optional[bool] = None) -> List[str]:
+    """
+    Classify every row of a regulation DataFrame
+
+    Args:
+        df: Regulation rows (Title, SubTitle, Sub_Subtitle, Text)
+        embeddings: Article embedding matrix aligned with df (needed for the embedding check)
+        embed_texts: Function texts -> embedding matrix for the labeled examples, in the same
+                     embedding space as the article embeddings
+        use_embeddings: Run the embedding check for rule-undecided rows
+                        (defaults to ARTICLE_CLASSIFIER_EMBEDDINGS)
+
+    Returns:
+        Category per row, aligned with df
+    """
+    if use_embeddings is None:
+        use_embeddings = ARTICLE_CLASSIFIER_EMBEDDINGS
+
+    categories = [
+        classify_by_rules(row.get('Title'), row.get('SubTitle'), row.get('Sub_Subtitle'), row.get('Text'))
+        for _, row in df.iterrows()
+    ]
+    undecided = [position for position, category in enumerate(categories) if category is None]
+
+    if use_embeddings and undecided and embeddings is not None and embed_texts is not None:
+        example_embeddings = {
+            category: np.asarray(embed_texts(examples)) for category, examples in LABELED_EXAMPLES.items()
+        }
+        similar = classify_by_similarity(np.asarray(embeddings)[undecided], example_embeddings)
+        for position, category in zip(undecided, similar):
+            categories[position] = category
+
+    return [category or "requirement" for category in categories]
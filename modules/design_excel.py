@@ -79,6 +79,16 @@ def write_to_excel(df_table):
 
         worksheet.column_dimensions.group("B", "B", hidden=True)
 
+        # Run totals and per-article token usage (set by the gap analyzer in df.attrs)
+        run_metrics = df_table.attrs.get("run_metrics")
+        if run_metrics:
+            df_metrics = pd.DataFrame(list(run_metrics.items()), columns=["Metric", "Value"])
+            df_metrics.to_excel(writer, index=False, sheet_name="Run Metrics")
+            writer.book["Run Metrics"].column_dimensions["A"].width = 32
+        article_usage = df_table.attrs.get("article_usage")
+        if article_usage:
+            pd.DataFrame(article_usage).to_excel(writer, index=False, sheet_name="Token Usage")
+
     # Save the workbook to the buffer
     output.seek(0)
     return output
\ No newline at end of file
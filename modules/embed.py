@@ -1,38 +1,48 @@
 
-from model.bedrock import bedrock_embedding
+from concurrent.futures import ThreadPoolExecutor
+from modules.model.bedrock import bedrock_embedding
+from modules.embed_open_source import build_article_texts
+import numpy as np
 import pandas as pd
 
-bedrock_embeddings=bedrock_embedding()
-
-def embed_articles(df):
-    finma_df = pd.DataFrame(columns=["Embedding"])
-    for index,item in enumerate(df['Text']):
-        print(index)
-        complete_article=df['Title'][index]
-        if df['SubTitle'][index] and str(df['SubTitle'][index])!='nan':
-            complete_article=complete_article+'\n'+df['SubTitle'][index]
-            
-        if df['Sub_Subtitle'][index] and str(df['Sub_Subtitle'][index])!='nan': 
-            complete_article=complete_article+'\n'+df['Sub_Subtitle'][index]
-        
-        # complete_article=complete_article+'\n Article: '+df_2017['Margin'][index]
-        complete_article=complete_article+'\n'+item
-        cur_embedding=bedrock_embeddings.embed_query(complete_article)
-        print(type(cur_embedding))
-        new_row = [{
-                    "Embedding": cur_embedding,
-                }]
-        finma_df = pd.concat([finma_df, pd.DataFrame(new_row)], ignore_index=True)
-    return finma_df
-
-df_2017=pd.read_excel('Data/Finma_EN/splitted/finma2017.xlsx') 
-finma_df_2017= embed_articles(df_2017)    
-finma_df_2017.to_excel('Data/Finma_EN/Splitted/embedding_2017.xlsx')
-
-# df_2023=pd.read_excel('Data/Finma_EN/splitted/finma2023.xlsx') 
-# finma_df_2023= embed_articles(df_2023)    
-# finma_df_2023.to_excel('Data/Finma_EN/Splitted/embedding_2023.xlsx')  
-
-# df_2008=pd.read_excel('Data/Finma_EN/splitted/finma2008.xlsx') 
-# finma_df_2008= embed_articles(df_2008)    
-# finma_df_2008.to_excel('Data/Finma_EN/Splitted/embedding_2008.xlsx')  
\ No newline at end of file
+# Titan embeds one text per request, so batches are sent from a few threads at once
+BEDROCK_EMBED_BATCH_SIZE = 32
+BEDROCK_EMBED_WORKERS = 4
+
+def embed_articles(df, bedrock_embeddings=None, batch_size=BEDROCK_EMBED_BATCH_SIZE, workers=BEDROCK_EMBED_WORKERS):
+    """
+    Generate Bedrock Titan embeddings for articles (legacy twin of modules/embed_open_source.py)
+
+    Run as: python -m modules.embed
+    """
+    bedrock_embeddings = bedrock_embeddings or bedrock_embedding()
+    texts = build_article_texts(df)
+
+    def embed_batch(start):
+        return bedrock_embeddings.embed_documents(texts[start:start + batch_size])
+
+    # Results are written into one preallocated float32 matrix, in row order
+    matrix = None
+    starts = range(0, len(texts), batch_size)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start, embeddings in zip(starts, pool.map(embed_batch, starts)):
+            if matrix is None:
+                matrix = np.empty((len(texts), len(embeddings[0])), dtype=np.float32)
+            matrix[start:start + len(embeddings)] = embeddings
+
+    if matrix is None:
+        return pd.DataFrame(columns=["Embedding"])
+    return pd.DataFrame({"Embedding": matrix.tolist()})
+
+if __name__ == "__main__":
+    df_2017=pd.read_excel('Data/Finma_EN/splitted/finma2017.xlsx')
+    finma_df_2017= embed_articles(df_2017)
+    finma_df_2017.to_excel('Data/Finma_EN/Splitted/embedding_2017.xlsx')
+
+    # df_2023=pd.read_excel('Data/Finma_EN/splitted/finma2023.xlsx')
+    # finma_df_2023= embed_articles(df_2023)
+    # finma_df_2023.to_excel('Data/Finma_EN/Splitted/embedding_2023.xlsx')
+
+    # df_2008=pd.read_excel('Data/Finma_EN/splitted/finma2008.xlsx')
+    # finma_df_2008= embed_articles(df_2008)
+    # finma_df_2008.to_excel('Data/Finma_EN/Splitted/embedding_2008.xlsx')
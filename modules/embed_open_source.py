@@ -1,46 +1,150 @@
-from modules.model.open_source_llm import create_embeddings
+from modules.resources import get_base_embeddings, get_embeddings
+from modules.model.open_source_llm import EMBED_BATCH_SIZE
+import hashlib
+import numpy as np
 import pandas as pd
 
-# Initialize embeddings
-embeddings = create_embeddings()
+# Heading columns combined (in this order) with the Text column into one article text
+ARTICLE_TEXT_COLUMNS = ['Title', 'SubTitle', 'Sub_Subtitle', 'Text']
 
-def embed_articles(df):
+
+def _text_column(df, column):
+    """Column as strings, with missing columns and empty/NaN cells as ''"""
+    if column not in df.columns:
+        return pd.Series('', index=df.index)
+    values = df[column].fillna('').astype(str)
+    return values.mask(values.isin(['nan', 'None']), '')
+
+
+def build_article_texts(df):
+    """
+    Build the complete text (Title, SubTitle, Sub_Subtitle, Text) of every article
+    
+    Column-wise string operations instead of a Python loop over the rows; empty
+    parts are left out together with their line break.
+    
+    Args:
+        df: DataFrame with columns 'Title', 'SubTitle', 'Sub_Subtitle' (optional), 'Text'
+    
+    Returns:
+        List of article texts, aligned with the DataFrame rows
+    """
+    texts = _text_column(df, ARTICLE_TEXT_COLUMNS[0])
+    for column in ARTICLE_TEXT_COLUMNS[1:]:
+        part = _text_column(df, column)
+        separator = pd.Series(np.where((texts != '') & (part != ''), '\n', ''), index=df.index)
+        texts = texts + separator + part
+    return texts.tolist()
+
+
+def embed_article_matrix(df, batch_size=EMBED_BATCH_SIZE, progress_callback=None):
+    """
+    Embed all articles of a regulation in batches
+    
+    Args:
+        df: DataFrame with columns 'Title', 'SubTitle', 'Sub_Subtitle', 'Text'
+        batch_size: Number of articles per model call
+        progress_callback: Called as (done, total, articles_per_second) after every batch
+    
+    Returns:
+        float32 matrix with one embedding row per article (always freshly encoded,
+        the chunk embedding cache is bypassed)
+    """
+    return get_base_embeddings().encode_batched(
+        build_article_texts(df), batch_size=batch_size, precision="float32", progress_callback=progress_callback
+    )
+
+
+def embed_articles(df, batch_size=EMBED_BATCH_SIZE, progress_callback=None):
     """
     Generate embeddings for articles using open source sentence transformers
     
     Args:
         df: DataFrame with columns 'Title', 'SubTitle', 'Sub_Subtitle', 'Text'
-        
+        batch_size: Number of articles per model call
+        progress_callback: Called as (done, total, articles_per_second) after every batch
+    
     Returns:
         DataFrame with embeddings
     """
-    finma_df = pd.DataFrame(columns=["Embedding"])
+    matrix = embed_article_matrix(df, batch_size=batch_size, progress_callback=progress_callback)
+    # Lists, so Excel stores them in the same "[...]" format as before
+    return pd.DataFrame({"Embedding": matrix.tolist()})
+
+def article_hashes(df, model_name):
+    """
+    Content hash of every article for incremental re-embedding
     
-    for index, item in enumerate(df['Text']):
-        print(f"Processing article {index + 1}/{len(df)}")
-        
-        # Build complete article text
-        complete_article = df['Title'][index]
-        
-        if df['SubTitle'][index] and str(df['SubTitle'][index]) != 'nan':
-            complete_article = complete_article + '\n' + df['SubTitle'][index]
-            
-        if 'Sub_Subtitle' in df.columns and df['Sub_Subtitle'][index] and str(df['Sub_Subtitle'][index]) != 'nan': 
-            complete_article = complete_article + '\n' + df['Sub_Subtitle'][index]
-        
-        complete_article = complete_article + '\n' + item
-        
-        # Generate embedding
-        cur_embedding = embeddings.embed_query(complete_article)
-        print(f"Generated embedding of length: {len(cur_embedding)}")
+    Covers Title, SubTitle, Sub_Subtitle, Text and the embedding model, so a
+    corrected margin or a model change gives a new hash.
+    
+    Args:
+        df: DataFrame with columns 'Title', 'SubTitle', 'Sub_Subtitle' (optional), 'Text'
+        model_name: Embedding model name
         
-        # Add to DataFrame
-        new_row = [{
-            "Embedding": cur_embedding,
-        }]
-        finma_df = pd.concat([finma_df, pd.DataFrame(new_row)], ignore_index=True)
+    Returns:
+        List of hex digests, aligned with the DataFrame rows
+    """
+    columns = [_text_column(df, column).tolist() for column in ARTICLE_TEXT_COLUMNS]
+    return [
+        hashlib.sha256('\x1f'.join((model_name,) + fields).encode('utf-8')).hexdigest()
+        for fields in zip(*columns)
+    ]
+
+
+def embed_articles_incremental(df, model_name, previous_hashes=None, previous_matrix=None,
+                               batch_size=EMBED_BATCH_SIZE, progress_callback=None, encoder=None):
+    """
+    Embed only new or changed articles, reusing the vectors of unchanged ones
+    
+    Args:
+        df: DataFrame with columns 'Title', 'SubTitle', 'Sub_Subtitle', 'Text'
+        model_name: Embedding model name (part of the article hash)
+        previous_hashes: Article hashes of the previous run (manifest), aligned with previous_matrix
+        previous_matrix: Embedding matrix of the previous run (NaN rows are embedded again)
+        batch_size: Number of articles per model call
+        progress_callback: Called as (done, total, articles_per_second) after every batch
+        encoder: Object with encode_batched() to use instead of the shared in-process model
+                 (e.g. modules.parallel_embed.MultiProcessEncoder); the chunk embedding
+                 cache is never used, so articles without a reusable vector are encoded
         
-    return finma_df
+    Returns:
+        Tuple (float32 matrix, article hashes, report dict with reused/embedded/removed counts)
+    """
+    hashes = article_hashes(df, model_name)
+    previous = {}
+    if previous_hashes is not None and previous_matrix is not None and len(previous_hashes) == len(previous_matrix):
+        for article_hash, vector in zip(previous_hashes, previous_matrix):
+            if article_hash not in previous and not np.isnan(vector).any():
+                previous[article_hash] = vector
+    
+    missing = [position for position, article_hash in enumerate(hashes) if article_hash not in previous]
+    matrix = None
+    if missing:
+        texts = build_article_texts(df)
+        new_vectors = (encoder or get_base_embeddings()).encode_batched(
+            [texts[position] for position in missing], batch_size=batch_size, precision="float32",
+            progress_callback=progress_callback
+        )
+        matrix = np.empty((len(hashes), new_vectors.shape[1]), dtype=np.float32)
+        matrix[missing] = new_vectors
+    
+    reused = [position for position, article_hash in enumerate(hashes) if article_hash in previous]
+    if reused:
+        if matrix is None:
+            dimension = len(next(iter(previous.values())))
+            matrix = np.empty((len(hashes), dimension), dtype=np.float32)
+        matrix[reused] = np.stack([previous[hashes[position]] for position in reused])
+    if matrix is None:
+        matrix = np.empty((0, 0), dtype=np.float32)
+    
+    report = {
+        "reused": len(reused),
+        "embedded": len(missing),
+        "removed": len(set(previous) - set(hashes))
+    }
+    return matrix, hashes, report
+
 
 def embed_documents(texts):
     """
@@ -52,7 +156,7 @@ def embed_documents(texts):
     Returns:
         List of embeddings
     """
-    return embeddings.embed_documents(texts)
+    return get_embeddings().embed_documents(texts)
 
 # Example usage for existing data
 if __name__ == "__main__":
@@ -0,0 +1,206 @@
+"""
+Persistent chunk-level embedding cache
+
+Document chunks are keyed by SHA-256 of (embedding model name, chunk text), so
+re-uploading the same or a lightly edited document only sends new or changed
+chunks through the embedding model.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from modules.model.open_source_llm import EMBED_BATCH_SIZE, EMBED_PRECISION, quantize_embeddings
+
+DEFAULT_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite3")
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_CHUNK = 500
+
+
+def make_embedding_key(text: str, model_name: str) -> str:
+    """
+    Build the cache key for one chunk
+
+    Args:
+        text: Chunk text (Document.page_content)
+        model_name: Embedding model name
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLite store of float32 embedding vectors keyed by content hash
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        """
+        Open (or create) the cache
+
+        Args:
+            path: SQLite file path
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                created REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Look up several vectors at once
+
+        Args:
+            keys: Keys from make_embedding_key
+
+        Returns:
+            Dictionary key -> float32 vector for the keys that were found
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), _LOOKUP_CHUNK):
+                chunk = unique_keys[start:start + _LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                for key, blob in self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ):
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def set_many(self, items: Dict[str, np.ndarray]):
+        """
+        Store several vectors
+
+        Args:
+            items: Dictionary key -> vector (stored as float32)
+        """
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, created) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """
+        Get hit/miss counters and entry count
+
+        Returns:
+            Dictionary with hits, misses and entries
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+class CachedEmbeddings:
+    """
+    Embeddings wrapper that only encodes chunks missing from an EmbeddingCache
+
+    Exposes the same embed_query / embed_documents / encode_batched interface as
+    the wrapped embeddings, so it can be handed to Chroma or InMemoryRetriever.
+    Other attributes (model, model_name, ...) are forwarded to the wrapped object.
+    """
+    def __init__(self, base, cache: EmbeddingCache):
+        """
+        Initialize the wrapper
+
+        Args:
+            base: Embeddings object with encode_batched (e.g. OpenSourceEmbeddings)
+            cache: EmbeddingCache instance
+        """
+        self.base = base
+        self.cache = cache
+        self.last_throughput = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.base, name)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Queries are embedded directly (they are not document chunks)"""
+        return self.base.embed_query(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents, reusing cached chunk vectors"""
+        return self.encode_batched(texts, precision="float32").tolist()
+
+    def encode_batched(self, texts: List[str], batch_size: int = EMBED_BATCH_SIZE, sort_by_length: bool = True,
+                       normalize: bool = False, precision: str = EMBED_PRECISION, progress_callback=None) -> np.ndarray:
+        """
+        Encode texts, sending only cache misses through the model
+
+        Arguments match OpenSourceEmbeddings.encode_batched. Normalized vectors
+        are derived from the cached raw vectors, so one cache entry serves both.
+
+        Returns:
+            Matrix of shape (len(texts), dimension)
+        """
+        texts = list(texts)
+        total = len(texts)
+        model_name = getattr(self.base, "model_name", "")
+        keys = [make_embedding_key(text, model_name) for text in texts]
+
+        start = time.perf_counter()
+        cached = self.cache.get_many(keys)
+        missing_positions = [i for i, key in enumerate(keys) if key not in cached]
+        done_before = total - len(missing_positions)
+
+        # Encode each distinct missing text once
+        missing_texts = list(dict.fromkeys(texts[i] for i in missing_positions))
+
+        def on_progress(done, _total, _rate):
+            if progress_callback:
+                rate = (done_before + done) / max(time.perf_counter() - start, 1e-9)
+                progress_callback(min(done_before + done, total - 1), total, rate)
+
+        if missing_texts:
+            encoded = self.base.encode_batched(
+                missing_texts, batch_size=batch_size, sort_by_length=sort_by_length,
+                precision="float32", progress_callback=on_progress
+            )
+            new_items = {make_embedding_key(text, model_name): vector for text, vector in zip(missing_texts, encoded)}
+            self.cache.set_many(new_items)
+            cached.update(new_items)
+
+        self.last_throughput = total / max(time.perf_counter() - start, 1e-9) if total else 0.0
+        if progress_callback and total:
+            progress_callback(total, total, self.last_throughput)
+
+        if not total:
+            dimension = self.base.get_sentence_embedding_dimension()
+            return quantize_embeddings(np.empty((0, dimension), dtype=np.float32), precision)
+
+        output = np.vstack([cached[key] for key in keys]).astype(np.float32)
+        if normalize:
+            norms = np.linalg.norm(output, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            output = output / norms
+        return quantize_embeddings(output, precision)
@@ -8,14 +8,72 @@ import pandas as pd
 import numpy as np
 from langchain_chroma import Chroma
 from langchain.schema.document import Document
-from modules.model.open_source_llm import create_embeddings, get_llm
-import streamlit as st
+from modules.llm_cache import make_cache_key
+from modules.resources import (
+    get_embeddings, get_llm_client, get_llm_cache, get_reranker, get_upload_index_manager, get_run_journal
+)
+from modules.run_journal import make_article_key, make_config_fingerprint, make_run_id
+from modules.token_budget import GAP_INPUT_TOKEN_BUDGET, adaptive_max_tokens, count_tokens, fit_chunks_to_budget
+from modules.upload_index import document_content_hash
+from modules.model.open_source_llm import EMBEDDING_MODEL
+from modules.regulation_store import load_regulation, regulation_embedding_model
+from modules.article_classifier import classify_by_rules
+from modules.retrieval import InMemoryRetriever
+from modules.progress import ProgressReporter, RowFeed
+from modules.structured_output import (
+    GAP_ROWS_TOOL_NAME, JsonRowParser, gap_rows_tool, normalize_covered, parse_row_items, validate_row
+)
 import os
 import ast
+import json
+import hashlib
+import time
+import tempfile
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-# Initialize embeddings and LLM
-embeddings = create_embeddings()
-llm = get_llm()
+# Embeddings, LLM client and LLM response cache are process-wide singletons
+# loaded on first use (see modules/resources.py), not at import time.
+
+GAP_TEMPERATURE = 0.2
+GAP_MAX_TOKENS = 3000
+
+# Number of articles sent to the LLM in parallel (1 = sequential)
+DEFAULT_MAX_WORKERS = int(os.getenv("GAP_ANALYSIS_MAX_WORKERS", "4"))
+# "threads" (one worker thread per in-flight article) or "async" (asyncio fan-out)
+DEFAULT_EXECUTION_MODE = os.getenv("GAP_ANALYSIS_EXECUTION_MODE", "threads").lower()
+# Retrieve from a persisted Chroma store instead of the in-memory matrix retriever
+DEFAULT_USE_CHROMA = os.getenv("GAP_ANALYSIS_USE_CHROMA", "false").lower() == "true"
+# Skip articles already checkpointed in the run journal by an interrupted earlier run
+DEFAULT_RESUME = os.getenv("GAP_ANALYSIS_RESUME", "true").lower() == "true"
+# Pack consecutive short articles under the same Title/SubTitle into one LLM request
+DEFAULT_BATCH_ARTICLES = os.getenv("GAP_BATCH_ARTICLES", "false").lower() == "true"
+GAP_BATCH_MAX_ARTICLES = int(os.getenv("GAP_BATCH_MAX_ARTICLES", "6"))
+GAP_BATCH_SHORT_ARTICLE_TOKENS = int(os.getenv("GAP_BATCH_SHORT_ARTICLE_TOKENS", "200"))
+# Stream LLM responses and report result rows while they arrive
+DEFAULT_STREAM = os.getenv("GAP_STREAM_RESPONSES", "true").lower() == "true"
+# How often streamed rows are handed to the progress reporter
+LIVE_ROWS_REFRESH_SECONDS = 0.5
+# "table" (pipe-delimited rows) or "json" (forced tool use with a JSON schema, validated and repaired)
+DEFAULT_OUTPUT_FORMAT = os.getenv("GAP_OUTPUT_FORMAT", "table").lower()
+# Completion budget per row when re-asking for rows that failed validation
+REPAIR_TOKENS_PER_ROW = 300
+# Article categories (modules/article_classifier.py) that are not sent to the LLM
+GAP_SKIP_CATEGORIES = {
+    category.strip().lower()
+    for category in os.getenv("GAP_SKIP_CATEGORIES", "definition,scope,abrogated").split(",") if category.strip()
+}
+RETRIEVAL_K = 4
+# Rerank the top GAP_RERANK_CANDIDATES bi-encoder hits with a cross-encoder and keep the top RETRIEVAL_K
+DEFAULT_RERANK = os.getenv("GAP_RERANK", "false").lower() == "true"
+GAP_RERANK_CANDIDATES = int(os.getenv("GAP_RERANK_CANDIDATES", "20"))
+# Articles whose best chunk similarity is below this get a templated "No" row without an
+# LLM call (0 = off; only with the in-memory retriever, which returns cosine scores)
+DEFAULT_SIMILARITY_GATE = float(os.getenv("GAP_SIMILARITY_GATE", "0"))
+# Percentage of gated articles still sent to the LLM to measure how often the gate is wrong
+DEFAULT_GATE_VERIFY_PERCENT = float(os.getenv("GAP_GATE_VERIFY_PERCENT", "10"))
+
+RESULT_HEADERS = ['Article', 'Article Content', 'Requirement', 'Covered', 'Reference in Document', 'Comment']
 
 
 def parse_embedding(embedding_str):
@@ -102,8 +160,8 @@ def split_docx_by_structure(file_path):
     return content
 
 
-def create_vectorstore(db_directory, split_content):
-    """Create ChromaDB vector store from document chunks"""
+def build_documents(split_content):
+    """Turn split document sections into langchain Documents (Title/SubTitle + content)"""
     documents = []
     
     for item in split_content:
@@ -133,52 +191,74 @@ def create_vectorstore(db_directory, split_content):
         )
         documents.append(doc)
     
+    return documents
+
+
+def create_vectorstore(db_directory, split_content):
+    """
+    Create ChromaDB vector store from document chunks in a new unique directory
+    
+    Note: the directory is never cleaned up; perform_gap_analysis uses
+    open_managed_vectorstore instead.
+    """
+    documents = build_documents(split_content)
+    
     # Create vector store - use a unique directory each time to avoid conflicts
-    import time
     import uuid
     unique_db_directory = f"{db_directory}_{uuid.uuid4().hex[:8]}"
     
     vectorstore = Chroma.from_documents(
         documents=documents,
-        embedding=embeddings,
+        embedding=get_embeddings(),
         persist_directory=unique_db_directory
     )
     
     return vectorstore
 
 
-def build_gap_prompt(retrieved_docs, article):
-    """Build professional prompt for comprehensive gap analysis with direct table output"""
-    concept_text = ''
-    for item in retrieved_docs:
-        concept_text += '\n' + item.page_content
+def open_managed_vectorstore(document_bytes, split_content):
+    """
+    Get a Chroma store for an uploaded document from the upload index manager
     
-    concept_text = concept_text.replace("Title: ", 'Section: ').replace(' SubTitle:', ' SubSection:')
+    The index is reused when the same document (and embedding model) was
+    indexed before, and is leased so the sweeper cannot delete it mid-run.
     
-    prompt = f"""You are an expert in market conduct regulation for banks and a senior regulatory compliance consultant conducting a professional gap analysis between a company's internal documentation and regulatory requirements.
+    Returns:
+        Tuple (vectorstore, lease id) - release the lease when done
+    """
+    embeddings = get_embeddings()
+    content_hash = document_content_hash(document_bytes, getattr(embeddings, "model_name", ""))
+    
+    def build(path):
+        Chroma.from_documents(
+            documents=build_documents(split_content),
+            embedding=embeddings,
+            persist_directory=path
+        )
+    
+    index_path, lease_id = get_upload_index_manager().acquire(content_hash, build)
+    vectorstore = Chroma(persist_directory=index_path, embedding_function=embeddings)
+    return vectorstore, lease_id
 
-**YOUR TASK:**
-Analyze the regulatory article below and identify EVERY requirement. For each requirement, evaluate whether the company's concept document adequately addresses it. Output your findings DIRECTLY in table format.
 
-**ANALYSIS CRITERIA:**
+# Prompt sections shared by the single-article and the multi-article gap prompts
+GAP_PROMPT_INTRO = """You are an expert in market conduct regulation for banks and a senior regulatory compliance consultant conducting a professional gap analysis between a company's internal documentation and regulatory requirements."""
+
+GAP_PROMPT_CRITERIA = """**ANALYSIS CRITERIA:**
 - "Yes" = Requirement is FULLY addressed with specific controls, procedures, or evidence
 - "Partial" = Requirement is mentioned but lacks sufficient detail, procedures, or implementation guidance
-- "No" = Requirement is NOT addressed or missing entirely
+- "No" = Requirement is NOT addressed or missing entirely"""
 
-**OUTPUT FORMAT:**
-Create a table with EXACTLY these columns (use | as separator):
-Requirement | Covered | Reference | Comment
-
-**COLUMN SPECIFICATIONS:**
+GAP_PROMPT_COLUMN_SPECS = """**COLUMN SPECIFICATIONS:**
 1. **Requirement**: Clear description of what the regulatory article requires (30-60 words). Be specific about WHAT must be done.
 2. **Covered**: Only use "Yes", "Partial", or "No"
 3. **Reference**: Exact section/subsection name from company document where requirement is addressed. Use "-" if not covered.
 4. **Comment**: DETAILED professional assessment (MINIMUM 30 words, aim for 40 words) explaining:
    - For "Yes": Describe HOW the requirement is met, WHICH controls/procedures/evidence exist, and WHERE in the document they are documented. Include specific details about implementation.
    - For "Partial": Explain in detail WHAT aspects are covered, reference specific sections, then clearly describe WHAT specific elements/details/procedures are missing or inadequate. Provide recommendations.
-   - For "No": Describe WHAT specific controls/procedures/documentation need to be implemented, WHY they are required by regulation, and provide actionable recommendations for compliance.
+   - For "No": Describe WHAT specific controls/procedures/documentation need to be implemented, WHY they are required by regulation, and provide actionable recommendations for compliance."""
 
-**QUALITY STANDARDS:**
+GAP_PROMPT_QUALITY = """**QUALITY STANDARDS:**
 - Comments MUST be detailed and comprehensive (minimum 30 words each)
 - Be specific and actionable in all assessments
 - Always reference exact sections from the company document
@@ -186,215 +266,1591 @@ Requirement | Covered | Reference | Comment
 - Write in professional business language suitable for executive review
 - Provide actionable recommendations where gaps exist
 - Each requirement must be on a separate row
-- NEVER use short phrases - always write full explanatory sentences
+- NEVER use short phrases - always write full explanatory sentences"""
+
+
+# Static instructions: sent as the (prompt-cached) system block, identical for every article
+GAP_SYSTEM_PROMPT = f"""{GAP_PROMPT_INTRO}
+
+**YOUR TASK:**
+Analyze the regulatory article below and identify EVERY requirement. For each requirement, evaluate whether the company's concept document adequately addresses it. Output your findings DIRECTLY in table format.
+
+{GAP_PROMPT_CRITERIA}
+
+**OUTPUT FORMAT:**
+Create a table with EXACTLY these columns (use | as separator):
+Requirement | Covered | Reference | Comment
+
+{GAP_PROMPT_COLUMN_SPECS}
+
+{GAP_PROMPT_QUALITY}"""
+
+BATCH_GAP_SYSTEM_PROMPT = f"""{GAP_PROMPT_INTRO}
+
+**YOUR TASK:**
+Analyze EACH of the regulatory articles below and identify EVERY requirement. For each requirement, evaluate whether the company's concept document adequately addresses it. Output your findings for all articles DIRECTLY in one table.
+
+{GAP_PROMPT_CRITERIA}
+
+**OUTPUT FORMAT:**
+Create a table with EXACTLY these columns (use | as separator):
+Margin | Requirement | Covered | Reference | Comment
+
+Start every row with the margin number of the article the requirement belongs to, exactly as written after "Margin" below. Every article must have at least one row.
+
+{GAP_PROMPT_COLUMN_SPECS}
+
+{GAP_PROMPT_QUALITY}"""
+
+# Structured output mode: the same instructions, but rows are recorded through the tool
+GAP_JSON_SYSTEM_PROMPT = f"""{GAP_PROMPT_INTRO}
+
+**YOUR TASK:**
+Analyze the regulatory article below and identify EVERY requirement. For each requirement, evaluate whether the company's concept document adequately addresses it. Record your findings with the {GAP_ROWS_TOOL_NAME} tool.
+
+{GAP_PROMPT_CRITERIA}
+
+**OUTPUT FORMAT:**
+Call the {GAP_ROWS_TOOL_NAME} tool with one entry in "rows" per requirement. Every entry has EXACTLY these fields:
+requirement, covered, reference, comment
+
+{GAP_PROMPT_COLUMN_SPECS}
+
+{GAP_PROMPT_QUALITY}"""
 
-**REGULATORY ARTICLE TO ANALYZE:**
+BATCH_GAP_JSON_SYSTEM_PROMPT = f"""{GAP_PROMPT_INTRO}
+
+**YOUR TASK:**
+Analyze EACH of the regulatory articles below and identify EVERY requirement. For each requirement, evaluate whether the company's concept document adequately addresses it. Record your findings for all articles with the {GAP_ROWS_TOOL_NAME} tool.
+
+{GAP_PROMPT_CRITERIA}
+
+**OUTPUT FORMAT:**
+Call the {GAP_ROWS_TOOL_NAME} tool with one entry in "rows" per requirement. Every entry has EXACTLY these fields:
+margin, requirement, covered, reference, comment
+
+Set margin to the margin number of the article the requirement belongs to, exactly as written after "Margin" below. Every article must have at least one entry.
+
+{GAP_PROMPT_COLUMN_SPECS}
+
+{GAP_PROMPT_QUALITY}"""
+
+# Last line of the per-request message, by output format
+GAP_MESSAGE_CLOSINGS = {
+    "table": "**OUTPUT YOUR GAP ANALYSIS TABLE BELOW (start immediately with data rows, no headers needed):**",
+    "json": f"**RECORD YOUR GAP ANALYSIS WITH THE {GAP_ROWS_TOOL_NAME} TOOL:**"
+}
+
+GAP_REPAIR_MESSAGE = """**REGULATORY ARTICLES:**
+{articles}
+
+**INCOMPLETE ENTRIES:**
+{entries}
+
+The entries above were recorded for these articles but are incomplete or invalid: covered must be exactly "Yes", "Partial" or "No", and every entry needs a reference ("-" if not covered) and a detailed comment{margin_rule}. Record the corrected entries with the {tool} tool. Keep every requirement as written and do not add other requirements."""
+
+
+def gap_system_prompt(output_format="table", multi_article=False):
+    """Static instructions for the output format (table or json) and request kind"""
+    if output_format == "json":
+        return BATCH_GAP_JSON_SYSTEM_PROMPT if multi_article else GAP_JSON_SYSTEM_PROMPT
+    return BATCH_GAP_SYSTEM_PROMPT if multi_article else GAP_SYSTEM_PROMPT
+
+
+def analysis_fingerprint(output_format, batch_articles, rerank, similarity_gate, gate_verify_percent, use_chroma):
+    """
+    Fingerprint of everything besides document, regulation and model that shapes a run's results
+
+    Part of the default run ID, so a changed setting or prompt template never resumes
+    checkpoints written under the old one.
+    """
+    settings = {
+        "output_format": output_format,
+        "batch_articles": bool(batch_articles),
+        "batch_max_articles": GAP_BATCH_MAX_ARTICLES,
+        "batch_short_article_tokens": GAP_BATCH_SHORT_ARTICLE_TOKENS,
+        "rerank": bool(rerank),
+        "rerank_candidates": GAP_RERANK_CANDIDATES,
+        "similarity_gate": similarity_gate,
+        "gate_verify_percent": gate_verify_percent,
+        "use_chroma": bool(use_chroma),
+        "retrieval_k": RETRIEVAL_K,
+        "input_token_budget": GAP_INPUT_TOKEN_BUDGET,
+        "temperature": GAP_TEMPERATURE,
+        "skip_categories": sorted(GAP_SKIP_CATEGORIES)
+    }
+    return make_config_fingerprint(
+        settings,
+        gap_system_prompt(output_format), gap_system_prompt(output_format, multi_article=True),
+        render_gap_message([], "", output_format), render_batch_gap_message([], [], output_format),
+        GAP_REPAIR_MESSAGE
+    )
+
+
+def build_gap_prompt(retrieved_docs, article):
+    """Build professional prompt for comprehensive gap analysis with direct table output"""
+    return render_gap_prompt([item.page_content for item in retrieved_docs], article)
+
+
+def build_concept_text(chunk_texts):
+    """Join company document chunks for the prompt, labelling their headings as sections"""
+    concept_text = ''
+    for text in chunk_texts:
+        concept_text += '\n' + text
+    
+    return concept_text.replace("Title: ", 'Section: ').replace(' SubTitle:', ' SubSection:')
+
+
+def render_gap_message(chunk_texts, article, output_format="table"):
+    """Per-article part of the gap prompt: the article and the retrieved company document chunks"""
+    concept_text = build_concept_text(chunk_texts)
+    
+    message = f"""**REGULATORY ARTICLE TO ANALYZE:**
 {article}
 
 **COMPANY CONCEPT DOCUMENT:**
 {concept_text}
 
-**OUTPUT YOUR GAP ANALYSIS TABLE BELOW (start immediately with data rows, no headers needed):**"""
+{GAP_MESSAGE_CLOSINGS[output_format]}"""
+    
+    return message
+
+
+def render_gap_prompt(chunk_texts, article):
+    """Full single-string gap prompt (system instructions followed by the article message)"""
+    return GAP_SYSTEM_PROMPT + '\n\n' + render_gap_message(chunk_texts, article)
+
+
+def render_batch_gap_message(chunk_texts, batch_articles, output_format="table"):
+    """
+    Per-request part of the multi-article gap prompt; every output row starts with its margin
+    
+    Args:
+        chunk_texts: Company document chunks (deduplicated across the articles)
+        batch_articles: List of (margin, article text)
+        output_format: "table" or "json"
+    """
+    concept_text = build_concept_text(chunk_texts)
+    articles_text = '\n\n'.join(f"Margin {margin}:\n{article}" for margin, article in batch_articles)
+    
+    message = f"""**REGULATORY ARTICLES TO ANALYZE:**
+{articles_text}
+
+**COMPANY CONCEPT DOCUMENT:**
+{concept_text}
+
+{GAP_MESSAGE_CLOSINGS[output_format]}"""
     
-    return prompt
+    return message
+
+
+def render_batch_gap_prompt(chunk_texts, batch_articles):
+    """Full single-string multi-article gap prompt"""
+    return BATCH_GAP_SYSTEM_PROMPT + '\n\n' + render_batch_gap_message(chunk_texts, batch_articles)
+
+
+def prepare_gap_request(retrieved_docs, article, input_token_budget=GAP_INPUT_TOKEN_BUDGET, output_format="table"):
+    """
+    Build the gap prompt within the input token budget and size max_tokens to the article
+    
+    The least relevant retrieved chunks are dropped (or the last kept one is
+    truncated) until template + article + chunks fit into input_token_budget.
+    
+    Args:
+        retrieved_docs: Retrieved Documents, most relevant first
+        article: Full article text
+        input_token_budget: Token budget for the whole prompt (0 = no limit)
+        output_format: "table" or "json"
+        
+    Returns:
+        Tuple (system instructions, per-article message, max_tokens,
+        stats dict with estimated_prompt_tokens, dropped_chunks, truncated_chunks)
+    """
+    system = gap_system_prompt(output_format)
+    chunk_texts = [doc.page_content for doc in retrieved_docs]
+    dropped = truncated = 0
+    if input_token_budget and input_token_budget > 0:
+        overhead = count_tokens(system) + count_tokens(render_gap_message([], article, output_format))
+        chunk_texts, dropped, truncated = fit_chunks_to_budget(chunk_texts, input_token_budget - overhead)
+    
+    message = render_gap_message(chunk_texts, article, output_format)
+    stats = {
+        "estimated_prompt_tokens": count_tokens(system) + count_tokens(message),
+        "dropped_chunks": dropped,
+        "truncated_chunks": truncated
+    }
+    return system, message, adaptive_max_tokens(article, GAP_MAX_TOKENS), stats
+
+
+def merge_contexts(contexts):
+    """
+    Union of several retrieved Document lists without duplicates
+    
+    Documents are interleaved by rank (every article's best chunk first), so
+    trimming to the token budget drops the least relevant chunks of all articles.
+    """
+    merged = []
+    seen = set()
+    for rank in range(max((len(docs) for docs in contexts), default=0)):
+        for docs in contexts:
+            if rank < len(docs) and docs[rank].page_content not in seen:
+                seen.add(docs[rank].page_content)
+                merged.append(docs[rank])
+    return merged
+
+
+def prepare_batch_gap_request(batch, input_token_budget=GAP_INPUT_TOKEN_BUDGET, output_format="table"):
+    """
+    Multi-article counterpart of prepare_gap_request
+    
+    Args:
+        batch: List of (margin, full_text, retrieved_docs)
+        input_token_budget: Token budget for the whole prompt (0 = no limit)
+        output_format: "table" or "json"
+        
+    Returns:
+        Tuple (system instructions, message, max_tokens, stats dict)
+    """
+    system = gap_system_prompt(output_format, multi_article=True)
+    batch_articles = [(margin, full_text) for margin, full_text, _ in batch]
+    chunk_texts = [doc.page_content for doc in merge_contexts([docs for _, _, docs in batch])]
+    dropped = truncated = 0
+    if input_token_budget and input_token_budget > 0:
+        overhead = count_tokens(system) + count_tokens(render_batch_gap_message([], batch_articles, output_format))
+        chunk_texts, dropped, truncated = fit_chunks_to_budget(chunk_texts, input_token_budget - overhead)
+    
+    message = render_batch_gap_message(chunk_texts, batch_articles, output_format)
+    stats = {
+        "estimated_prompt_tokens": count_tokens(system) + count_tokens(message),
+        "dropped_chunks": dropped,
+        "truncated_chunks": truncated
+    }
+    all_text = '\n'.join(full_text for _, full_text in batch_articles)
+    return system, message, adaptive_max_tokens(all_text, GAP_MAX_TOKENS), stats
+
+
+def prepare_repair_request(batch_articles, broken_rows, multi_article=False):
+    """
+    Build a follow-up request for the rows that failed validation only
+    
+    The request carries the articles and the broken entries but no document
+    context, so it costs a fraction of re-running the articles. It shares the
+    system instructions (and their prompt-cache entry) with the original request.
+    
+    Args:
+        batch_articles: List of (margin, article text) of the original request
+        broken_rows: Validated row dicts with status "broken"
+        multi_article: The original request covered several articles (rows carry a margin)
+        
+    Returns:
+        Tuple (system instructions, message, max_tokens)
+    """
+    articles_text = '\n\n'.join(f"Margin {margin}:\n{article}" for margin, article in batch_articles)
+    entries = json.dumps({"rows": broken_rows}, ensure_ascii=False, indent=1)
+    message = GAP_REPAIR_MESSAGE.format(
+        articles=articles_text, entries=entries, tool=GAP_ROWS_TOOL_NAME,
+        margin_rule=' and the margin of its article' if multi_article else ''
+    )
+    max_tokens = min(GAP_MAX_TOKENS, REPAIR_TOKENS_PER_ROW * (len(broken_rows) + 1))
+    return gap_system_prompt("json", multi_article), message, max_tokens
+
+
+def plan_article_batches(articles, max_articles=GAP_BATCH_MAX_ARTICLES,
+                         short_article_tokens=GAP_BATCH_SHORT_ARTICLE_TOKENS):
+    """
+    Group consecutive short articles that share a heading
+    
+    Args:
+        articles: List of (full_text, heading) in regulation order
+        max_articles: Maximum number of articles per group
+        short_article_tokens: Articles longer than this are always analyzed alone
+        
+    Returns:
+        List of index lists covering every article once, in order
+    """
+    groups = []
+    current = []
+    for index, (full_text, heading) in enumerate(articles):
+        if count_tokens(full_text) > short_article_tokens:
+            if current:
+                groups.append(current)
+                current = []
+            groups.append([index])
+            continue
+        
+        if current and (len(current) >= max_articles or articles[current[-1]][1] != heading):
+            groups.append(current)
+            current = []
+        current.append(index)
+    
+    if current:
+        groups.append(current)
+    return groups
 
 
 # Removed build_table_prompt - now using direct table output in build_gap_prompt
 
 
+def parse_table_line(margin, article, line):
+    """
+    Parse one "Requirement | Covered | Reference | Comment" line of an LLM response
+    
+    Returns:
+        Result row, or None for headers, separators and lines that are not table rows
+    """
+    line = line.strip()
+    if not line or '|' not in line:
+        return None
+    
+    # Skip header lines (case insensitive)
+    line_lower = line.lower()
+    if ('requirement' in line_lower and 'covered' in line_lower) or \
+       ('---' in line or '===' in line or '___' in line):
+        return None
+    
+    # Split by | and handle cases with more than 4 parts (comment might contain |)
+    parts = line.split('|')
+    if len(parts) < 4:
+        return None
+    
+    requirement = parts[0].strip()
+    covered = parts[1].strip()
+    reference = parts[2].strip()
+    
+    # Join remaining parts as comment (in case comment contains |)
+    comment = '|'.join(parts[3:]).strip()
+    
+    # Skip empty requirements
+    if not requirement or len(requirement) < 5:
+        return None
+    
+    # Normalize coverage values
+    return make_result_row(margin, article, requirement, normalize_covered(covered), reference, comment)
+
+
+def make_result_row(margin, article, requirement, covered, reference, comment):
+    """One result row in RESULT_HEADERS order"""
+    return [
+        margin,                    # Article number
+        article[:300],             # Article content (300 chars for context)
+        requirement,               # Requirement description
+        covered,                   # Coverage status (Yes/Partial/No)
+        reference if reference != '-' else '',  # Reference in document
+        comment                    # Detailed comment
+    ]
+
+
 def extract_table_from_text(margin, article, table_response):
     """Extract table data from LLM response with improved parsing"""
     rows = []
+    for line in table_response.strip().split('\n'):
+        row = parse_table_line(margin, article, line)
+        if row is not None:
+            rows.append(row)
+    return rows
+
+
+def _normalize_margin(value):
+    """Margin cell as written by the model (e.g. "**Margin 12.**") -> comparable key ("12")"""
+    value = value.strip().strip('*').strip()
+    for prefix in ('margin', 'art.', 'article'):
+        if value.lower().startswith(prefix):
+            value = value[len(prefix):].strip()
+    return value.rstrip('.:').strip().lower()
+
+
+def margin_index(batch_articles):
+    """Normalized margin -> position in batch_articles"""
+    return {_normalize_margin(str(margin)): index for index, (margin, _) in enumerate(batch_articles)}
+
+
+def batch_line_parser(batch_articles):
+    """
+    Line parser for multi-article responses ("Margin | Requirement | Covered | Reference | Comment")
     
-    # Split response into lines
-    lines = table_response.strip().split('\n')
+    Args:
+        batch_articles: List of (margin, article text) sent in the request
+        
+    Returns:
+        Function mapping one response line to (index into batch_articles, row), or None
+        for lines that are not rows of a requested article
+    """
+    index_by_margin = margin_index(batch_articles)
     
-    for line in lines:
+    def parse_line(line):
         line = line.strip()
-        if not line or '|' not in line:
-            continue
+        if line.startswith('|'):
+            line = line[1:]
+        if '|' not in line:
+            return None
         
-        # Skip header lines (case insensitive)
-        line_lower = line.lower()
-        if ('requirement' in line_lower and 'covered' in line_lower) or \
-           ('---' in line or '===' in line or '___' in line):
-            continue
+        margin_cell, rest = line.split('|', 1)
+        index = index_by_margin.get(_normalize_margin(margin_cell))
+        if index is None:
+            return None
+        # Markdown-style rows also end with a separator
+        margin, article = batch_articles[index]
+        row = parse_table_line(margin, article, rest.rstrip().rstrip('|'))
+        return (index, row) if row is not None else None
+    
+    return parse_line
+
+
+def extract_batch_table_from_text(batch_articles, table_response):
+    """
+    Split a multi-article response into rows per article using the Margin column
+    
+    Args:
+        batch_articles: List of (margin, article text) sent in the request
+        table_response: LLM response with "Margin | Requirement | Covered | Reference | Comment" rows
         
-        # Split by | and handle cases with more than 4 parts (comment might contain |)
-        parts = line.split('|')
+    Returns:
+        List of row lists aligned with batch_articles (empty for articles the model skipped)
+    """
+    rows_per_article = [[] for _ in batch_articles]
+    parse_line = batch_line_parser(batch_articles)
+    for line in table_response.strip().split('\n'):
+        parsed = parse_line(line)
+        if parsed is not None:
+            rows_per_article[parsed[0]].append(parsed[1])
+    return rows_per_article
+
+
+def place_json_row(batch_articles, index_by_margin, item, multi_article=False):
+    """
+    Validate one tool-use row object and assign it to its article
+    
+    Args:
+        batch_articles: List of (margin, article text) of the request
+        index_by_margin: margin_index(batch_articles)
+        item: Row object from the tool input
+        multi_article: Rows carry a margin (otherwise they belong to the only article)
         
-        if len(parts) >= 4:
-            requirement = parts[0].strip()
-            covered = parts[1].strip()
-            reference = parts[2].strip()
-            
-            # Join remaining parts as comment (in case comment contains |)
-            comment = '|'.join(parts[3:]).strip()
-            
-            # Skip empty requirements
-            if not requirement or len(requirement) < 5:
-                continue
-            
-            # Normalize coverage values
-            covered_normalized = covered
-            if covered.lower() in ['yes', 'y', 'full', 'fully covered']:
-                covered_normalized = 'Yes'
-            elif covered.lower() in ['partial', 'partially', 'p', 'partly']:
-                covered_normalized = 'Partial'
-            elif covered.lower() in ['no', 'n', 'missing', 'not covered']:
-                covered_normalized = 'No'
-            
-            rows.append([
-                margin,                    # Article number
-                article[:300],             # Article content (300 chars for context)
-                requirement,               # Requirement description
-                covered_normalized,        # Coverage status (Yes/Partial/No)
-                reference if reference != '-' else '',  # Reference in document
-                comment                    # Detailed comment
-            ])
+    Returns:
+        Tuple (article index, result row, validated fields, status) with the status of
+        validate_row; a row of an unknown article is "dropped" unless it is "broken"
+        (the repair request may still fix its margin)
+    """
+    fields, status = validate_row(item, multi_article)
+    if status == "dropped":
+        return None, None, None, status
+    index = index_by_margin.get(_normalize_margin(fields.get('margin', ''))) if multi_article else 0
+    if status == "broken":
+        return index, None, fields, status
+    if index is None:
+        return None, None, fields, "dropped"
+    margin, article = batch_articles[index]
+    row = make_result_row(
+        margin, article, fields['requirement'], fields['covered'], fields['reference'], fields['comment']
+    )
+    return index, row, fields, status
+
+
+def new_parse_stats():
+    """Per-request output parsing counters"""
+    return {
+        "parse_failures": 0, "salvaged_rows": 0, "repaired_rows": 0, "dropped_rows": 0,
+        "reasked_rows": 0, "repair_requests": 0
+    }
+
+
+def extract_json_rows(batch_articles, response, multi_article=False):
+    """
+    Rows per article from a tool-use (JSON) response
     
-    return rows
+    Args:
+        batch_articles: List of (margin, article text) of the request
+        response: JSON tool input returned by the LLM client
+        multi_article: Rows carry a margin
+        
+    Returns:
+        Tuple (row lists aligned with batch_articles, broken row dicts to re-ask, parse stats)
+    """
+    items, parse_failed = parse_row_items(response)
+    stats = new_parse_stats()
+    stats["parse_failures"] = int(parse_failed)
+    index_by_margin = margin_index(batch_articles)
+    rows_per_article = [[] for _ in batch_articles]
+    broken = []
+    for item in items:
+        index, row, fields, status = place_json_row(batch_articles, index_by_margin, item, multi_article)
+        if status == "dropped":
+            stats["dropped_rows"] += 1
+        elif status == "broken":
+            broken.append(fields)
+        else:
+            rows_per_article[index].append(row)
+            stats["repaired_rows"] += int(status == "repaired")
+            stats["salvaged_rows"] += int(parse_failed)
+    return rows_per_article, broken, stats
+
+
+def extract_rows(batch_articles, response, output_format="table", multi_article=False):
+    """
+    Rows per article from a gap analysis response in either output format
+    
+    A table response counts as a parse failure when it yields no row at all.
+    
+    Returns:
+        Tuple (row lists aligned with batch_articles, broken row dicts to re-ask, parse stats)
+    """
+    if output_format == "json":
+        return extract_json_rows(batch_articles, response, multi_article)
+    
+    if multi_article:
+        rows_per_article = extract_batch_table_from_text(batch_articles, response)
+    else:
+        margin, article = batch_articles[0]
+        rows_per_article = [extract_table_from_text(margin, article, response)]
+    stats = new_parse_stats()
+    stats["parse_failures"] = int(not any(rows_per_article))
+    return rows_per_article, [], stats
 
 
-def perform_gap_analysis(uploaded_file, regulation_file, regulation_name):
+def merge_repaired_rows(rows_per_article, parse_stats, batch_articles, broken, repair_response, multi_article=False):
     """
-    Main function to perform gap analysis
+    Add the rows of a repair response; rows that are still invalid are dropped
     
     Args:
-        uploaded_file: Streamlit uploaded file object (company document)
-        regulation_file: Path to regulation Excel file
-        regulation_name: Name of the regulation
+        rows_per_article: Row lists of the original response (extended in place)
+        parse_stats: Parse stats of the original response (updated in place)
+        batch_articles: List of (margin, article text) of the request
+        broken: The broken row dicts that were re-asked
+        repair_response: JSON tool input of the repair request
+        multi_article: Rows carry a margin
+    """
+    repaired_rows, still_broken, repair_stats = extract_json_rows(batch_articles, repair_response, multi_article)
+    for rows, repaired in zip(rows_per_article, repaired_rows):
+        rows.extend(repaired)
+    parse_stats["reasked_rows"] += len(broken)
+    parse_stats["repaired_rows"] += repair_stats["repaired_rows"]
+    parse_stats["dropped_rows"] += repair_stats["dropped_rows"] + len(still_broken)
+
+
+class IncrementalRowParser:
+    """
+    Turns a streamed LLM response into table rows as soon as each line is complete
+    
+    Text deltas are buffered until a newline arrives; every complete line goes
+    through parse_line and non-None results are passed to on_row. The rows are
+    a live preview only - the final rows are parsed from the full response.
+    """
+    def __init__(self, parse_line, on_row, on_restart=None):
+        """
+        Args:
+            parse_line: Function mapping one response line to a result (or None to skip the line)
+            on_row: Called with every non-None parse_line result
+            on_restart: Called when the response starts over (retried request)
+        """
+        self.parse_line = parse_line
+        self.on_row = on_row
+        self.on_restart = on_restart
+        self._buffer = ''
+    
+    def feed(self, text):
+        """Add a text delta and emit the rows of all lines it completes"""
+        if '\n' not in text:
+            self._buffer += text
+            return
+        lines = (self._buffer + text).split('\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            self._emit(line)
+    
+    def close(self):
+        """Emit the last line (responses usually do not end with a newline)"""
+        line, self._buffer = self._buffer, ''
+        self._emit(line)
+    
+    def restart(self):
+        """Discard the partial response; the rows emitted so far are withdrawn through on_restart"""
+        self._buffer = ''
+        if self.on_restart:
+            self.on_restart()
+    
+    def _emit(self, line):
+        result = self.parse_line(line)
+        if result is not None:
+            self.on_row(result)
+
+
+def article_heading(row):
+    """Title/SubTitle of a regulation row - articles are only batched under the same heading"""
+    return (str(row.get('Title', '')), str(row.get('SubTitle', '')))
+
+
+def build_article_text(row):
+    """Combine Title/SubTitle/Sub_Subtitle/Text of a regulation row into one article text"""
+    title = str(row.get('Title', ''))
+    sub_title = str(row.get('SubTitle', ''))
+    sub_subtitle = str(row.get('Sub_Subtitle', ''))
+    text = row.get('Text', '')
+    
+    full_text = ''
+    if title and title not in ['None', 'nan', '']:
+        full_text = title
+    if sub_title and sub_title not in ['None', 'nan', '']:
+        full_text = full_text + '\n' + sub_title if full_text else sub_title
+    if sub_subtitle and sub_subtitle not in ['None', 'nan', '']:
+        full_text = full_text + '\n' + sub_subtitle if full_text else sub_subtitle
+    full_text = full_text + '\n' + text if full_text else text
+    
+    return full_text
+
+
+def _cache_lookup(prompt, max_tokens, system=None):
+    """Return (cache_key, cached_response) for a gap prompt; both None when caching is off"""
+    llm_cache = get_llm_cache()
+    if llm_cache is None:
+        return None, None
+    # Keyed on the full prompt text, the same as when it was sent as one message
+    full_prompt = system + '\n\n' + prompt if system else prompt
+    key = make_cache_key(full_prompt, get_llm_client().model, GAP_TEMPERATURE, max_tokens)
+    return key, llm_cache.get(key)
+
+
+def _cache_store(key, response, usage, max_tokens):
+    """Store a successful LLM response in the cache"""
+    # A cut-off answer under a reduced (adaptive) limit is re-asked, so it is not worth keeping
+    if usage.get("stop_reason") == "max_tokens" and max_tokens < GAP_MAX_TOKENS:
+        return
+    if key is not None and response and not response.startswith("Error:"):
+        get_llm_cache().set(key, response)
+
+
+# Usage reported for answers served from the response cache (no API tokens spent)
+CACHED_USAGE = {
+    "input_tokens": 0, "output_tokens": 0, "cache_read_tokens": 0, "cache_write_tokens": 0,
+    "stop_reason": None, "cached": True
+}
+
+
+def ask_llm_with_retry(prompt, max_tokens=GAP_MAX_TOKENS, system=None, parser=None, tool=None):
+    """
+    Call the LLM (or return the cached answer)
+    
+    Rate limiting, backoff and retries of 429/5xx/connection errors are handled
+    by the client's shared scheduler (modules/model/rate_limiter.py). The static
+    instructions go in system, which the Anthropic client marks for prompt caching.
+    With a parser the response is streamed and fed to it as it arrives. With a
+    tool definition the model is forced to call it and the response is its JSON input.
+    
+    Returns:
+        Tuple (response text, usage dict with input_tokens, output_tokens and stop_reason)
+    """
+    key, cached = _cache_lookup(prompt, max_tokens, system)
+    if cached is not None:
+        if parser is not None:
+            parser.feed(cached)
+            parser.close()
+        return cached, dict(CACHED_USAGE)
+    
+    if parser is None:
+        response, usage = get_llm_client().ask_llm_with_usage(
+            prompt, temperature=GAP_TEMPERATURE, max_tokens=max_tokens, system=system, tool=tool
+        )
+    else:
+        response, usage = get_llm_client().stream_llm_with_usage(
+            prompt, temperature=GAP_TEMPERATURE, max_tokens=max_tokens, system=system,
+            on_text=parser.feed, on_restart=parser.restart, tool=tool
+        )
+        parser.close()
+    
+    _cache_store(key, response, usage, max_tokens)
+    return response, usage
+
+
+async def ask_llm_with_retry_async(prompt, max_tokens=GAP_MAX_TOKENS, system=None, parser=None, tool=None):
+    """Async twin of ask_llm_with_retry using the pooled async LLM client"""
+    key, cached = _cache_lookup(prompt, max_tokens, system)
+    if cached is not None:
+        if parser is not None:
+            parser.feed(cached)
+            parser.close()
+        return cached, dict(CACHED_USAGE)
+    
+    if parser is None:
+        response, usage = await get_llm_client().ask_llm_with_usage_async(
+            prompt, temperature=GAP_TEMPERATURE, max_tokens=max_tokens, system=system, tool=tool
+        )
+    else:
+        response, usage = await get_llm_client().stream_llm_with_usage_async(
+            prompt, temperature=GAP_TEMPERATURE, max_tokens=max_tokens, system=system,
+            on_text=parser.feed, on_restart=parser.restart, tool=tool
+        )
+        parser.close()
+    
+    _cache_store(key, response, usage, max_tokens)
+    return response, usage
+
+
+def article_row_parser(margin, full_text, on_row=None, on_restart=None, output_format="table"):
+    """Streaming parser for a single-article response, or None when nobody consumes streamed rows"""
+    if on_row is None:
+        return None
+    if output_format == "json":
+        batch_articles = [(margin, full_text)]
+        index_by_margin = margin_index(batch_articles)
         
+        def on_item(item):
+            _, row, _, _ = place_json_row(batch_articles, index_by_margin, item)
+            if row is not None:
+                on_row(row)
+        
+        return JsonRowParser(on_item, on_restart)
+    return IncrementalRowParser(lambda line: parse_table_line(margin, full_text, line), on_row, on_restart)
+
+
+def batch_row_parser(batch, on_row=None, on_restart=None, output_format="table"):
+    """
+    Streaming parser for a multi-article response, or None when nobody consumes streamed rows
+    
+    on_row is called as (index into batch, row), on_restart with the batch indices to withdraw.
+    """
+    if on_row is None:
+        return None
+    batch_articles = [(margin, full_text) for margin, full_text, _ in batch]
+    restart = (lambda: on_restart(range(len(batch)))) if on_restart else None
+    if output_format == "json":
+        index_by_margin = margin_index(batch_articles)
+        
+        def on_item(item):
+            index, row, _, _ = place_json_row(batch_articles, index_by_margin, item, multi_article=True)
+            if row is not None:
+                on_row(index, row)
+        
+        return JsonRowParser(on_item, restart)
+    return IncrementalRowParser(batch_line_parser(batch_articles), lambda parsed: on_row(*parsed), restart)
+
+
+def _fallback_callbacks(index, on_row, on_restart):
+    """Streaming callbacks of a batch, narrowed to the separate request for one of its articles"""
+    if on_row is None:
+        return None, None
+    return (lambda row: on_row(index, row)), ((lambda: on_restart([index])) if on_restart else None)
+
+
+def repair_broken_rows(rows_per_article, parse_stats, batch_articles, broken, multi_article=False):
+    """
+    Re-ask for the rows that failed validation (see prepare_repair_request)
+    
     Returns:
-        DataFrame with gap analysis results
+        Usage dict of the repair request
+    """
+    system, message, max_tokens = prepare_repair_request(batch_articles, broken, multi_article)
+    response, usage = ask_llm_with_retry(message, max_tokens, system, tool=gap_rows_tool(multi_article))
+    merge_repaired_rows(rows_per_article, parse_stats, batch_articles, broken, response, multi_article)
+    return usage
+
+
+async def repair_broken_rows_async(rows_per_article, parse_stats, batch_articles, broken, multi_article=False):
+    """Async twin of repair_broken_rows"""
+    system, message, max_tokens = prepare_repair_request(batch_articles, broken, multi_article)
+    response, usage = await ask_llm_with_retry_async(message, max_tokens, system, tool=gap_rows_tool(multi_article))
+    merge_repaired_rows(rows_per_article, parse_stats, batch_articles, broken, response, multi_article)
+    return usage
+
+
+def article_usage(margin, max_tokens, prompt_stats, usage, output_retries, articles_in_request=1, parse_stats=None):
+    """Per-request token and parsing record (actual usage, or the estimate for cached answers)"""
+    prompt_tokens = usage.get("input_tokens")
+    record = {
+        "article": margin,
+        "articles_in_request": articles_in_request,
+        "prompt_tokens": prompt_tokens if prompt_tokens is not None else prompt_stats["estimated_prompt_tokens"],
+        "completion_tokens": usage.get("output_tokens") or 0,
+        "cache_read_tokens": usage.get("cache_read_tokens") or 0,
+        "cache_write_tokens": usage.get("cache_write_tokens") or 0,
+        "estimated_prompt_tokens": prompt_stats["estimated_prompt_tokens"],
+        "max_tokens": max_tokens,
+        "dropped_chunks": prompt_stats["dropped_chunks"],
+        "truncated_chunks": prompt_stats["truncated_chunks"],
+        "output_retries": output_retries,
+        "fallback_articles": 0,
+        "cached": bool(usage.get("cached"))
+    }
+    record.update(parse_stats or new_parse_stats())
+    return record
+
+
+def _add_fallback_usage(record, single_usage):
+    """Count a skipped article's separate request into its batch's usage record"""
+    record["prompt_tokens"] += single_usage["prompt_tokens"]
+    record["completion_tokens"] += single_usage["completion_tokens"]
+    record["cache_read_tokens"] += single_usage["cache_read_tokens"]
+    record["cache_write_tokens"] += single_usage["cache_write_tokens"]
+    record["fallback_articles"] += 1
+    for key in new_parse_stats():
+        record[key] += single_usage[key]
+
+
+def _add_repair_usage(record, usage):
+    """Count a repair request into the usage record of the request it repaired"""
+    record["prompt_tokens"] += usage.get("input_tokens") or 0
+    record["completion_tokens"] += usage.get("output_tokens") or 0
+    record["cache_read_tokens"] += usage.get("cache_read_tokens") or 0
+    record["cache_write_tokens"] += usage.get("cache_write_tokens") or 0
+    record["repair_requests"] += int(not usage.get("cached"))
+
+
+def retrieve_contexts(retriever, article_embeddings, k=RETRIEVAL_K, with_scores=False):
     """
+    Retrieve the top-k document chunks for every article
     
-    # Save uploaded file temporarily
-    temp_file_path = f"temp_uploaded_document.docx"
-    with open(temp_file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    Args:
+        retriever: InMemoryRetriever (one batched matmul) or a Chroma vector store
+        article_embeddings: List of article embedding vectors
+        k: Number of chunks per article
+        with_scores: Also return the best cosine similarity per article
+        
+    Returns:
+        List of Document lists, aligned with article_embeddings; with_scores returns a tuple
+        (contexts, best scores) where a score is None when unknown (Chroma, empty document)
+    """
+    if not article_embeddings:
+        return ([], []) if with_scores else []
     
-    # Progress tracking
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    # Step 1: Parse uploaded document
-    status_text.text("Parsing uploaded document...")
-    split_content = split_docx_by_structure(temp_file_path)
-    progress_bar.progress(10)
-    
-    # Step 2: Create vector store
-    status_text.text("Creating document embeddings...")
-    db_directory = "vectorestores/chroma_db_temp_upload"
-    vectorstore = create_vectorstore(db_directory, split_content)
-    vectorstore_directory = vectorstore._persist_directory  # Store the actual directory path
-    progress_bar.progress(30)
-    
-    # Step 3: Load regulation data
-    status_text.text(f"Loading {regulation_name} regulation...")
-    df_regulation = pd.read_excel(regulation_file)
-    df_regulation['Embedding'] = df_regulation['Embedding'].apply(parse_embedding)
-    progress_bar.progress(40)
-    
-    # Step 4: Perform gap analysis
-    status_text.text("Analyzing gaps with Claude AI...")
-    
-    headers = ['Article', 'Article Content', 'Requirement', 'Covered', 'Reference in Document', 'Comment']
-    all_rows = []
-    
-    total_articles = len(df_regulation)
-    
-    for index, row in df_regulation.iterrows():
-        # Extract article information
-        title = str(row.get('Title', ''))
-        sub_title = str(row.get('SubTitle', ''))
-        sub_subtitle = str(row.get('Sub_Subtitle', ''))
-        margin = str(row.get('Margin', ''))
-        text = row.get('Text', '')
-        embedded_item = row.get('Embedding', None)
-        
-        # Skip abrogated articles
-        if text == 'Abrogated' or text == 'abrogated':
-            continue
+    if isinstance(retriever, InMemoryRetriever):
+        contexts, scores = retriever.retrieve_batch(np.vstack(article_embeddings), k=k)
+        if not with_scores:
+            return contexts
+        best_scores = [float(row[0]) if len(row) else None for row in scores]
+        return contexts, best_scores
+    
+    contexts = [
+        retriever.similarity_search_by_vector(embedding=np.asarray(embedding).tolist(), k=k)
+        for embedding in article_embeddings
+    ]
+    return (contexts, [None for _ in contexts]) if with_scores else contexts
+
+
+def rerank_contexts(reranker, queries, contexts, k=RETRIEVAL_K):
+    """
+    Rerank retrieved chunks with a cross-encoder and keep the best k per article
+    
+    The (article, chunk) pairs of all articles are scored in one call, so the
+    cross-encoder runs in large batches instead of one small batch per article.
+    
+    Args:
+        reranker: CrossEncoderReranker (score_pairs)
+        queries: Article texts, aligned with contexts
+        contexts: Candidate Document lists (bi-encoder top-N) per article
+        k: Number of chunks kept per article
         
-        # Build full article text
-        full_text = ''
-        if title and title not in ['None', 'nan', '']:
-            full_text = title
-        if sub_title and sub_title not in ['None', 'nan', '']:
-            full_text = full_text + '\n' + sub_title if full_text else sub_title
-        if sub_subtitle and sub_subtitle not in ['None', 'nan', '']:
-            full_text = full_text + '\n' + sub_subtitle if full_text else sub_subtitle
-        full_text = full_text + '\n' + text if full_text else text
-        
-        # Similarity search
-        if embedded_item is not None:
+    Returns:
+        List of Document lists ordered by descending cross-encoder score
+    """
+    pairs = [(query, doc.page_content) for query, docs in zip(queries, contexts) for doc in docs]
+    scores = reranker.score_pairs(pairs)
+    
+    reranked = []
+    offset = 0
+    for docs in contexts:
+        article_scores = scores[offset:offset + len(docs)]
+        offset += len(docs)
+        order = np.argsort(-article_scores, kind="stable")[:k]
+        reranked.append([docs[i] for i in order])
+    return reranked
+
+
+def gate_verify_sample(article_key, percent):
+    """
+    Whether a gated article belongs to the verification sample
+    
+    The choice is derived from the article key, so a rerun verifies the same articles.
+    """
+    if percent <= 0:
+        return False
+    bucket = int(hashlib.sha256(article_key.encode("utf-8")).hexdigest()[:8], 16) % 10000
+    return bucket < percent * 100
+
+
+def gated_result_row(margin, full_text, best_score, threshold):
+    """Templated "not addressed" row for an article the similarity gate kept from the LLM"""
+    article_text = full_text.strip().split('\n')[-1].strip()
+    requirement = article_text if len(article_text) <= 300 else article_text[:297].rsplit(' ', 1)[0] + ' ...'
+    comment = (
+        f"Not addressed: no section of the document is similar to this article "
+        f"(best similarity {best_score:.2f}, gate {threshold:.2f}), so it was not analyzed in detail."
+    )
+    return make_result_row(margin, full_text, requirement, 'No', '-', comment)
+
+
+def analyze_article(margin, full_text, retrieved_docs, on_row=None, on_restart=None, output_format=None):
+    """
+    Run the LLM gap analysis for a single regulation article
+    
+    Safe to call from worker threads: it does not touch any Streamlit element.
+    
+    Args:
+        margin, full_text, retrieved_docs: Article and its retrieved document chunks
+        on_row: Optional callback receiving each row while the response streams in
+        on_restart: Optional callback withdrawing the streamed rows (the request is sent again)
+        output_format: "table" or "json" (defaults to GAP_OUTPUT_FORMAT)
+    
+    Returns:
+        Tuple (list of table rows for this article, token usage record)
+    """
+    output_format = output_format or DEFAULT_OUTPUT_FORMAT
+    tool = gap_rows_tool() if output_format == "json" else None
+    
+    # Build gap analysis prompt (direct table output) within the token budget
+    system, gap_prompt, max_tokens, prompt_stats = prepare_gap_request(
+        retrieved_docs, full_text, output_format=output_format
+    )
+    parser = article_row_parser(margin, full_text, on_row, on_restart, output_format)
+    
+    # Get gap analysis from Claude (single call - returns table directly)
+    table_response, usage = ask_llm_with_retry(gap_prompt, max_tokens, system, parser, tool)
+    
+    # The adaptive output limit was too small for this article: ask again with the full limit
+    output_retries = 0
+    if usage.get("stop_reason") == "max_tokens" and max_tokens < GAP_MAX_TOKENS:
+        output_retries = 1
+        max_tokens = GAP_MAX_TOKENS
+        if parser is not None:
+            parser.restart()
+        table_response, usage = ask_llm_with_retry(gap_prompt, max_tokens, system, parser, tool)
+    
+    # Extract table data; rows that fail validation are re-asked on their own
+    batch_articles = [(margin, full_text)]
+    rows_per_article, broken, parse_stats = extract_rows(batch_articles, table_response, output_format)
+    repair_usage = None
+    if broken:
+        repair_usage = repair_broken_rows(rows_per_article, parse_stats, batch_articles, broken)
+    
+    record = article_usage(margin, max_tokens, prompt_stats, usage, output_retries, parse_stats=parse_stats)
+    if repair_usage is not None:
+        _add_repair_usage(record, repair_usage)
+    return rows_per_article[0], record
+
+
+async def analyze_article_async(margin, full_text, retrieved_docs, on_row=None, on_restart=None, output_format=None):
+    """Async twin of analyze_article: the LLM call is awaited"""
+    output_format = output_format or DEFAULT_OUTPUT_FORMAT
+    tool = gap_rows_tool() if output_format == "json" else None
+    system, gap_prompt, max_tokens, prompt_stats = prepare_gap_request(
+        retrieved_docs, full_text, output_format=output_format
+    )
+    parser = article_row_parser(margin, full_text, on_row, on_restart, output_format)
+    table_response, usage = await ask_llm_with_retry_async(gap_prompt, max_tokens, system, parser, tool)
+    
+    output_retries = 0
+    if usage.get("stop_reason") == "max_tokens" and max_tokens < GAP_MAX_TOKENS:
+        output_retries = 1
+        max_tokens = GAP_MAX_TOKENS
+        if parser is not None:
+            parser.restart()
+        table_response, usage = await ask_llm_with_retry_async(gap_prompt, max_tokens, system, parser, tool)
+    
+    batch_articles = [(margin, full_text)]
+    rows_per_article, broken, parse_stats = extract_rows(batch_articles, table_response, output_format)
+    repair_usage = None
+    if broken:
+        repair_usage = await repair_broken_rows_async(rows_per_article, parse_stats, batch_articles, broken)
+    
+    record = article_usage(margin, max_tokens, prompt_stats, usage, output_retries, parse_stats=parse_stats)
+    if repair_usage is not None:
+        _add_repair_usage(record, repair_usage)
+    return rows_per_article[0], record
+
+
+def analyze_article_batch(batch, on_row=None, on_restart=None, output_format=None):
+    """
+    Run one gap analysis request for several short articles
+    
+    Rows that fail validation are re-asked on their own; articles still
+    without any row are then analyzed again on their own.
+    
+    Args:
+        batch: List of (margin, full_text, retrieved_docs)
+        on_row: Optional callback(index into batch, row) for rows streamed in
+        on_restart: Optional callback(batch indices) withdrawing streamed rows
+        output_format: "table" or "json" (defaults to GAP_OUTPUT_FORMAT)
+        
+    Returns:
+        Tuple (list of row lists aligned with batch, token usage record)
+    """
+    output_format = output_format or DEFAULT_OUTPUT_FORMAT
+    if len(batch) == 1:
+        rows, usage = analyze_article(*batch[0], *_fallback_callbacks(0, on_row, on_restart), output_format)
+        return [rows], usage
+    
+    tool = gap_rows_tool(with_margin=True) if output_format == "json" else None
+    system, gap_prompt, max_tokens, prompt_stats = prepare_batch_gap_request(batch, output_format=output_format)
+    parser = batch_row_parser(batch, on_row, on_restart, output_format)
+    table_response, usage = ask_llm_with_retry(gap_prompt, max_tokens, system, parser, tool)
+    
+    output_retries = 0
+    if usage.get("stop_reason") == "max_tokens" and max_tokens < GAP_MAX_TOKENS:
+        output_retries = 1
+        max_tokens = GAP_MAX_TOKENS
+        if parser is not None:
+            parser.restart()
+        table_response, usage = ask_llm_with_retry(gap_prompt, max_tokens, system, parser, tool)
+    
+    batch_articles = [(margin, text) for margin, text, _ in batch]
+    rows_per_article, broken, parse_stats = extract_rows(
+        batch_articles, table_response, output_format, multi_article=True
+    )
+    repair_usage = None
+    if broken:
+        repair_usage = repair_broken_rows(rows_per_article, parse_stats, batch_articles, broken, multi_article=True)
+    record = article_usage(
+        ', '.join(margin for margin, _, _ in batch), max_tokens, prompt_stats, usage, output_retries, len(batch),
+        parse_stats
+    )
+    if repair_usage is not None:
+        _add_repair_usage(record, repair_usage)
+    
+    for index, (margin, full_text, retrieved_docs) in enumerate(batch):
+        if not rows_per_article[index]:
+            rows_per_article[index], single_usage = analyze_article(
+                margin, full_text, retrieved_docs, *_fallback_callbacks(index, on_row, on_restart), output_format
+            )
+            _add_fallback_usage(record, single_usage)
+    
+    return rows_per_article, record
+
+
+async def analyze_article_batch_async(batch, on_row=None, on_restart=None, output_format=None):
+    """Async twin of analyze_article_batch"""
+    output_format = output_format or DEFAULT_OUTPUT_FORMAT
+    if len(batch) == 1:
+        rows, usage = await analyze_article_async(*batch[0], *_fallback_callbacks(0, on_row, on_restart), output_format)
+        return [rows], usage
+    
+    tool = gap_rows_tool(with_margin=True) if output_format == "json" else None
+    system, gap_prompt, max_tokens, prompt_stats = prepare_batch_gap_request(batch, output_format=output_format)
+    parser = batch_row_parser(batch, on_row, on_restart, output_format)
+    table_response, usage = await ask_llm_with_retry_async(gap_prompt, max_tokens, system, parser, tool)
+    
+    output_retries = 0
+    if usage.get("stop_reason") == "max_tokens" and max_tokens < GAP_MAX_TOKENS:
+        output_retries = 1
+        max_tokens = GAP_MAX_TOKENS
+        if parser is not None:
+            parser.restart()
+        table_response, usage = await ask_llm_with_retry_async(gap_prompt, max_tokens, system, parser, tool)
+    
+    batch_articles = [(margin, text) for margin, text, _ in batch]
+    rows_per_article, broken, parse_stats = extract_rows(
+        batch_articles, table_response, output_format, multi_article=True
+    )
+    repair_usage = None
+    if broken:
+        repair_usage = await repair_broken_rows_async(
+            rows_per_article, parse_stats, batch_articles, broken, multi_article=True
+        )
+    record = article_usage(
+        ', '.join(margin for margin, _, _ in batch), max_tokens, prompt_stats, usage, output_retries, len(batch),
+        parse_stats
+    )
+    if repair_usage is not None:
+        _add_repair_usage(record, repair_usage)
+    
+    for index, (margin, full_text, retrieved_docs) in enumerate(batch):
+        if not rows_per_article[index]:
+            rows_per_article[index], single_usage = await analyze_article_async(
+                margin, full_text, retrieved_docs, *_fallback_callbacks(index, on_row, on_restart), output_format
+            )
+            _add_fallback_usage(record, single_usage)
+    
+    return rows_per_article, record
+
+
+async def run_articles_async(batches, max_workers, on_done, stream_callbacks=None, on_tick=None, output_format=None):
+    """
+    Analyze all articles concurrently with asyncio.gather
+    
+    Args:
+        batches: List of article batches, each a list of (margin, full_text, retrieved_docs)
+                 tuples (one tuple per batch unless multi-article batching is on)
+        max_workers: Maximum number of requests in flight
+        on_done: Callback(batch_index, result, error) invoked on the event loop thread,
+                 result being the (row lists, usage) tuple of analyze_article_batch_async
+        stream_callbacks: Optional function batch_index -> (on_row, on_restart) for streamed rows
+        on_tick: Optional callback invoked every LIVE_ROWS_REFRESH_SECONDS while articles run
+        output_format: "table" or "json" (defaults to GAP_OUTPUT_FORMAT)
+        
+    Returns:
+        None - results are delivered through on_done
+    """
+    semaphore = asyncio.Semaphore(max_workers)
+    
+    async def run_one(batch_index, batch):
+        on_row, on_restart = stream_callbacks(batch_index) if stream_callbacks else (None, None)
+        async with semaphore:
             try:
-                results = vectorstore.similarity_search_by_vector(
-                    embedding=embedded_item.tolist() if isinstance(embedded_item, np.ndarray) else embedded_item,
-                    k=4
-                )
-                
-                # Build gap analysis prompt (direct table output)
-                gap_prompt = build_gap_prompt(results, full_text)
-                
-                # Get gap analysis from Claude (single call - returns table directly)
-                # Use higher max_tokens for detailed comments with retry logic
-                max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        table_response = llm.ask_llm(gap_prompt, temperature=0.2, max_tokens=3000)
-                        break  # Success, exit retry loop
-                    except Exception as e:
-                        if attempt < max_retries - 1:
-                            import time
-                            time.sleep(2)  # Wait 2 seconds before retry
-                            continue
-                        else:
-                            raise e  # Re-raise the exception on final attempt
-                
-                # Extract table data
-                cur_table_data = extract_table_from_text(margin, full_text, table_response)
-                all_rows.extend(cur_table_data)
-                
-                # Progress tracking only - no individual article messages
-                
+                result = await analyze_article_batch_async(batch, on_row, on_restart, output_format)
             except Exception as e:
-                st.warning(f"Error analyzing article {margin}: {str(e)}")
-                continue
+                on_done(batch_index, None, e)
+                return
+        on_done(batch_index, result, None)
+    
+    async def tick():
+        while True:
+            await asyncio.sleep(LIVE_ROWS_REFRESH_SECONDS)
+            on_tick()
+    
+    ticker = asyncio.ensure_future(tick()) if on_tick else None
+    try:
+        await asyncio.gather(*[run_one(batch_index, batch) for batch_index, batch in enumerate(batches)])
+    finally:
+        if ticker is not None:
+            ticker.cancel()
+        # The pooled client is bound to this event loop, which asyncio.run closes
+        await get_llm_client().aclose()
+
+
+def run_gap_analysis(document_path, regulation_file, regulation_name, progress=None, max_workers=None,
+                     execution_mode=None, use_chroma=None, executor=None, run_id=None, resume=None,
+                     document_name=None, batch_articles=None, stream=None, output_format=None,
+                     similarity_gate=None, gate_verify_percent=None, rerank=None):
+    """
+    UI-agnostic gap analysis pipeline
+    
+    Args:
+        document_path: Path to the company document (.docx)
+        regulation_file: Path to regulation Excel file (its compiled store is used when available)
+        regulation_name: Name of the regulation
+        progress: ProgressReporter receiving progress and warnings (defaults to a silent one)
+        max_workers: Number of articles analyzed in parallel (defaults to
+                     GAP_ANALYSIS_MAX_WORKERS, 1 = sequential)
+        execution_mode: "threads" or "async" (defaults to GAP_ANALYSIS_EXECUTION_MODE)
+        use_chroma: Persist the document in Chroma and query it per article instead of
+                    the in-memory batched retriever (defaults to GAP_ANALYSIS_USE_CHROMA)
+        executor: Optional shared ThreadPoolExecutor for the LLM calls (threads mode);
+                  when given, max_workers is ignored and the pool's size applies
+        run_id: Journal key of this run (defaults to a hash of document, regulation, LLM model
+                and analysis settings/prompts, so rerunning the same analysis finds its checkpoints)
+        resume: Reuse articles checkpointed by an earlier attempt of the run
+                (defaults to GAP_ANALYSIS_RESUME); False starts the run over
+        document_name: Name recorded in the run journal (defaults to the file name)
+        batch_articles: Pack consecutive short articles under the same heading into one
+                        request (defaults to GAP_BATCH_ARTICLES)
+        stream: Stream the LLM responses and report rows to progress.rows() line by line
+                (defaults to GAP_STREAM_RESPONSES); without streaming, rows are reported
+                per finished article
+        output_format: "table" (pipe-delimited rows) or "json" (forced tool call, validated
+                       and repaired rows; defaults to GAP_OUTPUT_FORMAT)
+        similarity_gate: Articles whose best chunk similarity is below this value get a
+                         templated "No" row instead of an LLM call (defaults to
+                         GAP_SIMILARITY_GATE; 0 = off, in-memory retriever only)
+        gate_verify_percent: Percentage of gated articles sent to the LLM anyway to estimate
+                             how often the gate is wrong (defaults to GAP_GATE_VERIFY_PERCENT)
+        rerank: Retrieve GAP_RERANK_CANDIDATES chunks per article and keep the RETRIEVAL_K
+                best by cross-encoder score (defaults to GAP_RERANK)
         
-        # Update progress
-        progress = 40 + int((index + 1) / total_articles * 50)
-        progress_bar.progress(min(progress, 90))
-        status_text.text(f"Analyzing article {index + 1}/{total_articles}...")
+    Returns:
+        DataFrame with gap analysis results (run metrics in df.attrs["run_metrics"])
+    """
+    progress = progress or ProgressReporter()
+    if max_workers is None:
+        max_workers = DEFAULT_MAX_WORKERS
+    max_workers = max(1, int(max_workers))
+    execution_mode = (execution_mode or DEFAULT_EXECUTION_MODE).lower()
+    if use_chroma is None:
+        use_chroma = DEFAULT_USE_CHROMA
+    if resume is None:
+        resume = DEFAULT_RESUME
+    if batch_articles is None:
+        batch_articles = DEFAULT_BATCH_ARTICLES
+    if stream is None:
+        stream = DEFAULT_STREAM
+    output_format = (output_format or DEFAULT_OUTPUT_FORMAT).lower()
+    if similarity_gate is None:
+        similarity_gate = DEFAULT_SIMILARITY_GATE
+    if gate_verify_percent is None:
+        gate_verify_percent = DEFAULT_GATE_VERIFY_PERCENT
+    if rerank is None:
+        rerank = DEFAULT_RERANK
     
-    # Step 5: Create DataFrame
-    status_text.text("Generating Excel report...")
-    df_results = pd.DataFrame(all_rows, columns=headers)
-    progress_bar.progress(100)
+    with open(document_path, "rb") as f:
+        document_bytes = f.read()
     
-    # Clean up
-    status_text.empty()
-    progress_bar.empty()
+    # Step 1: Parse document
+    progress.update(0, "Parsing uploaded document...")
+    split_content = split_docx_by_structure(document_path)
+    progress.update(10, "Parsing uploaded document...")
     
-    # Remove temp files
-    if os.path.exists(temp_file_path):
-        os.remove(temp_file_path)
+    # Cache counters are process-wide; the run reports the deltas
+    llm_cache = get_llm_cache()
+    cache_stats_before = llm_cache.stats() if llm_cache is not None else None
+    embedding_cache = getattr(get_embeddings(), "cache", None)
+    embedding_cache_before = embedding_cache.stats() if embedding_cache is not None else None
+    scheduler = getattr(get_llm_client(), "scheduler", None)
+    scheduler_before = scheduler.stats() if scheduler is not None else None
+    
+    # Step 2: Embed document chunks
+    progress.update(10, "Creating document embeddings...")
+    index_lease_id = None
+    if use_chroma:
+        retriever, index_lease_id = open_managed_vectorstore(document_bytes, split_content)
+    else:
+        documents = build_documents(split_content)
+        
+        def on_embedding_progress(done, total, chunks_per_second):
+            progress.update(
+                10 + int(done / max(total, 1) * 20),
+                f"Creating document embeddings... {done}/{total} chunks ({chunks_per_second:.1f} chunks/sec)"
+            )
+        
+        document_matrix = get_embeddings().encode_batched(
+            [doc.page_content for doc in documents],
+            progress_callback=on_embedding_progress
+        )
+        retriever = InMemoryRetriever(documents, document_matrix)
+    embedding_chunks_per_second = get_embeddings().last_throughput
     
-    # Clean up vector store - just close the connection, keep the files
     try:
-        # Close the vectorstore connection
-        if 'vectorstore' in locals():
-            try:
-                vectorstore._client.reset()
-            except:
-                pass
+        # Step 3: Load regulation data
+        progress.update(30, f"Loading {regulation_name} regulation...")
+        df_regulation, regulation_embeddings = load_regulation(regulation_file)
         
-        # Note: We keep the vectorstore files for potential reuse or debugging
-        # They are stored in unique directories so they won't conflict
-        pass
-    except Exception as e:
-        pass  # Ignore cleanup errors
+        # Chunk and article vectors are only fully comparable when made by the same model/backend
+        chunk_model = getattr(get_embeddings(), "model_name", EMBEDDING_MODEL)
+        article_model = regulation_embedding_model(regulation_file) or EMBEDDING_MODEL
+        if chunk_model != article_model:
+            progress.warning(
+                f"Document chunks are embedded with {chunk_model} but the {regulation_name} articles with "
+                f"{article_model}; retrieval and similarity gate scores are slightly less accurate. "
+                f"Regenerate the regulation embeddings with the same EMBEDDINGS_BACKEND."
+            )
+        
+        # Step 4: Perform gap analysis
+        progress.update(40, "Analyzing gaps with Claude AI...")
+        
+        # Collect the articles to analyze, in regulation (margin) order
+        articles = []
+        skipped_margins = {}
+        for position, (index, row) in enumerate(df_regulation.iterrows()):
+            margin = str(row.get('Margin', ''))
+            
+            # Definitions, scope and abrogated margins carry no requirements to check
+            category = row.get('Category') or classify_by_rules(
+                row.get('Title'), row.get('SubTitle'), row.get('Sub_Subtitle'), row.get('Text')
+            ) or "requirement"
+            if category in GAP_SKIP_CATEGORIES:
+                skipped_margins.setdefault(category, []).append(margin.strip())
+                continue
+            
+            # Skip articles without an embedding (NaN rows in the matrix)
+            if regulation_embeddings is None or np.isnan(regulation_embeddings[position]).any():
+                continue
+            
+            articles.append((
+                margin, build_article_text(row), np.asarray(regulation_embeddings[position]), article_heading(row)
+            ))
+        
+        # Resume: articles checkpointed by an earlier attempt of this run are not sent again
+        total_articles = len(articles)
+        rows_by_position = [[] for _ in articles]
+        article_keys = [make_article_key(margin, full_text) for margin, full_text, _, _ in articles]
+        if run_id is None:
+            run_id = make_run_id(
+                document_bytes, regulation_name, getattr(get_llm_client(), "model", ""),
+                analysis_fingerprint(output_format, batch_articles, rerank, similarity_gate,
+                                     gate_verify_percent, use_chroma)
+            )
+        journal = get_run_journal()
+        checkpointed = journal.start_run(
+            run_id, total_articles, document_name=document_name or os.path.basename(document_path),
+            regulation_name=regulation_name, resume=resume
+        )
+        pending = []
+        for position, article_key in enumerate(article_keys):
+            if article_key in checkpointed:
+                rows_by_position[position] = checkpointed[article_key]
+            else:
+                pending.append(position)
+        resumed_articles = total_articles - len(pending)
+        if resumed_articles:
+            progress.update(40, f"Resuming run: {resumed_articles}/{total_articles} articles already analyzed...")
+        
+        # Retrieve context for all pending articles up front (one matrix multiply in-memory)
+        retrieval_start = time.perf_counter()
+        contexts, best_scores = retrieve_contexts(
+            retriever, [articles[position][2] for position in pending],
+            k=max(GAP_RERANK_CANDIDATES, RETRIEVAL_K) if rerank else RETRIEVAL_K, with_scores=True
+        )
+        retrieval_seconds = time.perf_counter() - retrieval_start
+        
+        # Similarity gate: articles no chunk resembles get a templated "No" row without an
+        # LLM call; a sample of them still goes to the LLM to measure how often that is wrong
+        gated_articles = 0
+        verify_positions = set()
+        gate_verified = 0
+        gate_disagreements = 0
+        if similarity_gate > 0:
+            sent, sent_contexts = [], []
+            for position, retrieved_docs, best_score in zip(pending, contexts, best_scores):
+                if best_score is not None and best_score < similarity_gate:
+                    if gate_verify_sample(article_keys[position], gate_verify_percent):
+                        verify_positions.add(position)
+                    else:
+                        margin, full_text = articles[position][0], articles[position][1]
+                        # Not journaled: gated rows are no LLM answers, and a resumed run with a
+                        # lower (or no) gate must analyze these articles for real
+                        rows_by_position[position] = [
+                            gated_result_row(margin, full_text, best_score, similarity_gate)
+                        ]
+                        gated_articles += 1
+                        continue
+                sent.append(position)
+                sent_contexts.append(retrieved_docs)
+            pending, contexts = sent, sent_contexts
+        
+        # Rerank the candidates of the articles that go to the LLM (gated ones are not reranked)
+        rerank_seconds = 0.0
+        if rerank and pending:
+            progress.update(40, f"Reranking context chunks for {len(pending)} articles...")
+            rerank_start = time.perf_counter()
+            contexts = rerank_contexts(get_reranker(), [articles[position][1] for position in pending], contexts)
+            rerank_seconds = time.perf_counter() - rerank_start
+        
+        tasks = [
+            (articles[position][0], articles[position][1], retrieved_docs)
+            for position, retrieved_docs in zip(pending, contexts)
+        ]
+        
+        completed = resumed_articles + gated_articles
+        failed_articles = 0
+        
+        # One LLM request per batch: single articles, or groups of short articles under one heading
+        if batch_articles:
+            batches = plan_article_batches([(articles[position][1], articles[position][3]) for position in pending])
+        else:
+            batches = [[task_index] for task_index in range(len(tasks))]
+        
+        usage_by_position = [None for _ in articles]
+        
+        # Live rows: final rows of finished articles, streamed rows of running ones
+        finished = [True for _ in articles]
+        for position in pending:
+            finished[position] = False
+        row_feed = RowFeed() if stream else None
+        rows_changed = True
+        
+        # (on_row, on_restart) of one batch, feeding its streamed rows into row_feed by article position
+        def stream_callbacks(batch_index):
+            positions = [pending[task_index] for task_index in batches[batch_index]]
+            
+            def on_row(index, row):
+                row_feed.add(positions[index], row)
+            
+            def on_restart(indices):
+                for index in indices:
+                    row_feed.reset(positions[index])
+            
+            return on_row, on_restart
+        
+        def publish_rows():
+            nonlocal rows_changed
+            if row_feed is not None and row_feed.drain():
+                rows_changed = True
+            if not rows_changed:
+                return
+            rows_changed = False
+            live_rows = []
+            for position, rows in enumerate(rows_by_position):
+                if finished[position]:
+                    live_rows.extend(rows)
+                elif row_feed is not None:
+                    live_rows.extend(row_feed.rows_by_key.get(position, []))
+            progress.rows(live_rows, RESULT_HEADERS)
+        
+        def on_done(batch_index, result, error):
+            nonlocal completed, failed_articles, rows_changed, gate_verified, gate_disagreements
+            task_indices = batches[batch_index]
+            rows_changed = True
+            for task_index in task_indices:
+                finished[pending[task_index]] = True
+            if error is not None:
+                failed_articles += len(task_indices)
+                margins = ', '.join(tasks[task_index][0] for task_index in task_indices)
+                progress.warning(f"Error analyzing article {margins}: {str(error)}")
+            else:
+                rows_per_article, usage = result
+                usage_by_position[pending[task_indices[0]]] = usage
+                for task_index, rows in zip(task_indices, rows_per_article):
+                    position = pending[task_index]
+                    rows_by_position[position] = rows
+                    # Gated article in the verification sample: the gate was wrong if the LLM found coverage
+                    if position in verify_positions:
+                        gate_verified += 1
+                        gate_disagreements += any(row[3] in ('Yes', 'Partial') for row in rows)
+                    # Checkpoint immediately so a crash later in the run does not lose this article
+                    journal.record_article(run_id, article_keys[position], tasks[task_index][0], rows)
+            
+            completed += len(task_indices)
+            progress.update(
+                min(40 + int(completed / max(total_articles, 1) * 50), 90),
+                f"Analyzing article {completed}/{total_articles}..."
+            )
+        
+        batch_tasks = [[tasks[task_index] for task_index in batch] for batch in batches]
+        publish_rows()
+        if execution_mode == "async":
+            # The event loop runs on the calling thread, so on_done reports from there too
+            asyncio.run(run_articles_async(
+                batch_tasks, max_workers, on_done,
+                stream_callbacks=stream_callbacks if stream else None, on_tick=publish_rows,
+                output_format=output_format
+            ))
+            publish_rows()
+        else:
+            # Worker threads only run the LLM calls; progress and streamed rows
+            # are reported here on the calling thread.
+            pool = executor or ThreadPoolExecutor(max_workers=max_workers)
+            try:
+                futures = {
+                    pool.submit(
+                        analyze_article_batch, batch, *(stream_callbacks(batch_index) if stream else (None, None)),
+                        output_format
+                    ): batch_index
+                    for batch_index, batch in enumerate(batch_tasks)
+                }
+                not_done = set(futures)
+                while not_done:
+                    done, not_done = wait(
+                        not_done, timeout=LIVE_ROWS_REFRESH_SECONDS if stream else None, return_when=FIRST_COMPLETED
+                    )
+                    for future in done:
+                        try:
+                            result, error = future.result(), None
+                        except Exception as e:
+                            result, error = None, e
+                        on_done(futures[future], result, error)
+                    publish_rows()
+            finally:
+                if executor is None:
+                    pool.shutdown()
+        journal.finish_run(run_id, failed_articles)
+    finally:
+        # Release the upload index; the index manager decides when to delete it
+        if index_lease_id is not None:
+            get_upload_index_manager().release(index_lease_id)
+    
+    # Reassemble rows in margin order regardless of completion order
+    all_rows = [row for rows in rows_by_position for row in rows]
+    
+    # Step 5: Create DataFrame
+    progress.update(95, "Generating Excel report...")
+    df_results = pd.DataFrame(all_rows, columns=RESULT_HEADERS)
+    
+    # Run metrics travel with the results
+    run_metrics = {
+        "run_id": run_id,
+        "articles": total_articles,
+        "resumed_articles": resumed_articles,
+        "failed_articles": failed_articles,
+        "skipped_articles": sum(len(margins) for margins in skipped_margins.values()),
+        "embedding_chunks_per_second": round(embedding_chunks_per_second, 1),
+        "retrieval_seconds": round(retrieval_seconds, 3)
+    }
+    if rerank:
+        run_metrics["rerank_candidates"] = max(GAP_RERANK_CANDIDATES, RETRIEVAL_K)
+        run_metrics["rerank_seconds"] = round(rerank_seconds, 3)
+    if similarity_gate > 0:
+        # Share of verified gated articles where the LLM found (partial) coverage
+        run_metrics["similarity_gate"] = similarity_gate
+        run_metrics["gated_articles"] = gated_articles
+        run_metrics["gate_verified_articles"] = gate_verified
+        run_metrics["gate_disagreements"] = gate_disagreements
+        run_metrics["gate_estimated_error_rate"] = (
+            round(gate_disagreements / gate_verified, 4) if gate_verified else None
+        )
+    for category, margins in sorted(skipped_margins.items()):
+        run_metrics[f"skipped_{category}"] = len(margins)
+        run_metrics[f"skipped_{category}_margins"] = ', '.join(margins)
+    if llm_cache is not None:
+        cache_stats = llm_cache.stats()
+        run_metrics["llm_cache_hits"] = cache_stats["hits"] - cache_stats_before["hits"]
+        run_metrics["llm_cache_misses"] = cache_stats["misses"] - cache_stats_before["misses"]
+    if embedding_cache is not None:
+        embedding_stats = embedding_cache.stats()
+        run_metrics["embedding_cache_hits"] = embedding_stats["hits"] - embedding_cache_before["hits"]
+        run_metrics["embedding_cache_misses"] = embedding_stats["misses"] - embedding_cache_before["misses"]
+    if scheduler is not None:
+        scheduler_stats = scheduler.stats()
+        run_metrics["llm_retries"] = scheduler_stats["retries"] - scheduler_before["retries"]
+        run_metrics["llm_rate_limited"] = scheduler_stats["rate_limited"] - scheduler_before["rate_limited"]
+        run_metrics["llm_rate_limit_wait_seconds"] = round(
+            scheduler_stats["wait_seconds"] - scheduler_before["wait_seconds"], 1
+        )
+    # Token accounting for the articles sent in this run (resumed articles are not counted)
+    article_usages = [usage for usage in usage_by_position if usage is not None]
+    run_metrics["prompt_tokens"] = sum(usage["prompt_tokens"] for usage in article_usages)
+    run_metrics["completion_tokens"] = sum(usage["completion_tokens"] for usage in article_usages)
+    run_metrics["cache_read_tokens"] = sum(usage["cache_read_tokens"] for usage in article_usages)
+    run_metrics["cache_write_tokens"] = sum(usage["cache_write_tokens"] for usage in article_usages)
+    run_metrics["context_chunks_dropped"] = sum(usage["dropped_chunks"] for usage in article_usages)
+    run_metrics["context_chunks_truncated"] = sum(usage["truncated_chunks"] for usage in article_usages)
+    run_metrics["output_limit_retries"] = sum(usage["output_retries"] for usage in article_usages)
+    run_metrics["llm_requests"] = (
+        sum(1 for usage in article_usages if not usage["cached"])
+        + sum(usage["fallback_articles"] for usage in article_usages)
+        + sum(usage["repair_requests"] for usage in article_usages)
+    )
+    run_metrics["batched_articles"] = sum(
+        usage["articles_in_request"] for usage in article_usages if usage["articles_in_request"] > 1
+    )
+    # Response parsing: failures are responses without usable structure (no table rows or
+    # malformed JSON); rows are salvaged from broken JSON, repaired locally or re-asked
+    parsed_responses = sum(1 + usage["fallback_articles"] for usage in article_usages)
+    parse_failures = sum(usage["parse_failures"] for usage in article_usages)
+    run_metrics["output_format"] = output_format
+    run_metrics["parse_failures"] = parse_failures
+    run_metrics["parse_failure_rate"] = round(parse_failures / parsed_responses, 4) if parsed_responses else 0.0
+    run_metrics["rows_salvaged"] = sum(usage["salvaged_rows"] for usage in article_usages)
+    run_metrics["rows_repaired_locally"] = sum(usage["repaired_rows"] for usage in article_usages)
+    run_metrics["rows_dropped"] = sum(usage["dropped_rows"] for usage in article_usages)
+    run_metrics["rows_reasked"] = sum(usage["reasked_rows"] for usage in article_usages)
+    run_metrics["repair_requests"] = sum(usage["repair_requests"] for usage in article_usages)
+    df_results.attrs["run_metrics"] = run_metrics
+    df_results.attrs["article_usage"] = article_usages
+    progress.update(100, "Done")
     
     return df_results
 
+
+def perform_gap_analysis(uploaded_file, regulation_file, regulation_name, max_workers=None, execution_mode=None,
+                         use_chroma=None, resume=None, batch_articles=None, stream=None, output_format=None,
+                         similarity_gate=None, gate_verify_percent=None, rerank=None):
+    """
+    Main function to perform gap analysis from the Streamlit page
+    
+    Args:
+        uploaded_file: Streamlit uploaded file object (company document)
+        regulation_file: Path to regulation Excel file
+        regulation_name: Name of the regulation
+        max_workers, execution_mode, use_chroma, resume, batch_articles, stream, output_format,
+        similarity_gate, gate_verify_percent, rerank: See run_gap_analysis
+        
+    Returns:
+        DataFrame with gap analysis results
+    """
+    # Imported here so the core pipeline does not depend on Streamlit
+    from modules.UI.progress import StreamlitProgressReporter
+    
+    # Save uploaded file temporarily (unique name - several sessions may run at once)
+    with tempfile.NamedTemporaryFile(suffix=".docx", delete=False) as f:
+        f.write(uploaded_file.getbuffer())
+        temp_file_path = f.name
+    
+    progress = StreamlitProgressReporter()
+    try:
+        return run_gap_analysis(
+            temp_file_path, regulation_file, regulation_name, progress=progress,
+            max_workers=max_workers, execution_mode=execution_mode, use_chroma=use_chroma, resume=resume,
+            document_name=getattr(uploaded_file, "name", None), batch_articles=batch_articles, stream=stream,
+            output_format=output_format, similarity_gate=similarity_gate, gate_verify_percent=gate_verify_percent,
+            rerank=rerank
+        )
+    finally:
+        progress.finish()
+        
+        # Remove temp files
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
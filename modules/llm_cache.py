@@ -0,0 +1,161 @@
+"""
+Persistent, content-addressed cache for LLM responses
+
+Responses are keyed by a SHA-256 hash of (prompt, model, temperature, max_tokens)
+and stored in a SQLite file, so re-running the same document against the same
+regulation returns identical article analyses without calling the LLM again.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+DEFAULT_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "cache/llm_responses.sqlite3")
+DEFAULT_MAX_SIZE_MB = float(os.getenv("LLM_CACHE_MAX_MB", "200"))
+
+
+def make_cache_key(prompt: str, model: str, temperature: float, max_tokens: int) -> str:
+    """
+    Build the cache key for one LLM request
+
+    Args:
+        prompt: Full prompt text sent to the model
+        model: Model name
+        temperature: Sampling temperature
+        max_tokens: Maximum tokens in response
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    payload = json.dumps({
+        "prompt": prompt,
+        "model": model,
+        "temperature": float(temperature),
+        "max_tokens": int(max_tokens)
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    SQLite-backed LLM response cache with size-based LRU eviction
+
+    Safe to share between threads; several processes may also point at the
+    same file (SQLite handles the locking).
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_size_mb: float = DEFAULT_MAX_SIZE_MB):
+        """
+        Open (or create) the cache
+
+        Args:
+            path: SQLite file path
+            max_size_mb: Total response size kept before least recently used entries are evicted
+        """
+        self.path = path
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response
+
+        Args:
+            key: Cache key from make_cache_key
+
+        Returns:
+            Cached response text, or None on a miss
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, response: str):
+        """
+        Store a response and evict old entries if the cache grew past its size limit
+
+        Args:
+            key: Cache key from make_cache_key
+            response: Response text
+        """
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Delete least recently used entries until the total size fits the limit (lock held)"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_size_bytes:
+            return
+
+        to_delete = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC"):
+            if total <= self.max_size_bytes:
+                break
+            to_delete.append((key,))
+            total -= size
+
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+        self.evictions += len(to_delete)
+
+    def stats(self) -> dict:
+        """
+        Get hit/miss counters and storage usage
+
+        Returns:
+            Dictionary with hits, misses, hit_rate, evictions, entries and size_bytes
+        """
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "size_bytes": size
+            }
+
+    def clear(self):
+        """Remove every cached response"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
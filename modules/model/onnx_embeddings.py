@@ -0,0 +1,241 @@
+"""
+ONNX Runtime embeddings (int8 dynamic quantization, CPU)
+
+Drop-in alternative to OpenSourceEmbeddings (embed_query / embed_documents /
+encode_batched) selected with EMBEDDINGS_BACKEND=onnx. At runtime it needs only
+onnxruntime and tokenizers - no torch - which keeps the container's memory and
+startup time down.
+
+The model is exported once per sentence-transformer model into
+EMBEDDINGS_ONNX_DIR/<model>/ (model.onnx, model_int8.onnx, tokenizer.json,
+onnx_config.json). Exporting needs torch and sentence-transformers; it runs
+automatically on first use when the files are missing, or ahead of time with:
+
+    python -m modules.model.onnx_embeddings
+
+Pooling matches the sentence-transformer pipeline: mean over the attention
+mask, then L2 normalization when the original model normalizes.
+"""
+
+import json
+import os
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from modules.model.open_source_llm import EMBED_BATCH_SIZE, EMBED_PRECISION, EMBEDDING_MODEL, quantize_embeddings
+
+# Exported models, one sub-directory per sentence-transformer model
+ONNX_MODEL_DIR = os.getenv("EMBEDDINGS_ONNX_DIR", "models/onnx")
+# Use the int8 dynamically quantized graph (false = exported float32 graph)
+ONNX_QUANTIZED = os.getenv("EMBEDDINGS_ONNX_QUANTIZED", "true").lower() == "true"
+# intra-op threads of the ONNX Runtime session (0 = ONNX Runtime default, all cores)
+ONNX_THREADS = int(os.getenv("EMBEDDINGS_ONNX_THREADS", "0"))
+
+ONNX_OPSET = 14
+
+
+def onnx_model_dir(model_name: str = EMBEDDING_MODEL, root: str = ONNX_MODEL_DIR) -> str:
+    """Directory of the exported files of a model"""
+    return os.path.join(root, model_name.replace("/", "__"))
+
+
+def onnx_model_name(model_name: str = EMBEDDING_MODEL, quantized: bool = ONNX_QUANTIZED) -> str:
+    """Model name of the ONNX embeddings (kept apart from the torch vectors in caches and manifests)"""
+    return f"{model_name}-onnx-int8" if quantized else f"{model_name}-onnx"
+
+
+def export_onnx_model(model_name: str = EMBEDDING_MODEL, output_dir: Optional[str] = None) -> str:
+    """
+    Export a sentence-transformer model to ONNX and quantize it to int8
+
+    Args:
+        model_name: Sentence transformer model name
+        output_dir: Target directory (defaults to onnx_model_dir(model_name))
+
+    Returns:
+        Output directory
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    output_dir = output_dir or onnx_model_dir(model_name)
+    os.makedirs(output_dir, exist_ok=True)
+
+    model = SentenceTransformer(model_name, device="cpu")
+    model.eval()
+    transformer = model[0].auto_model
+    tokenizer = model.tokenizer
+
+    class LastHiddenState(torch.nn.Module):
+        """Transformer returning only the token embeddings (pooling is done in numpy)"""
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.auto_model(
+                input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids, return_dict=False
+            )[0]
+
+    sample = tokenizer(["an example sentence"], return_tensors="pt")
+    sample_inputs = (sample["input_ids"], sample["attention_mask"],
+                     sample.get("token_type_ids", torch.zeros_like(sample["input_ids"])))
+    float_path = os.path.join(output_dir, "model.onnx")
+    dynamic_axes = {"batch": 0, "tokens": 1}
+    with torch.no_grad():
+        torch.onnx.export(
+            LastHiddenState(transformer), sample_inputs, float_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: dynamic_axes for name in
+                          ("input_ids", "attention_mask", "token_type_ids", "last_hidden_state")},
+            opset_version=ONNX_OPSET
+        )
+    quantize_dynamic(float_path, os.path.join(output_dir, "model_int8.onnx"), weight_type=QuantType.QInt8)
+
+    # tokenizer.json is all the tokenizers library needs at runtime
+    tokenizer.save_pretrained(output_dir)
+    config = {
+        "model": model_name,
+        "max_seq_length": model.max_seq_length,
+        "dimension": model.get_sentence_embedding_dimension(),
+        "normalize": any(type(module).__name__ == "Normalize" for module in model),
+        "pad_token_id": tokenizer.pad_token_id or 0,
+        "pad_token": tokenizer.pad_token or "[PAD]"
+    }
+    with open(os.path.join(output_dir, "onnx_config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    return output_dir
+
+
+class OnnxEmbeddings:
+    """
+    Sentence embeddings from an exported ONNX model (same interface as OpenSourceEmbeddings)
+    """
+    def __init__(self, model_name: str = EMBEDDING_MODEL, quantized: bool = ONNX_QUANTIZED,
+                 model_dir: Optional[str] = None, threads: int = ONNX_THREADS):
+        """
+        Load the exported model, exporting it first when it is missing
+
+        Args:
+            model_name: Sentence transformer model the ONNX graph was exported from
+            quantized: Use the int8 graph instead of the float32 one
+            model_dir: Directory of the exported files (defaults to onnx_model_dir(model_name))
+            threads: intra-op threads (0 = ONNX Runtime default)
+        """
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        model_dir = model_dir or onnx_model_dir(model_name)
+        graph_file = "model_int8.onnx" if quantized else "model.onnx"
+        if not os.path.exists(os.path.join(model_dir, graph_file)):
+            export_onnx_model(model_name, model_dir)
+
+        with open(os.path.join(model_dir, "onnx_config.json"), encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.model_name = onnx_model_name(model_name, quantized)
+        self.normalize_default = self.config["normalize"]
+        self.last_throughput = 0.0  # chunks/sec of the most recent encode_batched call
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, graph_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        """Length of the embedding vectors"""
+        return self.config["dimension"]
+
+    def _encode(self, texts: List[str], normalize: bool) -> np.ndarray:
+        """Run one batch through the model: tokenize, infer, mean-pool"""
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        }
+        hidden = self.session.run(None, {name: value for name, value in inputs.items() if name in self.input_names})[0]
+
+        mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if normalize:
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Generate embedding for a single query
+
+        Args:
+            text: Input text to embed
+
+        Returns:
+            List of embedding values
+        """
+        return self._encode([text], self.normalize_default)[0].tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generate embeddings for multiple documents
+
+        Args:
+            texts: List of texts to embed
+
+        Returns:
+            List of embeddings
+        """
+        return self.encode_batched(texts, precision="float32").tolist()
+
+    def encode_batched(self, texts: List[str], batch_size: int = EMBED_BATCH_SIZE, sort_by_length: bool = True,
+                       normalize: bool = False, precision: str = EMBED_PRECISION,
+                       progress_callback: Optional[Callable[[int, int, float], None]] = None) -> np.ndarray:
+        """
+        Encode texts in explicit batches (see OpenSourceEmbeddings.encode_batched)
+
+        Args:
+            texts: List of texts to embed
+            batch_size: Number of texts per model call
+            sort_by_length: Group texts of similar length into the same batch
+            normalize: L2-normalize the embeddings (models that normalize always do)
+            precision: Output dtype - "float32", "float16" or "int8"
+            progress_callback: Called as (done, total, chunks_per_second) after every batch
+
+        Returns:
+            Matrix of shape (len(texts), dimension)
+        """
+        texts = list(texts)
+        total = len(texts)
+        output = np.empty((total, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        if total == 0:
+            return quantize_embeddings(output, precision)
+
+        if sort_by_length:
+            order = np.argsort([-len(text) for text in texts], kind="stable")
+        else:
+            order = np.arange(total)
+
+        start = time.perf_counter()
+        done = 0
+        for batch_start in range(0, total, batch_size):
+            batch_idx = order[batch_start:batch_start + batch_size]
+            output[batch_idx] = self._encode([texts[i] for i in batch_idx], normalize or self.normalize_default)
+            done += len(batch_idx)
+            self.last_throughput = done / max(time.perf_counter() - start, 1e-9)
+            if progress_callback:
+                progress_callback(done, total, self.last_throughput)
+
+        return quantize_embeddings(output, precision)
+
+
+if __name__ == "__main__":
+    print(f"✅ Exported {EMBEDDING_MODEL} to {export_onnx_model(EMBEDDING_MODEL)}")
@@ -1,15 +1,160 @@
 import os
+import time
+import asyncio
+import threading
+import weakref
 import openai
 import requests
+import httpx
 import json
-from sentence_transformers import SentenceTransformer
-from typing import List, Optional
+from requests.adapters import HTTPAdapter
+from typing import Callable, List, Optional
 import numpy as np
 from dotenv import load_dotenv
+from modules.model.rate_limiter import LLMRequestError, estimate_request_tokens, get_scheduler, parse_retry_after
 
 # Load environment variables from .env file
 load_dotenv()
 
+ANTHROPIC_MESSAGES_URL = "https://api.anthropic.com/v1/messages"
+
+# Connection pool / timeout defaults shared by the sync and async clients
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "120"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+
+# Mark the system block of Anthropic requests as a prompt-cache breakpoint
+ANTHROPIC_PROMPT_CACHING = os.getenv("ANTHROPIC_PROMPT_CACHING", "true").lower() == "true"
+
+# Sentence-transformer model of the document and regulation embeddings
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# "torch" (sentence-transformers) or "onnx" (ONNX Runtime, int8 - see modules/model/onnx_embeddings.py)
+EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "torch").lower()
+
+# Batched document encoding defaults
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_PRECISION = os.getenv("EMBED_PRECISION", "float32").lower()
+
+# Cross-encoder used to rerank retrieved chunks
+RERANK_MODEL = os.getenv("GAP_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_BATCH_SIZE = int(os.getenv("GAP_RERANK_BATCH_SIZE", "128"))
+
+
+def quantize_embeddings(embeddings: np.ndarray, precision: str = "float32") -> np.ndarray:
+    """
+    Convert float32 embeddings to a smaller output precision
+    
+    int8 uses one symmetric scale for the whole matrix, so cosine similarities
+    between rows are preserved up to rounding.
+    
+    Args:
+        embeddings: float32 matrix
+        precision: "float32", "float16" or "int8"
+        
+    Returns:
+        Matrix in the requested dtype
+    """
+    if precision == "float32":
+        return embeddings
+    if precision == "float16":
+        return embeddings.astype(np.float16)
+    if precision == "int8":
+        max_abs = float(np.abs(embeddings).max()) if embeddings.size else 0.0
+        scale = 127.0 / max_abs if max_abs > 0 else 1.0
+        return np.clip(np.rint(embeddings * scale), -127, 127).astype(np.int8)
+    raise ValueError(f"Unsupported embedding precision: {precision}")
+
+
+def create_http_session(pool_size: int = LLM_MAX_CONCURRENCY) -> requests.Session:
+    """
+    Create a requests session that keeps TCP/TLS connections alive between calls
+    
+    Args:
+        pool_size: Maximum number of pooled connections per host
+        
+    Returns:
+        requests.Session instance
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return session
+
+
+def restart_notifier(on_restart: Optional[Callable[[], None]]) -> Callable[[], None]:
+    """
+    Callable to run at the start of every attempt of a streamed request
+    
+    The scheduler may retry a stream that already delivered text; from the
+    second attempt on, on_restart tells the consumer to discard that text.
+    
+    Args:
+        on_restart: Callback of the stream consumer (or None)
+        
+    Returns:
+        Zero-argument callable
+    """
+    attempts = 0
+    
+    def begin_attempt():
+        nonlocal attempts
+        if attempts and on_restart:
+            on_restart()
+        attempts += 1
+    
+    return begin_attempt
+
+
+class AsyncHTTPPool:
+    """
+    Shared keep-alive httpx.AsyncClient plus a concurrency semaphore for async LLM calls
+    
+    asyncio objects are bound to the event loop that first uses them, so one
+    client/semaphore pair is kept per running loop. Every coroutine running on
+    the same loop shares the same connection pool.
+    """
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, timeout: float = LLM_REQUEST_TIMEOUT):
+        """
+        Initialize the pool
+        
+        Args:
+            max_concurrency: Maximum number of requests in flight per event loop
+            timeout: Request timeout in seconds
+        """
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._per_loop = weakref.WeakKeyDictionary()
+    
+    def get(self):
+        """
+        Get the (client, semaphore) pair for the running event loop
+        
+        Returns:
+            Tuple of httpx.AsyncClient and asyncio.Semaphore
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._per_loop.get(loop)
+            if entry is None or entry[0].is_closed:
+                client = httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=self.max_concurrency,
+                        max_keepalive_connections=self.max_concurrency
+                    ),
+                    timeout=httpx.Timeout(self.timeout, connect=10.0)
+                )
+                entry = (client, asyncio.Semaphore(self.max_concurrency))
+                self._per_loop[loop] = entry
+        return entry
+    
+    async def aclose(self):
+        """Close the client bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._per_loop.pop(loop, None)
+        if entry is not None:
+            await entry[0].aclose()
+
 class OpenSourceEmbeddings:
     """
     Open source embeddings using Sentence Transformers
@@ -22,7 +167,12 @@ class OpenSourceEmbeddings:
             model_name: Name of the sentence transformer model to use
                       Options: 'all-MiniLM-L6-v2', 'all-mpnet-base-v2', 'paraphrase-multilingual-MiniLM-L12-v2'
         """
+        # Imported here so the ONNX backend never loads torch
+        from sentence_transformers import SentenceTransformer
+        
+        self.model_name = model_name
         self.model = SentenceTransformer(model_name)
+        self.last_throughput = 0.0  # chunks/sec of the most recent encode_batched call
         
     def embed_query(self, text: str) -> List[float]:
         """
@@ -47,8 +197,113 @@ class OpenSourceEmbeddings:
         Returns:
             List of embeddings
         """
-        embeddings = self.model.encode(texts)
+        # Vector stores expect plain floats, whatever EMBED_PRECISION is set to
+        embeddings = self.encode_batched(texts, precision="float32")
         return embeddings.tolist()
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        """Length of the embedding vectors"""
+        return self.model.get_sentence_embedding_dimension()
+    
+    def encode_batched(self, texts: List[str], batch_size: int = EMBED_BATCH_SIZE, sort_by_length: bool = True,
+                       normalize: bool = False, precision: str = EMBED_PRECISION,
+                       progress_callback: Optional[Callable[[int, int, float], None]] = None) -> np.ndarray:
+        """
+        Encode texts in explicit batches
+        
+        Texts are ordered longest-first before batching so each batch holds texts
+        of similar length (less padding), and results are written back in the
+        original order.
+        
+        Args:
+            texts: List of texts to embed
+            batch_size: Number of texts per model call
+            sort_by_length: Group texts of similar length into the same batch
+            normalize: L2-normalize the embeddings
+            precision: Output dtype - "float32", "float16" or "int8"
+            progress_callback: Called as (done, total, chunks_per_second) after every batch
+            
+        Returns:
+            Matrix of shape (len(texts), dimension)
+        """
+        texts = list(texts)
+        total = len(texts)
+        dimension = self.get_sentence_embedding_dimension()
+        output = np.empty((total, dimension), dtype=np.float32)
+        if total == 0:
+            return quantize_embeddings(output, precision)
+        
+        if sort_by_length:
+            order = np.argsort([-len(text) for text in texts], kind="stable")
+        else:
+            order = np.arange(total)
+        
+        start = time.perf_counter()
+        done = 0
+        for batch_start in range(0, total, batch_size):
+            batch_idx = order[batch_start:batch_start + batch_size]
+            output[batch_idx] = self.model.encode(
+                [texts[i] for i in batch_idx],
+                batch_size=len(batch_idx),
+                normalize_embeddings=normalize,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+            done += len(batch_idx)
+            self.last_throughput = done / max(time.perf_counter() - start, 1e-9)
+            if progress_callback:
+                progress_callback(done, total, self.last_throughput)
+        
+        return quantize_embeddings(output, precision)
+
+class CrossEncoderReranker:
+    """
+    Local cross-encoder scoring (query, passage) pairs for reranking
+    """
+    def __init__(self, model_name: str = RERANK_MODEL):
+        """
+        Initialize the cross-encoder model
+        
+        Args:
+            model_name: Name of the sentence-transformers cross-encoder model
+        """
+        from sentence_transformers import CrossEncoder
+        
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name)
+        self.last_throughput = 0.0  # pairs/sec of the most recent score_pairs call
+    
+    def score_pairs(self, pairs: List[tuple], batch_size: int = RERANK_BATCH_SIZE) -> np.ndarray:
+        """
+        Relevance scores for many (query, passage) pairs
+        
+        Pairs are ordered longest-first before batching (less padding per batch),
+        and scores are returned in the original order.
+        
+        Args:
+            pairs: List of (query text, passage text)
+            batch_size: Number of pairs per model call
+            
+        Returns:
+            float32 array with one score per pair (higher is more relevant)
+        """
+        pairs = list(pairs)
+        scores = np.empty(len(pairs), dtype=np.float32)
+        if not pairs:
+            return scores
+        
+        order = np.argsort([-(len(query) + len(passage)) for query, passage in pairs], kind="stable")
+        start = time.perf_counter()
+        for batch_start in range(0, len(pairs), batch_size):
+            batch_idx = order[batch_start:batch_start + batch_size]
+            scores[batch_idx] = self.model.predict(
+                [list(pairs[i]) for i in batch_idx],
+                batch_size=len(batch_idx),
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+        self.last_throughput = len(pairs) / max(time.perf_counter() - start, 1e-9)
+        return scores
 
 class OpenAILLM:
     """
@@ -69,8 +324,165 @@ class OpenAILLM:
             raise ValueError("OpenAI API key is required. Set OPENAI_API_KEY environment variable or pass api_key parameter.")
             
         openai.api_key = self.api_key
+        # Retries are handled by the shared scheduler, not by the SDK
+        self._client = openai.OpenAI(api_key=self.api_key, max_retries=0, timeout=LLM_REQUEST_TIMEOUT)
+        self._async_pool = AsyncHTTPPool()
+        self.scheduler = get_scheduler("openai")
+    
+    @staticmethod
+    def _request_error(e: Exception) -> LLMRequestError:
+        """Convert an OpenAI SDK exception into an LLMRequestError the scheduler can classify"""
+        if isinstance(e, openai.APIStatusError):
+            return LLMRequestError(str(e), e.status_code, parse_retry_after(e.response.headers.get("retry-after")))
+        if isinstance(e, openai.APIConnectionError):
+            return LLMRequestError(str(e))
+        return LLMRequestError(str(e), status_code=-1)
+    
+    @staticmethod
+    def _messages(question, system):
+        """Chat messages with the optional static instructions as a system message first"""
+        messages = [{"role": "system", "content": system}] if system else []
+        return messages + [{"role": "user", "content": question}]
+    
+    def _request_args(self, question, temperature, max_tokens, system, tool):
+        """
+        Keyword arguments of chat.completions.create
+        
+        A tool definition (name, description, input_schema) becomes a function
+        the model is forced to call.
+        """
+        args = {
+            "model": self.model,
+            "messages": self._messages(question, system),
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        if tool:
+            args["tools"] = [{
+                "type": "function",
+                "function": {
+                    "name": tool["name"],
+                    "description": tool["description"],
+                    "parameters": tool["input_schema"]
+                }
+            }]
+            args["tool_choice"] = {"type": "function", "function": {"name": tool["name"]}}
+        return args
+    
+    @staticmethod
+    def _parse_completion(response):
+        """
+        Extract the text (or the forced tool call's JSON arguments) and token usage from a chat completion
+        
+        Returns:
+            Tuple ((text, usage), total tokens used) - the shape LLMScheduler.call expects
+        """
+        choice = response.choices[0]
+        if choice.message.tool_calls:
+            text = choice.message.tool_calls[0].function.arguments
+        else:
+            text = choice.message.content
+        return OpenAILLM._completion_result(text, choice.finish_reason, getattr(response, "usage", None))
+    
+    @staticmethod
+    def _delta_text(delta):
+        """Text of a streamed delta: content, or the next fragment of the tool call's JSON arguments"""
+        if delta.content:
+            return delta.content
+        if delta.tool_calls:
+            return "".join(call.function.arguments or "" for call in delta.tool_calls if call.function)
+        return ""
+    
+    @staticmethod
+    def _completion_result(text, finish_reason, usage):
+        """Build ((text, usage dict), total tokens) from a completion's parts (shared by plain and streamed calls)"""
+        # OpenAI caches long prompt prefixes automatically and reports the cached part
+        details = getattr(usage, "prompt_tokens_details", None) if usage is not None else None
+        usage_info = {
+            "input_tokens": usage.prompt_tokens if usage is not None else None,
+            "output_tokens": usage.completion_tokens if usage is not None else None,
+            "cache_read_tokens": (getattr(details, "cached_tokens", None) or 0) if details is not None else 0,
+            "cache_write_tokens": 0,
+            "stop_reason": "max_tokens" if finish_reason == "length" else finish_reason
+        }
+        return (text, usage_info), (usage.total_tokens if usage is not None else None)
+    
+    def ask_llm_with_usage(self, question: str, temperature: float = 0.7, max_tokens: int = 4096,
+                           system: Optional[str] = None, tool: Optional[dict] = None):
+        """
+        Send a question to OpenAI API and report token usage
+        
+        The request goes through the shared scheduler (rate limits, in-flight cap,
+        retries with backoff).
+        
+        Args:
+            question: The prompt/question to send
+            temperature: Controls randomness (0.0 to 1.0)
+            max_tokens: Maximum tokens in response
+            system: Optional static instructions sent ahead of the question
+            tool: Optional tool definition (name, description, input_schema); the model is
+                  forced to call it and the JSON tool input is returned as the response text
+            
+        Returns:
+            Tuple (response text, usage dict with input_tokens, output_tokens,
+            cache_read_tokens, cache_write_tokens and stop_reason)
+        """
+        def send():
+            try:
+                response = self._client.chat.completions.create(
+                    **self._request_args(question, temperature, max_tokens, system, tool)
+                )
+            except openai.OpenAIError as e:
+                raise self._request_error(e) from e
+            return self._parse_completion(response)
+        
+        return self.scheduler.call(send, estimate_request_tokens((system or "") + question, max_tokens))
     
-    def ask_llm(self, question: str, temperature: float = 0.7, max_tokens: int = 4096) -> str:
+    def stream_llm_with_usage(self, question: str, temperature: float = 0.7, max_tokens: int = 4096,
+                              system: Optional[str] = None, on_text: Optional[Callable[[str], None]] = None,
+                              on_restart: Optional[Callable[[], None]] = None, tool: Optional[dict] = None):
+        """
+        Streaming variant of ask_llm_with_usage
+        
+        on_text receives every text delta as it arrives (on the calling thread).
+        When the scheduler retries after text was already delivered, on_restart
+        is called first so the consumer can discard it.
+        
+        Returns:
+            Tuple (full response text, usage dict) - the same as ask_llm_with_usage
+        """
+        begin_attempt = restart_notifier(on_restart)
+        
+        def send():
+            begin_attempt()
+            text_parts = []
+            finish_reason = usage = None
+            try:
+                chunks = self._client.chat.completions.create(
+                    **self._request_args(question, temperature, max_tokens, system, tool),
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                for chunk in chunks:
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    text = self._delta_text(choice.delta)
+                    if text:
+                        text_parts.append(text)
+                        if on_text:
+                            on_text(text)
+                    finish_reason = choice.finish_reason or finish_reason
+            except openai.OpenAIError as e:
+                raise self._request_error(e) from e
+            return self._completion_result("".join(text_parts), finish_reason, usage)
+        
+        return self.scheduler.call(send, estimate_request_tokens((system or "") + question, max_tokens))
+    
+    def ask_llm(self, question: str, temperature: float = 0.7, max_tokens: int = 4096,
+                system: Optional[str] = None) -> str:
         """
         Send a question to OpenAI API
         
@@ -78,22 +490,170 @@ class OpenAILLM:
             question: The prompt/question to send
             temperature: Controls randomness (0.0 to 1.0)
             max_tokens: Maximum tokens in response
+            system: Optional static instructions sent ahead of the question
             
         Returns:
             Response from the model
         """
         try:
-            response = openai.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": question}],
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
-            return response.choices[0].message.content
+            return self.ask_llm_with_usage(question, temperature, max_tokens, system)[0]
             
         except Exception as e:
             print(f"Error calling OpenAI API: {e}")
             return "Error: Could not get response from OpenAI"
+    
+    async def ask_llm_with_usage_async(self, question: str, temperature: float = 0.7, max_tokens: int = 4096,
+                                       system: Optional[str] = None, tool: Optional[dict] = None):
+        """
+        Async twin of ask_llm_with_usage
+        
+        Requests share one keep-alive connection pool, are capped by the
+        pool's concurrency semaphore and go through the shared scheduler.
+        
+        Returns:
+            Tuple (response text, usage dict)
+        """
+        client, semaphore = self._async_pool.get()
+        async_openai = openai.AsyncOpenAI(api_key=self.api_key, http_client=client, max_retries=0)
+        
+        async def send():
+            try:
+                async with semaphore:
+                    response = await async_openai.chat.completions.create(
+                        **self._request_args(question, temperature, max_tokens, system, tool)
+                    )
+            except openai.OpenAIError as e:
+                raise self._request_error(e) from e
+            return self._parse_completion(response)
+        
+        return await self.scheduler.call_async(send, estimate_request_tokens((system or "") + question, max_tokens))
+    
+    async def stream_llm_with_usage_async(self, question: str, temperature: float = 0.7, max_tokens: int = 4096,
+                                          system: Optional[str] = None,
+                                          on_text: Optional[Callable[[str], None]] = None,
+                                          on_restart: Optional[Callable[[], None]] = None,
+                                          tool: Optional[dict] = None):
+        """
+        Async twin of stream_llm_with_usage (callbacks run on the event loop thread)
+        
+        Returns:
+            Tuple (full response text, usage dict)
+        """
+        client, semaphore = self._async_pool.get()
+        async_openai = openai.AsyncOpenAI(api_key=self.api_key, http_client=client, max_retries=0)
+        begin_attempt = restart_notifier(on_restart)
+        
+        async def send():
+            begin_attempt()
+            text_parts = []
+            finish_reason = usage = None
+            try:
+                async with semaphore:
+                    chunks = await async_openai.chat.completions.create(
+                        **self._request_args(question, temperature, max_tokens, system, tool),
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    )
+                    async for chunk in chunks:
+                        if chunk.usage is not None:
+                            usage = chunk.usage
+                        if not chunk.choices:
+                            continue
+                        choice = chunk.choices[0]
+                        text = self._delta_text(choice.delta)
+                        if text:
+                            text_parts.append(text)
+                            if on_text:
+                                on_text(text)
+                        finish_reason = choice.finish_reason or finish_reason
+            except openai.OpenAIError as e:
+                raise self._request_error(e) from e
+            return self._completion_result("".join(text_parts), finish_reason, usage)
+        
+        return await self.scheduler.call_async(send, estimate_request_tokens((system or "") + question, max_tokens))
+    
+    async def ask_llm_async(self, question: str, temperature: float = 0.7, max_tokens: int = 4096,
+                            system: Optional[str] = None) -> str:
+        """
+        Send a question to OpenAI API without blocking the event loop
+        
+        Args:
+            question: The prompt/question to send
+            temperature: Controls randomness (0.0 to 1.0)
+            max_tokens: Maximum tokens in response
+            system: Optional static instructions sent ahead of the question
+            
+        Returns:
+            Response from the model
+        """
+        try:
+            return (await self.ask_llm_with_usage_async(question, temperature, max_tokens, system))[0]
+            
+        except Exception as e:
+            print(f"Error calling OpenAI API: {e}")
+            return "Error: Could not get response from OpenAI"
+    
+    async def aclose(self):
+        """Close the async connection pool of the running event loop"""
+        await self._async_pool.aclose()
+
+# Status codes for error events sent inside a Messages API stream (after the 200 response)
+ANTHROPIC_STREAM_ERROR_STATUS = {"overloaded_error": 529, "rate_limit_error": 429, "api_error": 500}
+
+
+class AnthropicStream:
+    """
+    Accumulates a Messages API event stream (SSE) into the text and usage of a whole message
+    """
+    def __init__(self):
+        self.text_parts = []
+        self.usage = {}
+        self.stop_reason = None
+    
+    def handle_line(self, line: str) -> Optional[str]:
+        """
+        Process one line of the event stream
+        
+        Args:
+            line: SSE line ("event: ...", "data: {...}" or empty)
+        
+        Returns:
+            The text delta carried by the line, or None
+        
+        Raises:
+            LLMRequestError for error events (e.g. overloaded while streaming)
+        """
+        if not line or not line.startswith("data:"):
+            return None
+        event = json.loads(line[len("data:"):])
+        event_type = event.get("type")
+        
+        if event_type == "content_block_delta":
+            delta = event.get("delta") or {}
+            if delta.get("type") == "text_delta":
+                self.text_parts.append(delta["text"])
+                return delta["text"]
+            if delta.get("type") == "input_json_delta":
+                # Forced tool use streams the tool input as JSON fragments
+                self.text_parts.append(delta["partial_json"])
+                return delta["partial_json"]
+        elif event_type == "message_start":
+            self.usage.update((event.get("message") or {}).get("usage") or {})
+        elif event_type == "message_delta":
+            # output_tokens here is the cumulative count for the message
+            self.usage.update(event.get("usage") or {})
+            self.stop_reason = (event.get("delta") or {}).get("stop_reason") or self.stop_reason
+        elif event_type == "error":
+            error = event.get("error") or {}
+            raise LLMRequestError(
+                f"Anthropic API stream error: {error}", ANTHROPIC_STREAM_ERROR_STATUS.get(error.get("type"), 500)
+            )
+        return None
+    
+    def result(self):
+        """((text, usage dict), used tokens) of the finished stream - the shape LLMScheduler.call expects"""
+        return AnthropicLLM._message_result("".join(self.text_parts), self.usage, self.stop_reason)
+
 
 class AnthropicLLM:
     """
@@ -112,75 +672,338 @@ class AnthropicLLM:
         
         if not self.api_key:
             raise ValueError("Anthropic API key is required. Set ANTHROPIC_API_KEY environment variable or pass api_key parameter.")
+        
+        self.timeout = LLM_REQUEST_TIMEOUT
+        self._session = create_http_session()
+        self._async_pool = AsyncHTTPPool()
+        self.scheduler = get_scheduler("anthropic")
     
-    def ask_llm(self, question: str, temperature: float = 0.7, max_tokens: int = 4096) -> str:
+    def _build_request(self, question: str, temperature: float, max_tokens: int, system: Optional[str] = None,
+                       stream: bool = False, tool: Optional[dict] = None):
         """
-        Send a question to Anthropic API
+        Build headers and JSON body for the Messages API
+        
+        The optional system block holds the static instructions and is marked
+        as a prompt-cache breakpoint, so repeated requests only pay full price
+        for the per-request message (prefixes shorter than the model's minimum
+        cacheable length are simply not cached).
+        """
+        headers = {
+            "x-api-key": self.api_key,
+            "content-type": "application/json",
+            "anthropic-version": "2023-06-01"
+        }
+        
+        data = {
+            "model": self.model,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "messages": [
+                {"role": "user", "content": question}
+            ]
+        }
+        if system:
+            system_block = {"type": "text", "text": system}
+            if ANTHROPIC_PROMPT_CACHING:
+                system_block["cache_control"] = {"type": "ephemeral"}
+            data["system"] = [system_block]
+        if stream:
+            data["stream"] = True
+        if tool:
+            # Forced tool use: the answer is the tool input, validated against its input_schema
+            data["tools"] = [tool]
+            data["tool_choice"] = {"type": "tool", "name": tool["name"]}
+        return headers, data
+    
+    def _parse_response(self, response):
+        """
+        Extract the text and token usage from a Messages API response
+        
+        Returns:
+            Tuple ((text, usage), input + output tokens) - the shape LLMScheduler.call expects
+            
+        Raises:
+            LLMRequestError with the status code and retry-after on API errors
+        """
+        if response.status_code == 200:
+            body = response.json()
+            return self._message_result(
+                self._content_text(body.get("content") or []), body.get("usage") or {}, body.get("stop_reason")
+            )
+        
+        self._raise_api_error(response)
+    
+    @staticmethod
+    def _content_text(content):
+        """Text of a message's content blocks; a tool_use block is returned as its JSON input"""
+        for block in content:
+            if block.get("type") == "tool_use":
+                return json.dumps(block.get("input"), ensure_ascii=False)
+        return "".join(block.get("text", "") for block in content if block.get("type") == "text")
+    
+    @staticmethod
+    def _message_result(text, usage, stop_reason):
+        """Build ((text, usage dict), input + output tokens) from a message's parts (plain or streamed)"""
+        # input_tokens only counts the uncached part; report the full prompt size plus the cache split
+        cache_read = usage.get("cache_read_input_tokens") or 0
+        cache_write = usage.get("cache_creation_input_tokens") or 0
+        prompt_tokens = usage.get("input_tokens", 0) + cache_read + cache_write if usage else None
+        usage_info = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": usage.get("output_tokens"),
+            "cache_read_tokens": cache_read,
+            "cache_write_tokens": cache_write,
+            "stop_reason": stop_reason
+        }
+        used_tokens = prompt_tokens + usage.get("output_tokens", 0) if usage else None
+        return (text, usage_info), used_tokens
+    
+    @staticmethod
+    def _raise_api_error(response):
+        """
+        Raise an LLMRequestError for a non-200 Messages API response
+        
+        The body must already be read (httpx streamed responses: await response.aread()).
+        """
+        error_msg = f"Anthropic API error: Status {response.status_code}"
+        try:
+            error_detail = response.json()
+            error_msg += f" - {error_detail}"
+        except:
+            error_msg += f" - {response.text[:500]}"
+        print(error_msg)
+        raise LLMRequestError(error_msg, response.status_code, parse_retry_after(response.headers.get("retry-after")))
+    
+    def ask_llm_with_usage(self, question: str, temperature: float = 0.7, max_tokens: int = 4096,
+                           system: Optional[str] = None, tool: Optional[dict] = None):
+        """
+        Send a question to Anthropic API and report token usage
+        
+        The request goes through the shared scheduler (rate limits, in-flight cap,
+        retries with backoff for 429/5xx/overloaded and connection errors).
         
         Args:
             question: The prompt/question to send
             temperature: Controls randomness (0.0 to 1.0)
             max_tokens: Maximum tokens in response
+            system: Optional static instructions sent ahead of the question
+            tool: Optional tool definition (name, description, input_schema); the model is
+                  forced to call it and the JSON tool input is returned as the response text
             
         Returns:
-            Response from the model
+            Tuple (response text, usage dict with input_tokens, output_tokens,
+            cache_read_tokens, cache_write_tokens and stop_reason)
         """
+        headers, data = self._build_request(question, temperature, max_tokens, system, tool=tool)
+        
+        def send():
+            try:
+                response = self._session.post(
+                    ANTHROPIC_MESSAGES_URL,
+                    headers=headers,
+                    json=data,
+                    timeout=self.timeout
+                )
+            except requests.exceptions.RequestException as e:
+                error_msg = f"Request error calling Anthropic API: {str(e)}"
+                print(error_msg)
+                raise LLMRequestError(error_msg) from e
+            return self._parse_response(response)
+        
         try:
-            headers = {
-                "x-api-key": self.api_key,
-                "content-type": "application/json",
-                "anthropic-version": "2023-06-01"
-            }
-            
-            data = {
-                "model": self.model,
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "messages": [
-                    {"role": "user", "content": question}
-                ]
-            }
-            
-            response = requests.post(
-                "https://api.anthropic.com/v1/messages",
-                headers=headers,
-                json=data
-            )
+            return self.scheduler.call(send, estimate_request_tokens((system or "") + question, max_tokens))
+        except Exception as e:
+            error_msg = f"Error calling Anthropic API: {str(e)}"
+            print(error_msg)
+            raise Exception(error_msg)
+    
+    def stream_llm_with_usage(self, question: str, temperature: float = 0.7, max_tokens: int = 4096,
+                              system: Optional[str] = None, on_text: Optional[Callable[[str], None]] = None,
+                              on_restart: Optional[Callable[[], None]] = None, tool: Optional[dict] = None):
+        """
+        Streaming variant of ask_llm_with_usage (server-sent events)
+        
+        on_text receives every text delta as it arrives (on the calling thread).
+        When the scheduler retries after text was already delivered, on_restart
+        is called first so the consumer can discard it.
+        
+        Returns:
+            Tuple (full response text, usage dict) - the same as ask_llm_with_usage
+        """
+        headers, data = self._build_request(question, temperature, max_tokens, system, stream=True, tool=tool)
+        begin_attempt = restart_notifier(on_restart)
+        
+        def send():
+            begin_attempt()
+            stream = AnthropicStream()
+            try:
+                with self._session.post(
+                    ANTHROPIC_MESSAGES_URL,
+                    headers=headers,
+                    json=data,
+                    timeout=self.timeout,
+                    stream=True
+                ) as response:
+                    if response.status_code != 200:
+                        self._raise_api_error(response)
+                    # text/event-stream has no charset parameter; the API always sends UTF-8
+                    response.encoding = "utf-8"
+                    for line in response.iter_lines(decode_unicode=True):
+                        text = stream.handle_line(line)
+                        if text and on_text:
+                            on_text(text)
+            except requests.exceptions.RequestException as e:
+                error_msg = f"Request error calling Anthropic API: {str(e)}"
+                print(error_msg)
+                raise LLMRequestError(error_msg) from e
+            return stream.result()
+        
+        try:
+            return self.scheduler.call(send, estimate_request_tokens((system or "") + question, max_tokens))
+        except Exception as e:
+            error_msg = f"Error calling Anthropic API: {str(e)}"
+            print(error_msg)
+            raise Exception(error_msg)
+    
+    def ask_llm(self, question: str, temperature: float = 0.7, max_tokens: int = 4096,
+                system: Optional[str] = None) -> str:
+        """
+        Send a question to Anthropic API
+        
+        Args:
+            question: The prompt/question to send
+            temperature: Controls randomness (0.0 to 1.0)
+            max_tokens: Maximum tokens in response
+            system: Optional static instructions sent ahead of the question
             
-            if response.status_code == 200:
-                return response.json()["content"][0]["text"]
-            else:
-                error_msg = f"Anthropic API error: Status {response.status_code}"
-                try:
-                    error_detail = response.json()
-                    error_msg += f" - {error_detail}"
-                except:
-                    error_msg += f" - {response.text[:500]}"
+        Returns:
+            Response from the model
+        """
+        return self.ask_llm_with_usage(question, temperature, max_tokens, system)[0]
+    
+    async def ask_llm_with_usage_async(self, question: str, temperature: float = 0.7, max_tokens: int = 4096,
+                                       system: Optional[str] = None, tool: Optional[dict] = None):
+        """
+        Async twin of ask_llm_with_usage
+        
+        Requests share one keep-alive connection pool, are capped by the
+        pool's concurrency semaphore and go through the shared scheduler.
+        
+        Returns:
+            Tuple (response text, usage dict)
+        """
+        client, semaphore = self._async_pool.get()
+        headers, data = self._build_request(question, temperature, max_tokens, system, tool=tool)
+        
+        async def send():
+            try:
+                async with semaphore:
+                    response = await client.post(ANTHROPIC_MESSAGES_URL, headers=headers, json=data)
+            except httpx.HTTPError as e:
+                error_msg = f"Request error calling Anthropic API: {str(e)}"
                 print(error_msg)
-                raise Exception(error_msg)
-                
-        except requests.exceptions.RequestException as e:
-            error_msg = f"Request error calling Anthropic API: {str(e)}"
+                raise LLMRequestError(error_msg) from e
+            return self._parse_response(response)
+        
+        try:
+            return await self.scheduler.call_async(send, estimate_request_tokens((system or "") + question, max_tokens))
+        except Exception as e:
+            error_msg = f"Error calling Anthropic API: {str(e)}"
             print(error_msg)
             raise Exception(error_msg)
+    
+    async def stream_llm_with_usage_async(self, question: str, temperature: float = 0.7, max_tokens: int = 4096,
+                                          system: Optional[str] = None,
+                                          on_text: Optional[Callable[[str], None]] = None,
+                                          on_restart: Optional[Callable[[], None]] = None,
+                                          tool: Optional[dict] = None):
+        """
+        Async twin of stream_llm_with_usage (callbacks run on the event loop thread)
+        
+        Returns:
+            Tuple (full response text, usage dict)
+        """
+        client, semaphore = self._async_pool.get()
+        headers, data = self._build_request(question, temperature, max_tokens, system, stream=True, tool=tool)
+        begin_attempt = restart_notifier(on_restart)
+        
+        async def send():
+            begin_attempt()
+            stream = AnthropicStream()
+            try:
+                async with semaphore:
+                    async with client.stream("POST", ANTHROPIC_MESSAGES_URL, headers=headers, json=data) as response:
+                        if response.status_code != 200:
+                            await response.aread()
+                            self._raise_api_error(response)
+                        async for line in response.aiter_lines():
+                            text = stream.handle_line(line)
+                            if text and on_text:
+                                on_text(text)
+            except httpx.HTTPError as e:
+                error_msg = f"Request error calling Anthropic API: {str(e)}"
+                print(error_msg)
+                raise LLMRequestError(error_msg) from e
+            return stream.result()
+        
+        try:
+            return await self.scheduler.call_async(send, estimate_request_tokens((system or "") + question, max_tokens))
         except Exception as e:
             error_msg = f"Error calling Anthropic API: {str(e)}"
             print(error_msg)
             raise Exception(error_msg)
+    
+    async def ask_llm_async(self, question: str, temperature: float = 0.7, max_tokens: int = 4096,
+                            system: Optional[str] = None) -> str:
+        """
+        Send a question to Anthropic API without blocking the event loop
+        
+        Args:
+            question: The prompt/question to send
+            temperature: Controls randomness (0.0 to 1.0)
+            max_tokens: Maximum tokens in response
+            system: Optional static instructions sent ahead of the question
+            
+        Returns:
+            Response from the model
+        """
+        return (await self.ask_llm_with_usage_async(question, temperature, max_tokens, system))[0]
+    
+    async def aclose(self):
+        """Close the async connection pool of the running event loop"""
+        await self._async_pool.aclose()
 
 # Factory functions for easy usage
-def create_embeddings(model_name: str = "all-MiniLM-L6-v2") -> OpenSourceEmbeddings:
+def create_embeddings(model_name: str = EMBEDDING_MODEL, backend: str = EMBEDDINGS_BACKEND):
     """
     Create embeddings instance
     
     Args:
         model_name: Sentence transformer model name
+        backend: "torch" (sentence-transformers) or "onnx" (ONNX Runtime, int8)
         
     Returns:
-        OpenSourceEmbeddings instance
+        OpenSourceEmbeddings or OnnxEmbeddings instance
     """
+    if backend == "onnx":
+        from modules.model.onnx_embeddings import OnnxEmbeddings
+        return OnnxEmbeddings(model_name)
+    if backend != "torch":
+        raise ValueError(f"Unsupported embeddings backend: {backend}")
     return OpenSourceEmbeddings(model_name)
 
+def create_reranker(model_name: str = RERANK_MODEL) -> CrossEncoderReranker:
+    """
+    Create cross-encoder reranker instance
+    
+    Args:
+        model_name: Cross-encoder model name
+        
+    Returns:
+        CrossEncoderReranker instance
+    """
+    return CrossEncoderReranker(model_name)
+
 def create_openai_llm(model: str = "gpt-4") -> OpenAILLM:
     """
     Create OpenAI LLM instance
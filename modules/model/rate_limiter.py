@@ -0,0 +1,361 @@
+"""
+Adaptive rate limiting and retry scheduling for LLM API calls
+
+Every LLM request goes through an LLMScheduler shared by all sessions and
+worker threads in the process (one per provider). The scheduler:
+
+- holds a token bucket for requests/min and one for tokens/min; a request
+  reserves its estimated tokens up front and the estimate is corrected with
+  the usage reported in the response (failed attempts give it back)
+- caps the number of requests in flight across threads and event loops
+- retries only retryable failures (429, 408, 409, 5xx, 529 overloaded,
+  connection errors) with exponential backoff and full jitter
+- honors retry-after: the whole scheduler pauses, so other threads stop
+  sending instead of collecting 429s of their own
+- halves its effective rate after a 429 and recovers gradually on success
+
+Limits are read from the environment when a scheduler is first created
+(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_MAX_IN_FLIGHT,
+LLM_MAX_RETRIES, LLM_BACKOFF_BASE_SECONDS, LLM_BACKOFF_MAX_SECONDS).
+A limit of 0 disables that bucket.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional, Tuple
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+# Rough characters-per-token ratio used to estimate prompt tokens before sending
+CHARS_PER_TOKEN = 4
+
+
+class LLMRequestError(Exception):
+    """
+    Failed LLM API request, carrying what the scheduler needs to decide on a retry
+    """
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        """
+        Args:
+            message: Error description
+            status_code: HTTP status code, or None for connection errors and timeouts
+            retry_after: Seconds to wait as requested by the server (retry-after header)
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        """Connection errors, rate limits, overload and server errors are retried"""
+        return self.status_code is None or self.status_code in RETRYABLE_STATUS_CODES
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """
+    Parse a retry-after header value
+
+    Args:
+        value: Header value - delay in seconds or an HTTP date (or None)
+
+    Returns:
+        Seconds to wait, or None when the header is missing or invalid
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_request_tokens(prompt: str, max_tokens: int) -> int:
+    """
+    Upper estimate of the tokens one request uses (prompt estimate + max_tokens)
+
+    Args:
+        prompt: Prompt text
+        max_tokens: Completion token limit of the request
+
+    Returns:
+        Estimated token count
+    """
+    return len(prompt) // CHARS_PER_TOKEN + max_tokens
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that hands out reservations
+
+    reserve() always takes the tokens immediately (the level may go negative)
+    and returns how long the caller has to wait, so waiting callers are served
+    in the order they reserved.
+    """
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate_per_minute: Refill rate
+            capacity: Burst size (defaults to one minute worth of tokens)
+        """
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now, scale):
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate_per_second * scale)
+        self._updated = now
+
+    def reserve(self, amount: float, scale: float = 1.0) -> float:
+        """
+        Take amount tokens
+
+        Args:
+            amount: Tokens to take (clamped to the capacity so one large request cannot block forever)
+            scale: Fraction of the nominal refill rate currently allowed
+
+        Returns:
+            Seconds to wait before using the reservation
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now, scale)
+            self._level -= min(amount, self.capacity)
+            if self._level >= 0:
+                return 0.0
+            return -self._level / (self.rate_per_second * scale)
+
+    def adjust(self, amount: float):
+        """Give back (positive) or take (negative) tokens after the real usage is known"""
+        with self._lock:
+            self._level = min(self.capacity, self._level + amount)
+
+
+class LLMScheduler:
+    """
+    Process-wide rate limiter, in-flight cap and retry policy for one LLM provider
+    """
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0, max_in_flight: int = 16,
+                 max_retries: int = 5, backoff_base: float = 1.0, backoff_max: float = 60.0):
+        """
+        Args:
+            requests_per_minute: Request rate limit (0 = unlimited)
+            tokens_per_minute: Token rate limit (0 = unlimited)
+            max_in_flight: Maximum concurrent requests across all threads and event loops
+            max_retries: Retries after the first attempt for retryable errors
+            backoff_base: First backoff step in seconds (doubled per attempt)
+            backoff_max: Upper bound for a single backoff
+        """
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._in_flight_changed = threading.Condition(self._lock)
+        self._pause_until = 0.0
+        self._rate_scale = 1.0
+        self._stats = {"requests": 0, "retries": 0, "rate_limited": 0, "failures": 0, "wait_seconds": 0.0}
+
+    # Admission -------------------------------------------------------------
+
+    def _reserve(self, estimated_tokens) -> float:
+        """Reserve one request and its tokens; returns the seconds to wait before sending"""
+        with self._lock:
+            scale = self._rate_scale
+            wait = max(0.0, self._pause_until - time.monotonic())
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.reserve(1, scale))
+        if self.token_bucket is not None and estimated_tokens:
+            wait = max(wait, self.token_bucket.reserve(estimated_tokens, scale))
+        if wait:
+            with self._lock:
+                self._stats["wait_seconds"] += wait
+        return wait
+
+    def _try_enter(self) -> bool:
+        """Take an in-flight slot if one is free (caller holds the lock)"""
+        if self._in_flight < self.max_in_flight:
+            self._in_flight += 1
+            return True
+        return False
+
+    def _enter(self):
+        with self._in_flight_changed:
+            while not self._try_enter():
+                self._in_flight_changed.wait()
+
+    async def _enter_async(self):
+        # A threading.Condition would block the event loop, so poll the shared counter
+        while True:
+            with self._lock:
+                if self._try_enter():
+                    return
+            await asyncio.sleep(0.05)
+
+    def _leave(self):
+        with self._in_flight_changed:
+            self._in_flight -= 1
+            self._in_flight_changed.notify()
+
+    # Outcome handling ------------------------------------------------------
+
+    def _on_success(self, estimated_tokens, used_tokens):
+        with self._lock:
+            self._stats["requests"] += 1
+            # Recover towards the nominal rate after a rate limit
+            self._rate_scale = min(1.0, self._rate_scale + 0.05)
+        if self.token_bucket is not None and estimated_tokens and used_tokens is not None:
+            self.token_bucket.adjust(estimated_tokens - used_tokens)
+
+    def _on_error(self, error, attempt, estimated_tokens=0) -> Optional[float]:
+        """
+        Give back the failed attempt's token reservation and decide whether to retry
+
+        Returns:
+            Seconds to wait before the next attempt, or None to give up
+        """
+        # API errors (rate limits, overload, connection failures, ...) come without usage:
+        # the server did not bill the tokens, and every retry reserves them again
+        if self.token_bucket is not None and estimated_tokens and isinstance(error, LLMRequestError):
+            self.token_bucket.adjust(min(estimated_tokens, self.token_bucket.capacity))
+
+        retryable = isinstance(error, LLMRequestError) and error.retryable
+        with self._lock:
+            if not retryable or attempt >= self.max_retries:
+                self._stats["failures"] += 1
+                return None
+
+            self._stats["retries"] += 1
+            # Exponential backoff with full jitter
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+            if error.status_code == 429:
+                self._stats["rate_limited"] += 1
+                self._rate_scale = max(0.1, self._rate_scale * 0.5)
+            if error.retry_after is not None:
+                delay = max(delay, min(error.retry_after, self.backoff_max))
+                # Everyone waits, not just this request
+                self._pause_until = max(self._pause_until, time.monotonic() + delay)
+            return delay
+
+    # Public API ------------------------------------------------------------
+
+    def call(self, send: Callable[[], Tuple[object, Optional[int]]], estimated_tokens: int = 0):
+        """
+        Run a request under the rate limits, retrying retryable failures
+
+        Args:
+            send: Zero-argument callable performing one attempt; returns (result, used tokens or None)
+                  and raises LLMRequestError on API failures
+            estimated_tokens: Token reservation for the tokens/min bucket
+
+        Returns:
+            The result returned by send
+        """
+        attempt = 0
+        while True:
+            wait = self._reserve(estimated_tokens)
+            if wait:
+                time.sleep(wait)
+
+            self._enter()
+            try:
+                result, used_tokens = send()
+                error = None
+            except Exception as e:
+                error = e
+            finally:
+                self._leave()
+
+            if error is None:
+                self._on_success(estimated_tokens, used_tokens)
+                return result
+
+            delay = self._on_error(error, attempt, estimated_tokens)
+            if delay is None:
+                raise error
+            time.sleep(delay)
+            attempt += 1
+
+    async def call_async(self, send, estimated_tokens: int = 0):
+        """
+        Async twin of call(); send is a zero-argument coroutine function
+
+        Waiting happens with asyncio.sleep, so the event loop keeps running.
+        """
+        attempt = 0
+        while True:
+            wait = self._reserve(estimated_tokens)
+            if wait:
+                await asyncio.sleep(wait)
+
+            await self._enter_async()
+            try:
+                result, used_tokens = await send()
+                error = None
+            except Exception as e:
+                error = e
+            finally:
+                self._leave()
+
+            if error is None:
+                self._on_success(estimated_tokens, used_tokens)
+                return result
+
+            delay = self._on_error(error, attempt, estimated_tokens)
+            if delay is None:
+                raise error
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> dict:
+        """
+        Counters since the scheduler was created
+
+        Returns:
+            Dictionary with requests, retries, rate_limited, failures, wait_seconds,
+            in_flight and rate_scale
+        """
+        with self._lock:
+            return dict(self._stats, in_flight=self._in_flight, rate_scale=self._rate_scale)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(provider: str) -> LLMScheduler:
+    """
+    Shared scheduler for one provider, configured from the environment on first use
+
+    Args:
+        provider: Provider name, e.g. "anthropic" or "openai"
+
+    Returns:
+        LLMScheduler instance
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(provider)
+        if scheduler is None:
+            scheduler = LLMScheduler(
+                requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "50")),
+                tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+                max_in_flight=int(os.getenv("LLM_MAX_IN_FLIGHT", os.getenv("LLM_MAX_CONCURRENCY", "16"))),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", "5")),
+                backoff_base=float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1")),
+                backoff_max=float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "60"))
+            )
+            _schedulers[provider] = scheduler
+        return scheduler
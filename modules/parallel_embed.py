@@ -0,0 +1,167 @@
+"""
+Multi-process sentence-transformer encoding
+
+One SentenceTransformer per worker process, each limited to a fixed number of
+torch/BLAS threads so N workers do not oversubscribe the CPU cores. Texts are
+sorted by length, cut into chunks and handed to the workers; results are
+written back into one preallocated float32 matrix in the original order.
+
+Worker processes are started with the "spawn" method (torch is not fork-safe)
+and load their model once, in the pool initializer. The OMP/MKL/OpenBLAS
+thread limits are put into the environment the workers inherit, because a
+spawned worker imports numpy before its initializer runs.
+"""
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from modules.model.open_source_llm import EMBED_BATCH_SIZE, EMBEDDING_MODEL
+
+# Texts per task handed to a worker (several model batches, so IPC overhead stays small)
+CHUNK_SIZE = 512
+
+_worker_model = None
+
+
+def _worker_environment(threads: int) -> dict:
+    """Environment the workers need at interpreter start (BLAS/OpenMP read it when numpy/torch are imported)"""
+    environment = {
+        variable: str(threads) for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+    }
+    environment["TOKENIZERS_PARALLELISM"] = "false"
+    return environment
+
+
+def _init_worker(model_name: str, threads: int):
+    """Pool initializer: pin torch's thread count, then load this worker's model"""
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+
+
+def _encode_chunk(texts: List[str], batch_size: int) -> np.ndarray:
+    """Encode one chunk with the worker's model"""
+    return _worker_model.encode(
+        texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False
+    ).astype(np.float32, copy=False)
+
+
+def default_processes() -> int:
+    """All available cores (CPU affinity aware)"""
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
+
+
+class MultiProcessEncoder:
+    """
+    Process pool encoding texts with one model per worker
+
+    Usable as a context manager; the pool (and the models) live until close().
+    """
+    def __init__(self, processes: Optional[int] = None, model_name: str = EMBEDDING_MODEL,
+                 threads_per_process: Optional[int] = None, batch_size: int = EMBED_BATCH_SIZE,
+                 chunk_size: int = CHUNK_SIZE):
+        """
+        Args:
+            processes: Number of worker processes (defaults to all cores)
+            model_name: Sentence transformer model name
+            threads_per_process: torch/BLAS threads per worker (defaults to cores // processes)
+            batch_size: Texts per model call inside a worker
+            chunk_size: Texts per task sent to a worker
+        """
+        self.processes = processes or default_processes()
+        self.threads_per_process = threads_per_process or max(1, default_processes() // self.processes)
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.last_throughput = 0.0  # texts/sec of the most recent encode call
+
+        # A spawned worker unpickles this module (and imports numpy) before the initializer runs,
+        # so the thread limits have to be in the environment it inherits. Workers are started
+        # on demand, so the variables stay set until close().
+        self._saved_environment = {}
+        for variable, value in _worker_environment(self.threads_per_process).items():
+            self._saved_environment[variable] = os.environ.get(variable)
+            os.environ[variable] = value
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, self.threads_per_process)
+        )
+
+    def warm_up(self):
+        """Start every worker and load its model (so load time is not counted as encoding time)"""
+        list(self._pool.map(_encode_chunk, [["warm up"]] * self.processes, [1] * self.processes))
+
+    def encode(self, texts: List[str],
+               progress_callback: Optional[Callable[[int, int, float], None]] = None) -> np.ndarray:
+        """
+        Encode texts across the worker processes
+
+        Args:
+            texts: List of texts to embed
+            progress_callback: Called as (done, total, texts_per_second) after every chunk
+
+        Returns:
+            float32 matrix of shape (len(texts), dimension), rows in input order
+        """
+        texts = list(texts)
+        total = len(texts)
+        if total == 0:
+            return np.empty((0, 0), dtype=np.float32)
+
+        # Longest first, so each chunk holds texts of similar length (less padding)
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        chunks = [order[start:start + self.chunk_size] for start in range(0, total, self.chunk_size)]
+
+        start = time.perf_counter()
+        output = None
+        done = 0
+        # map() yields results in submission order, whichever worker finishes first
+        results = self._pool.map(
+            _encode_chunk, [[texts[i] for i in chunk] for chunk in chunks], [self.batch_size] * len(chunks)
+        )
+        for chunk, vectors in zip(chunks, results):
+            if output is None:
+                output = np.empty((total, vectors.shape[1]), dtype=np.float32)
+            output[chunk] = vectors
+            done += len(chunk)
+            self.last_throughput = done / max(time.perf_counter() - start, 1e-9)
+            if progress_callback:
+                progress_callback(done, total, self.last_throughput)
+        return output
+
+    def encode_batched(self, texts: List[str], batch_size: Optional[int] = None, precision: str = "float32",
+                       progress_callback: Optional[Callable[[int, int, float], None]] = None, **_) -> np.ndarray:
+        """encode() with the keyword interface of OpenSourceEmbeddings.encode_batched (float32 only)"""
+        if precision != "float32":
+            raise ValueError("MultiProcessEncoder only returns float32 embeddings")
+        if batch_size:
+            self.batch_size = batch_size
+        return self.encode(texts, progress_callback=progress_callback)
+
+    def close(self):
+        """Shut the worker processes down and restore the environment"""
+        self._pool.shutdown()
+        for variable, value in self._saved_environment.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+        self._saved_environment = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,113 @@
+"""
+Progress reporting interface for the gap analysis core
+
+run_gap_analysis reports through a ProgressReporter instead of writing to
+Streamlit directly, so the same pipeline runs in the web app, the batch CLI
+and plain Python. Reporter methods are always called from the thread that
+called run_gap_analysis.
+"""
+
+import queue
+import threading
+
+
+class ProgressReporter:
+    """
+    Base reporter - ignores every event
+    """
+    def update(self, percent: int, message: str):
+        """
+        Report overall progress
+
+        Args:
+            percent: Progress from 0 to 100
+            message: Short status line
+        """
+        pass
+
+    def warning(self, message: str):
+        """Report a recoverable problem (e.g. one article failed)"""
+        pass
+
+    def rows(self, rows: list, columns: list):
+        """
+        Report the result rows available so far
+
+        Args:
+            rows: Rows of finished articles plus rows streamed in for articles still running,
+                  in regulation order
+            columns: Column names of the rows
+        """
+        pass
+
+    def finish(self):
+        """Called once when the run is over"""
+        pass
+
+
+class ConsoleProgressReporter(ProgressReporter):
+    """
+    Prints progress to stdout, one line per status change
+    """
+    _print_lock = threading.Lock()
+
+    def __init__(self, prefix: str = ""):
+        """
+        Initialize the reporter
+
+        Args:
+            prefix: Text printed in front of every line (e.g. document/regulation pair)
+        """
+        self.prefix = prefix
+        self._last_message = None
+
+    def _print(self, text):
+        with self._print_lock:
+            print(f"{self.prefix}{text}", flush=True)
+
+    def update(self, percent: int, message: str):
+        if message != self._last_message:
+            self._last_message = message
+            self._print(f"[{percent:3d}%] {message}")
+
+    def warning(self, message: str):
+        self._print(f"WARNING: {message}")
+
+
+class RowFeed:
+    """
+    Hands streamed result rows from worker threads to the calling thread
+
+    Workers call add() and reset(); the calling thread calls drain() and reads
+    rows_by_key, so reporters are still only called from the calling thread.
+    """
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self.rows_by_key = {}
+
+    def add(self, key, row):
+        """Append a row to the rows of key (any thread)"""
+        self._queue.put((key, row))
+
+    def reset(self, key):
+        """Withdraw all rows of key, e.g. because its request is sent again (any thread)"""
+        self._queue.put((key, None))
+
+    def drain(self) -> bool:
+        """
+        Apply the queued changes (calling thread)
+
+        Returns:
+            True if rows_by_key changed
+        """
+        changed = False
+        while True:
+            try:
+                key, row = self._queue.get_nowait()
+            except queue.Empty:
+                return changed
+            changed = True
+            if row is None:
+                self.rows_by_key.pop(key, None)
+            else:
+                self.rows_by_key.setdefault(key, []).append(row)
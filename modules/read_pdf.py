@@ -1,49 +1,223 @@
-from langchain_community.document_loaders import PDFMinerPDFasHTMLLoader
-from bs4 import BeautifulSoup
+"""
+FINMA circular PDFs -> regulation DataFrame (Title, SubTitle, Margin, Text)
+
+PDFs are read page by page with pdfminer's layout analysis: every text box
+becomes one (text, font size, 'B'/'N') snippet, and consecutive snippets with
+the same font are merged by chunk_snippets. No HTML is built, so memory stays
+bounded by the pages in flight, and pages can be extracted in parallel
+processes (PDF_PAGE_WORKERS).
+
+    python -m modules.read_pdf
+"""
+
+import os
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 import pandas as pd
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LAParams, LTAnno, LTChar, LTFigure, LTTextBox, LTTextLine
+from pdfminer.pdfpage import PDFPage
 
-def chunk_html_content(content):
+# Processes extracting pages in parallel (1 = in this process)
+PDF_PAGE_WORKERS = int(os.getenv("PDF_PAGE_WORKERS", "1"))
+# Pages per task handed to a worker
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+
+
+def _clean_snippet_text(text):
+    """Join hyphenated line breaks, flatten newlines, drop '*' and non-breaking spaces"""
+    return text.replace('-\n', '').replace('\n', ' ').replace("*",'').replace("\xa0", ' ')
+
+
+def text_box_snippet(box):
+    """
+    Snippet of one pdfminer text box (or figure with text)
+
+    Reproduces the text the HTML path (PDFMinerPDFasHTMLLoader + BeautifulSoup)
+    produced for the box's div, so article texts and hashes stay the same:
+    characters form one span per font run and every line ends with a line break;
+    the first span decides font size and weight, its strings are stripped,
+    joined without separator and cleaned, everything else is kept as parsed
+    (strings of ASCII whitespace collapse to "\n" or " " like in BeautifulSoup).
+
+    Args:
+        box: LTTextBox, or LTFigure (its characters are one run without line breaks)
+
+    Returns:
+        Tuple (text, font size, 'B' or 'N'), or None for boxes without characters
+        and margin numbers
+    """
+    # Strings as BeautifulSoup saw them: [span number (None outside any span), text];
+    # a new string starts at every span change and line break
+    strings = []
+    font = None
+    first_font = None
+    span = None
+    new_string = True
+    for line in ([box] if isinstance(box, LTFigure) else box):
+        if not isinstance(line, (LTTextLine, LTFigure)):
+            continue
+        for item in line:
+            if isinstance(item, LTChar):
+                if (item.fontname, item.size) != font:
+                    font = (item.fontname, item.size)
+                    span = 0 if span is None else span + 1
+                    first_font = first_font or font
+                    new_string = True
+            elif not isinstance(item, LTAnno):
+                continue
+            if new_string:
+                strings.append([span, ''])
+                new_string = False
+            strings[-1][1] += item.get_text()
+        if isinstance(line, LTTextLine):
+            new_string = True
+    if first_font is None:
+        return None
+
+    for string in strings:
+        if not string[1].strip(' \t\n\r\x0c'):
+            string[1] = '\n' if '\n' in string[1] else ' '
+
+    first_text = _clean_snippet_text(''.join(text.strip() for number, text in strings if number == 0))
+    if first_text.isdigit():
+        return None
+
+    before = ''.join(text for number, text in strings if number is None)
+    after = ''.join(text for number, text in strings if number is not None and number > 0)
+    fontname, size = first_font
+    return before + first_text + after, int(size), 'B' if 'Bold' in fontname else 'N'
+
+
+def page_snippets(page_layout):
+    """Yield the snippets of one page layout (LTPage), in pdfminer's reading order"""
+    for element in page_layout:
+        if isinstance(element, (LTTextBox, LTFigure)):
+            snippet = text_box_snippet(element)
+            if snippet:
+                yield snippet
+
+
+def _extract_page_range(path, page_numbers):
+    """Snippets of a range of pages (runs in a worker process)"""
+    return [
+        snippet
+        for page_layout in extract_pages(path, page_numbers=page_numbers, laparams=LAParams())
+        for snippet in page_snippets(page_layout)
+    ]
+
+
+def count_pages(path):
+    """Number of pages of a PDF (no layout analysis)"""
+    with open(path, 'rb') as fp:
+        return sum(1 for _ in PDFPage.get_pages(fp))
+
+
+def iter_pdf_snippets(path, workers=PDF_PAGE_WORKERS, pages_per_task=PDF_PAGES_PER_TASK):
+    """
+    Stream the text box snippets of a PDF, page by page
+
+    With several workers, page ranges are extracted in parallel processes; at
+    most 2 ranges per worker are in flight and results are yielded in page order.
+
+    Args:
+        path: PDF file
+        workers: Number of worker processes (1 = extract in this process)
+        pages_per_task: Pages per worker task
+
+    Yields:
+        Tuples (text, font size, 'B' or 'N')
+    """
+    if workers <= 1:
+        for page_layout in extract_pages(path, laparams=LAParams()):
+            yield from page_snippets(page_layout)
+        return
+
+    page_count = count_pages(path)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for start in range(0, page_count, pages_per_task):
+            pending.append(pool.submit(_extract_page_range, path, range(start, min(start + pages_per_task, page_count))))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def chunk_snippets(items):
+    """
+    Merge consecutive snippets with the same font size and weight
+
+    Args:
+        items: Iterable of (text, font size, 'B' or 'N')
+
+    Yields:
+        Merged (text, font size, 'B' or 'N') snippets, text boxes separated by "\\line "
+    """
     cur_fs = None
     cur_text = ''
     cur_ft=''
-    snippets = []   # first collect all snippets that have the same font size
-    for c in content:
-        sp = c.find('span')
-        if sp:
-            text = ''.join(sp.stripped_strings).replace('-\n', '').replace('\n', ' ').replace("*",'').replace("\xa0", ' ')
-            sp.string = text
-         
-        if not sp or sp.string.isdigit():
-            continue
-        st = sp.get('style')
-        if not st:
-            continue
-   
-        fs = re.findall('font-size:(\d+)px',st)
-        if 'Bold' in st:
-            ft='B'
-        else:
-            ft='N'
-        if not fs:
-            continue
-        fs = int(fs[0])
+    for text, fs, ft in items:
         if not cur_fs:
             cur_fs = fs
         if not cur_ft:
             cur_ft=ft
         if fs == cur_fs and ft==cur_ft:
-            cur_text += "\\line "+c.text
+            cur_text += "\\line "+text
             if "•" in cur_text or 'b)' in cur_text:
                cur_text=cur_text.replace("\\line ",' ').replace("•","\\line •").replace('participant.','participant.\\line')
         else:
-            snippets.append((cur_text,cur_fs,cur_ft))
+            yield (cur_text,cur_fs,cur_ft)
             cur_fs = fs
-            cur_text = c.text
+            cur_text = text
             cur_ft=ft
-    snippets.append((cur_text,cur_fs,cur_ft))
+    yield (cur_text,cur_fs,cur_ft)
+
 
-    return snippets
+def chunk_html_content(content):
+    """
+    Snippets of pdfminer HTML output (BeautifulSoup divs), for callers still using PDFMinerPDFasHTMLLoader
+    """
+    def html_items():
+        for c in content:
+            sp = c.find('span')
+            if sp:
+                text = ''.join(sp.stripped_strings).replace('-\n', '').replace('\n', ' ').replace("*",'').replace("\xa0", ' ')
+                sp.string = text
+
+            if not sp or sp.string.isdigit():
+                continue
+            st = sp.get('style')
+            if not st:
+                continue
+
+            fs = re.findall(r'font-size:(\d+)px',st)
+            if 'Bold' in st:
+                ft='B'
+            else:
+                ft='N'
+            if not fs:
+                continue
+            yield c.text, int(fs[0]), ft
+
+    return list(chunk_snippets(html_items()))
+
+
+def read_regulation_pdf(path, skip=0, workers=PDF_PAGE_WORKERS):
+    """
+    Regulation DataFrame of a FINMA circular PDF, streamed page by page
+
+    Args:
+        path: PDF file
+        skip: Number of leading merged snippets to drop (cover page, table of contents)
+        workers: Processes extracting pages in parallel
+
+    Returns:
+        DataFrame with columns Title, SubTitle, Margin, Text
+    """
+    return create_df(islice(chunk_snippets(iter_pdf_snippets(path, workers=workers)), skip, None))
 
 def create_df(snippets):
     finma_df = pd.DataFrame(columns=["Title","SubTitle","Margin", "Text"])
@@ -84,42 +258,21 @@ def create_df(snippets):
 
     return finma_df
 
-# =========================
-# Rregulloret ekzistuese
-# =========================
-
-loader_2017 = PDFMinerPDFasHTMLLoader("Data/Finma_EN/finma rs 2017 01 20200101.pdf")
-data_2017 = loader_2017.load()
-soup_2017 = BeautifulSoup(data_2017[0].page_content,'html.parser')
-content_2017 = soup_2017.find_all("div")
-snippets_2017=chunk_html_content(content_2017)
-df_2017=create_df(snippets_2017[141:])
-
-loader_2023 = PDFMinerPDFasHTMLLoader("Data/Finma_EN/finma rs 2023 01 20221207.pdf")
-data_2023 = loader_2023.load()
-soup_2023= BeautifulSoup(data_2023[0].page_content,'html.parser')
-content_2023= soup_2023.find_all("div")
-snippets_2023=chunk_html_content(content_2023)
-df_2023=create_df(snippets_2023[141:])
-
-loader_2008= PDFMinerPDFasHTMLLoader("Data/Finma_EN/ch-finma-circular-2008-21-en.pdf")
-data_2008 = loader_2008.load()
-soup_2008= BeautifulSoup(data_2008[0].page_content,'html.parser')
-content_2008= soup_2008.find_all("div")
-snippets_2008=chunk_html_content(content_2008)
-df_2008=create_df(snippets_2008)
-
-# =========================
-# Rregullorja e re: Operational Risk 2024
-# =========================
-
-loader_optional = PDFMinerPDFasHTMLLoader("Data/Finma_EN/op-risk.pdf")
-data_optional = loader_optional.load()
-soup_optional = BeautifulSoup(data_optional[0].page_content,'html.parser')
-content_optional = soup_optional.find_all("div")
-snippets_optional = chunk_html_content(content_optional)
-df_optional = create_df(snippets_optional)  # mund të përdorësh [141:] nëse të jep shumë tekste hyrëse
-
-# Ruaj në Excel
-df_optional.to_excel("Data/Finma_EN/splitted/finma_optional.xlsx", index=False)
 
+if __name__ == "__main__":
+    # =========================
+    # Rregulloret ekzistuese
+    # =========================
+
+    df_2017 = read_regulation_pdf("Data/Finma_EN/finma rs 2017 01 20200101.pdf", skip=141)
+    df_2023 = read_regulation_pdf("Data/Finma_EN/finma rs 2023 01 20221207.pdf", skip=141)
+    df_2008 = read_regulation_pdf("Data/Finma_EN/ch-finma-circular-2008-21-en.pdf")
+
+    # =========================
+    # Rregullorja e re: Operational Risk 2024
+    # =========================
+
+    df_optional = read_regulation_pdf("Data/Finma_EN/op-risk.pdf")  # mund të përdorësh skip=141 nëse të jep shumë tekste hyrëse
+
+    # Ruaj në Excel
+    df_optional.to_excel("Data/Finma_EN/splitted/finma_optional.xlsx", index=False)
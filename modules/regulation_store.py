@@ -0,0 +1,266 @@
+"""
+Compiled regulation store
+
+The regulation Excel files keep each article embedding as a stringified Python
+list, which is slow to read (openpyxl) and slow to parse (one literal per row).
+A compiled regulation is a directory with:
+
+    articles.parquet  - article metadata (Title, SubTitle, Margin, Text, ...) and the
+                        article Category (requirement/definition/scope/abrogated)
+    embeddings.npy    - contiguous float32 matrix, one row per article
+    meta.json         - source file hash, row count, embedding dimension and the
+                        embedding model of the vectors (from the embeddings manifest)
+
+load_regulation() memory-maps the compiled store when it is up to date and
+falls back to the Excel file otherwise.
+"""
+
+import ast
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from modules.article_classifier import ARTICLE_CLASSIFIER_EMBEDDINGS, CLASSIFIER_VERSION, classify_articles
+
+COMPILED_DIR = "Data/Finma_EN/compiled"
+
+# Regulation name (as shown in the UI) -> source Excel file
+REGULATION_FILES = {
+    'Circular 2023/1 Operational risks and resilience – banks': 'Data/Finma_EN/splitted/finma_optional.xlsx',
+    'Circular 2017/1 Corporate governance - banks': 'Data/Finma_EN/splitted/finma2017_open_source_embeddings.xlsx',
+    'Circular 2013/8 Market conduct rules': 'Data/Finma_EN/splitted/finma2013_market_conduct_embeddings.xlsx',
+}
+
+# Short regulation ID (for the command line and output file names) -> regulation name
+REGULATION_IDS = {
+    'finma-2023-1': 'Circular 2023/1 Operational risks and resilience – banks',
+    'finma-2017-1': 'Circular 2017/1 Corporate governance - banks',
+    'finma-2013-8': 'Circular 2013/8 Market conduct rules',
+}
+
+
+def _file_sha256(path):
+    """Hash a file in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _file_signature(path):
+    """Size and modification time (ns) of a file, the cheap check before hashing it"""
+    stat = os.stat(path)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def _parse_embedding_cell(value):
+    """Parse one Excel Embedding cell into a list of floats (None if empty/invalid)"""
+    if isinstance(value, (list, np.ndarray)):
+        return value
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        try:
+            return ast.literal_eval(value)
+        except Exception as e:
+            print(f"Error parsing embedding: {e}")
+            return None
+
+
+def embeddings_to_matrix(values):
+    """
+    Stack per-row embeddings into a float32 matrix
+
+    Rows without an embedding are filled with NaN so row positions stay aligned
+    with the article metadata.
+
+    Args:
+        values: Iterable of embedding cells (strings, lists, arrays or None)
+
+    Returns:
+        float32 numpy array of shape (rows, dim), or None if no row has an embedding
+    """
+    parsed = [_parse_embedding_cell(value) for value in values]
+    dim = next((len(item) for item in parsed if item is not None), None)
+    if dim is None:
+        return None
+
+    matrix = np.full((len(parsed), dim), np.nan, dtype=np.float32)
+    for position, item in enumerate(parsed):
+        if item is not None and len(item) == dim:
+            matrix[position] = item
+    return matrix
+
+
+def manifest_path(regulation_file):
+    """Manifest written by generate_embeddings.py next to an embeddings file (article hashes, model)"""
+    return str(regulation_file).replace('.xlsx', '.manifest.json')
+
+
+def _manifest_model(regulation_file):
+    """Embedding model recorded in the manifest of a regulation file, or None"""
+    path = manifest_path(regulation_file)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("model")
+
+
+def regulation_embedding_model(regulation_file):
+    """
+    Embedding model (and backend) the article vectors of a regulation were made with
+
+    Returns:
+        Model name as recorded by generate_embeddings.py (e.g. "all-MiniLM-L6-v2" or
+        "all-MiniLM-L6-v2-onnx-int8"), or None when unknown (files made before the
+        manifests, i.e. with the default torch model)
+    """
+    meta_file = os.path.join(compiled_path(regulation_file), "meta.json")
+    if os.path.exists(meta_file):
+        with open(meta_file, encoding="utf-8") as f:
+            model = json.load(f).get("embedding_model")
+        if model:
+            return model
+    return _manifest_model(regulation_file)
+
+
+def compiled_path(regulation_file):
+    """Directory holding the compiled form of a regulation Excel file"""
+    return os.path.join(COMPILED_DIR, Path(regulation_file).stem)
+
+
+def _normalise_metadata(df):
+    """Make object columns Parquet-friendly (Margin mixes ints and strings like '65*-67*')"""
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype == object or column == 'Margin':
+            df[column] = df[column].map(lambda value: None if pd.isna(value) else str(value))
+    return df
+
+
+def _example_embedder():
+    """Embedding function for the classifier's labeled examples (None unless the embedding check is on)"""
+    if not ARTICLE_CLASSIFIER_EMBEDDINGS:
+        return None
+    # Imported lazily - loading the embedding model is only needed for the embedding check
+    from modules.resources import get_embeddings
+    return get_embeddings().encode_batched
+
+
+def compile_regulation(regulation_file, output_dir=None):
+    """
+    Convert a regulation Excel file into the compiled Parquet + .npy format
+
+    Args:
+        regulation_file: Path to the regulation Excel file
+        output_dir: Target directory (defaults to compiled_path(regulation_file))
+
+    Returns:
+        Path of the compiled directory
+    """
+    output_dir = output_dir or compiled_path(regulation_file)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Taken before reading, so a file changed while compiling is compiled again next time
+    signature = _file_signature(regulation_file)
+    df = pd.read_excel(regulation_file)
+    matrix = None
+    if 'Embedding' in df.columns:
+        matrix = embeddings_to_matrix(df['Embedding'])
+        df = df.drop(columns=['Embedding'])
+    df['Category'] = classify_articles(df, matrix, embed_texts=_example_embedder())
+
+    _normalise_metadata(df).to_parquet(os.path.join(output_dir, "articles.parquet"), index=False)
+    if matrix is not None:
+        np.save(os.path.join(output_dir, "embeddings.npy"), matrix)
+
+    meta = {
+        "source": str(regulation_file),
+        "source_sha256": _file_sha256(regulation_file),
+        **signature,
+        "rows": len(df),
+        "dim": int(matrix.shape[1]) if matrix is not None else 0,
+        "classifier_version": CLASSIFIER_VERSION,
+        "embedding_model": _manifest_model(regulation_file)
+    }
+    with open(os.path.join(output_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    return output_dir
+
+
+def is_compiled(regulation_file):
+    """
+    Check whether an up-to-date compiled store exists for a regulation file
+
+    The source file is only hashed when its size or modification time differ
+    from the ones recorded in meta.json; when the hash still matches (file
+    touched but not changed) the new size and time are recorded.
+
+    Returns:
+        True if meta.json matches the current source file hash (or the source is gone)
+        and the articles were classified by the current classifier version
+    """
+    meta_file = os.path.join(compiled_path(regulation_file), "meta.json")
+    if not os.path.exists(meta_file):
+        return False
+    if not os.path.exists(regulation_file):
+        return True
+    with open(meta_file, encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("classifier_version") != CLASSIFIER_VERSION:
+        return False
+    signature = _file_signature(regulation_file)
+    if all(meta.get(key) == value for key, value in signature.items()):
+        return True
+    if meta.get("source_sha256") != _file_sha256(regulation_file):
+        return False
+    meta.update(signature)
+    try:
+        with open(meta_file, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+    except OSError:
+        pass  # read-only store: keep hashing on every load
+    return True
+
+
+def load_regulation(regulation_file, mmap=True):
+    """
+    Load a regulation's article metadata and embedding matrix
+
+    Uses the compiled store when it is up to date, otherwise reads the Excel file.
+
+    Args:
+        regulation_file: Path to the regulation Excel file
+        mmap: Memory-map the embedding matrix instead of reading it into RAM
+
+    Returns:
+        Tuple (DataFrame of articles with their Category, float32 embedding matrix or None).
+        Matrix rows line up with DataFrame rows; missing embeddings are NaN rows.
+    """
+    if is_compiled(regulation_file):
+        directory = compiled_path(regulation_file)
+        df = pd.read_parquet(os.path.join(directory, "articles.parquet"))
+        matrix_file = os.path.join(directory, "embeddings.npy")
+        matrix = np.load(matrix_file, mmap_mode='r' if mmap else None) if os.path.exists(matrix_file) else None
+        if 'Category' not in df.columns:
+            # Store compiled before articles were classified, whose source file is gone
+            df['Category'] = classify_articles(df, matrix, use_embeddings=False)
+        return df, matrix
+
+    print(f"No compiled store for {regulation_file}, reading Excel (run compile_regulations.py)")
+    df = pd.read_excel(regulation_file)
+    matrix = None
+    if 'Embedding' in df.columns:
+        matrix = embeddings_to_matrix(df['Embedding'])
+        df = df.drop(columns=['Embedding'])
+    # Rules only - the embedding check runs when the regulation is compiled
+    df['Category'] = classify_articles(df, matrix, use_embeddings=False)
+    return df, matrix
@@ -0,0 +1,181 @@
+"""
+Process-wide registry for heavy shared resources
+
+The embedding model (SentenceTransformer + torch), the reranking cross-encoder,
+the LLM client, the LLM response cache, the upload index manager and the run
+journal are created lazily on first use and then shared by every Streamlit
+session, worker thread and batch job in the process. Creation is guarded per resource, so concurrent first calls still load
+the model only once.
+
+The accessors are plain functions, so they can be used directly from Python
+or wrapped with st.cache_resource.
+"""
+
+import os
+import threading
+import time
+
+from modules.model.open_source_llm import create_embeddings, create_reranker, get_llm
+from modules.llm_cache import LLMResponseCache
+from modules.embedding_cache import CachedEmbeddings, EmbeddingCache
+from modules.upload_index import UploadIndexManager
+from modules.run_journal import RunJournal
+
+
+def current_rss_bytes():
+    """
+    Resident memory of this process in bytes
+
+    Returns:
+        RSS in bytes, or None when it cannot be determined on this platform
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is the peak, in bytes on macOS and kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+class ResourceRegistry:
+    """
+    Thread-safe, lazily initialized singletons keyed by name
+    """
+    def __init__(self):
+        self._resources = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, name, factory):
+        """
+        Get a resource, creating it with factory() on first use
+
+        Args:
+            name: Resource name
+            factory: Zero-argument callable that builds the resource
+
+        Returns:
+            The shared resource instance
+        """
+        if name in self._resources:
+            return self._resources[name]
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(name, threading.Lock())
+
+        with key_lock:
+            if name in self._resources:
+                return self._resources[name]
+
+            rss_before = current_rss_bytes()
+            start = time.perf_counter()
+            resource = factory()
+            load_seconds = time.perf_counter() - start
+            rss_after = current_rss_bytes()
+
+            rss_delta = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+            self._stats[name] = {
+                "load_seconds": load_seconds,
+                "rss_delta_bytes": rss_delta
+            }
+            self._resources[name] = resource
+
+            memory_note = f", +{rss_delta / 1024 / 1024:.0f} MB RSS" if rss_delta is not None else ""
+            print(f"Loaded shared resource '{name}' in {load_seconds:.1f}s{memory_note}")
+
+        return resource
+
+    def stats(self):
+        """
+        Load time and memory report for all loaded resources
+
+        Returns:
+            Dictionary with per-resource load_seconds / rss_delta_bytes and current rss_bytes
+        """
+        return {
+            "resources": {name: dict(values) for name, values in self._stats.items()},
+            "rss_bytes": current_rss_bytes()
+        }
+
+    def clear(self, name=None):
+        """Drop one resource (or all of them) so the next get() rebuilds it"""
+        with self._lock:
+            names = [name] if name is not None else list(self._resources)
+            for key in names:
+                self._resources.pop(key, None)
+                self._stats.pop(key, None)
+
+
+registry = ResourceRegistry()
+
+
+def get_embeddings():
+    """
+    Shared sentence-transformer embeddings (loaded once per process)
+
+    Document chunks go through the persistent chunk embedding cache unless
+    EMBEDDING_CACHE_ENABLED=false.
+    """
+    def build():
+        embeddings = create_embeddings()
+        if os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() != "true":
+            return embeddings
+        return CachedEmbeddings(embeddings, EmbeddingCache())
+
+    return registry.get("embeddings", build)
+
+
+def get_base_embeddings():
+    """
+    The shared embedding model without the chunk embedding cache
+
+    For regulation articles: they have their own store (the embedding files and
+    their manifest), and caching them per chunk would only fill the cache and
+    serve stale vectors where a fresh encode is wanted.
+    """
+    embeddings = get_embeddings()
+    return getattr(embeddings, "base", embeddings)
+
+
+def get_reranker():
+    """Shared cross-encoder for reranking retrieved chunks (loaded on first use)"""
+    return registry.get("reranker", create_reranker)
+
+
+def get_llm_client():
+    """Shared LLM client selected by LLM_PROVIDER"""
+    return registry.get("llm", get_llm)
+
+
+def get_llm_cache():
+    """Shared LLM response cache, or None when LLM_CACHE_ENABLED=false"""
+    def build():
+        if os.getenv("LLM_CACHE_ENABLED", "true").lower() != "true":
+            return None
+        return LLMResponseCache()
+
+    return registry.get("llm_cache", build)
+
+
+def get_upload_index_manager():
+    """Shared upload index manager with its background sweeper running"""
+    def build():
+        manager = UploadIndexManager()
+        manager.start_sweeper()
+        return manager
+
+    return registry.get("upload_index_manager", build)
+
+
+def get_run_journal():
+    """Shared checkpoint journal for resumable gap analysis runs"""
+    return registry.get("run_journal", RunJournal)
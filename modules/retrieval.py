@@ -0,0 +1,125 @@
+"""
+In-memory retrieval over document chunk embeddings
+
+Holds the chunk embeddings of one uploaded document as an L2-normalized NumPy
+matrix and answers the top-k query for every regulation article with a single
+matrix multiply + argpartition, instead of one vector-store round trip per
+article. Returns the same langchain Document objects that build_gap_prompt uses.
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+
+def normalize_rows(matrix):
+    """
+    L2-normalize the rows of a matrix (zero rows are left as zeros)
+
+    Args:
+        matrix: 2D array-like
+
+    Returns:
+        float32 numpy array with unit-length rows
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores, k):
+    """
+    Indices of the k highest scores per row, sorted by descending score
+
+    Args:
+        scores: 2D array (queries x candidates)
+        k: Number of results per row
+
+    Returns:
+        Tuple (indices, scores), both of shape (queries, min(k, candidates))
+    """
+    n_candidates = scores.shape[1]
+    k = min(k, n_candidates)
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(scores.dtype)
+
+    if k < n_candidates:
+        candidate_idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidate_idx = np.tile(np.arange(n_candidates), (scores.shape[0], 1))
+
+    candidate_scores = np.take_along_axis(scores, candidate_idx, axis=1)
+    order = np.argsort(-candidate_scores, axis=1)
+    return np.take_along_axis(candidate_idx, order, axis=1), np.take_along_axis(candidate_scores, order, axis=1)
+
+
+class InMemoryRetriever:
+    """
+    Cosine-similarity retriever over a fixed set of documents
+    """
+    def __init__(self, documents, embedding_matrix):
+        """
+        Initialize the retriever
+
+        Args:
+            documents: List of langchain Document objects
+            embedding_matrix: One embedding per document (rows aligned with documents)
+        """
+        self.documents = list(documents)
+        self.matrix = normalize_rows(embedding_matrix) if self.documents else np.empty((0, 0), dtype=np.float32)
+
+    @classmethod
+    def from_documents(cls, documents, embeddings):
+        """
+        Embed documents and build a retriever
+
+        Args:
+            documents: List of langchain Document objects
+            embeddings: Object with embed_documents(texts)
+
+        Returns:
+            InMemoryRetriever instance
+        """
+        documents = list(documents)
+        matrix = embeddings.embed_documents([doc.page_content for doc in documents]) if documents else []
+        return cls(documents, matrix)
+
+    def search_batch(self, query_matrix, k: int = 4) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k document indices and cosine scores for many queries at once
+
+        Args:
+            query_matrix: 2D array, one query embedding per row
+            k: Number of documents per query
+
+        Returns:
+            Tuple (indices, scores) of shape (queries, min(k, documents))
+        """
+        queries = normalize_rows(query_matrix)
+        if not self.documents:
+            empty = np.empty((queries.shape[0], 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        return top_k_indices(queries @ self.matrix.T, k)
+
+    def retrieve_batch(self, query_matrix, k: int = 4):
+        """
+        Top-k Documents for many queries at once
+
+        Args:
+            query_matrix: 2D array, one query embedding per row
+            k: Number of documents per query
+
+        Returns:
+            Tuple (list of Document lists, scores array)
+        """
+        indices, scores = self.search_batch(query_matrix, k)
+        return [[self.documents[i] for i in row] for row in indices], scores
+
+    def similarity_search_by_vector(self, embedding, k: int = 4):
+        """Single-query helper with the same signature as the Chroma method"""
+        results, _ = self.retrieve_batch(np.asarray(embedding, dtype=np.float32).reshape(1, -1), k)
+        return results[0]
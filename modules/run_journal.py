@@ -0,0 +1,230 @@
+"""
+Checkpoint journal for resumable gap analysis runs
+
+Each analyzed article's extracted rows are committed to a SQLite journal as
+soon as the article finishes, keyed by run ID. If a run dies halfway (API
+outage, crashed process, dropped Streamlit session), running the same
+document against the same regulation again resumes it: articles already in
+the journal are taken from there and only the remaining ones go to the LLM.
+
+The default run ID is a hash of the document content, the regulation, the
+LLM model and a fingerprint of the analysis settings and prompt templates, so
+a rerun of the same analysis finds its earlier run without the caller keeping
+state, while a changed setting or prompt starts a new run. Only runs that did
+not complete are resumed; rerunning a completed analysis starts over.
+Articles are keyed by margin plus a hash of the article text, so an article
+whose text changed in the regulation is analyzed again.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+DEFAULT_JOURNAL_PATH = os.getenv("RUN_JOURNAL_PATH", "cache/run_journal.sqlite3")
+# Runs not touched for this long are removed from the journal
+RUN_JOURNAL_RETENTION_DAYS = float(os.getenv("RUN_JOURNAL_RETENTION_DAYS", "7"))
+
+
+def make_config_fingerprint(settings: dict, *templates: str) -> str:
+    """
+    Fingerprint of the analysis settings and prompt templates of a run
+
+    Args:
+        settings: JSON-serializable settings that change the results (output format, gate, ...)
+        templates: Prompt templates used by the run
+
+    Returns:
+        Hex digest (first 16 characters of SHA-256)
+    """
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode("utf-8"))
+    for template in templates:
+        digest.update(b"\0")
+        digest.update(template.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def make_run_id(document_bytes: bytes, regulation_name: str, model_name: str = "", config: str = "") -> str:
+    """
+    Build the default run ID for a (document, regulation, model, settings) combination
+
+    Args:
+        document_bytes: Raw document bytes
+        regulation_name: Name of the regulation
+        model_name: LLM model used for the analysis
+        config: Settings/prompt fingerprint (see make_config_fingerprint)
+
+    Returns:
+        Hex digest (first 32 characters of SHA-256)
+    """
+    digest = hashlib.sha256()
+    for part in (model_name.encode("utf-8"), regulation_name.encode("utf-8"), config.encode("utf-8"),
+                 document_bytes):
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+def make_article_key(margin: str, full_text: str) -> str:
+    """
+    Journal key of one article within a run
+
+    Args:
+        margin: Article margin number
+        full_text: Article text as sent to the LLM
+
+    Returns:
+        "<margin>:<text hash>"
+    """
+    return f"{margin}:{hashlib.sha256(full_text.encode('utf-8')).hexdigest()[:16]}"
+
+
+class RunJournal:
+    """
+    Append-only SQLite journal of completed articles per run
+    """
+    def __init__(self, path: str = DEFAULT_JOURNAL_PATH, retention_days: float = RUN_JOURNAL_RETENTION_DAYS):
+        """
+        Open (or create) the journal
+
+        Args:
+            path: SQLite file path
+            retention_days: Runs not updated for this many days are pruned on start_run()
+        """
+        self.path = path
+        self.retention_seconds = retention_days * 24 * 3600
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                document_name TEXT,
+                regulation_name TEXT,
+                total_articles INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                started REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS articles (
+                run_id TEXT NOT NULL,
+                article_key TEXT NOT NULL,
+                margin TEXT NOT NULL,
+                rows TEXT NOT NULL,
+                completed REAL NOT NULL,
+                PRIMARY KEY (run_id, article_key)
+            )
+        """)
+        self._conn.commit()
+
+    def start_run(self, run_id: str, total_articles: int, document_name: str = "", regulation_name: str = "",
+                  resume: bool = True) -> Dict[str, List[list]]:
+        """
+        Register a run and return the articles an interrupted earlier attempt completed
+
+        A run whose earlier attempt completed is started over (its checkpoints are
+        discarded), so rerunning a finished analysis really analyzes again.
+
+        Args:
+            run_id: Run ID (see make_run_id)
+            total_articles: Number of articles in this run
+            document_name: Document name, for list_runs()
+            regulation_name: Regulation name, for list_runs()
+            resume: False discards earlier checkpoints of this run and starts over
+
+        Returns:
+            Dictionary article_key -> result rows for the completed articles
+            (empty unless an earlier attempt was interrupted or incomplete)
+        """
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            previous = self._conn.execute("SELECT status FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            if not resume or (previous is not None and previous[0] == "completed"):
+                self._conn.execute("DELETE FROM articles WHERE run_id = ?", (run_id,))
+            self._conn.execute(
+                """
+                INSERT INTO runs VALUES (?, ?, ?, ?, 'running', ?, ?)
+                ON CONFLICT(run_id) DO UPDATE SET
+                    total_articles = excluded.total_articles, status = 'running', updated = excluded.updated
+                """,
+                (run_id, document_name, regulation_name, total_articles, now, now)
+            )
+            self._conn.commit()
+            return {
+                article_key: json.loads(rows)
+                for article_key, rows in self._conn.execute(
+                    "SELECT article_key, rows FROM articles WHERE run_id = ?", (run_id,)
+                )
+            }
+
+    def record_article(self, run_id: str, article_key: str, margin: str, rows: List[list]):
+        """
+        Checkpoint the result rows of one completed article (committed immediately)
+
+        Args:
+            run_id: Run ID
+            article_key: Value from make_article_key
+            margin: Article margin number
+            rows: Result rows extracted for the article
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?)",
+                (run_id, article_key, margin, json.dumps(rows, ensure_ascii=False), now)
+            )
+            self._conn.execute("UPDATE runs SET updated = ? WHERE run_id = ?", (now, run_id))
+            self._conn.commit()
+
+    def finish_run(self, run_id: str, failed_articles: int = 0):
+        """Mark a run as completed, or as incomplete when some articles failed"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE runs SET status = ?, updated = ? WHERE run_id = ?",
+                ("completed" if failed_articles == 0 else "incomplete", time.time(), run_id)
+            )
+            self._conn.commit()
+
+    def list_runs(self) -> List[dict]:
+        """
+        All runs in the journal, most recently updated first
+
+        Returns:
+            List of dictionaries with run_id, document_name, regulation_name,
+            total_articles, completed_articles, status, started and updated
+        """
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT r.run_id, r.document_name, r.regulation_name, r.total_articles,
+                       (SELECT COUNT(*) FROM articles a WHERE a.run_id = r.run_id), r.status, r.started, r.updated
+                FROM runs r ORDER BY r.updated DESC
+            """).fetchall()
+        columns = ["run_id", "document_name", "regulation_name", "total_articles",
+                   "completed_articles", "status", "started", "updated"]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def delete_run(self, run_id: str):
+        """Remove a run and its checkpoints"""
+        with self._lock:
+            self._conn.execute("DELETE FROM articles WHERE run_id = ?", (run_id,))
+            self._conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            self._conn.commit()
+
+    def _prune(self, now):
+        """Drop runs older than the retention period (caller holds the lock)"""
+        cutoff = now - self.retention_seconds
+        self._conn.execute(
+            "DELETE FROM articles WHERE run_id IN (SELECT run_id FROM runs WHERE updated < ?)", (cutoff,)
+        )
+        self._conn.execute("DELETE FROM runs WHERE updated < ?", (cutoff,))
@@ -0,0 +1,240 @@
+"""
+Structured (tool-use / JSON schema) output for gap analysis responses
+
+In the "json" output mode the model records its findings by calling a tool
+whose input schema holds the four result columns, instead of writing a
+pipe-delimited table. The tool input arrives as JSON text, which is parsed
+and validated here:
+
+- rows are checked field by field; fixable problems (value types, coverage
+  spellings, missing reference) are repaired locally
+- rows that cannot be repaired locally (e.g. no valid coverage value or no
+  comment) are returned as broken, so the caller can re-ask for those rows only
+- when the JSON itself is malformed (typically cut off at max_tokens), every
+  complete row object is still recovered with the incremental scanner
+"""
+
+import json
+from typing import List, Optional, Tuple
+
+GAP_ROWS_TOOL_NAME = "record_gap_analysis"
+COVERED_VALUES = ("Yes", "Partial", "No")
+
+# Spellings accepted for the Covered column (table and JSON output)
+COVERED_ALIASES = {
+    'yes': 'Yes', 'y': 'Yes', 'full': 'Yes', 'fully covered': 'Yes',
+    'partial': 'Partial', 'partially': 'Partial', 'p': 'Partial', 'partly': 'Partial',
+    'no': 'No', 'n': 'No', 'missing': 'No', 'not covered': 'No'
+}
+
+# Field names the model sometimes uses instead of the schema names
+FIELD_ALIASES = {
+    'reference in document': 'reference', 'reference_in_document': 'reference', 'section': 'reference',
+    'coverage': 'covered', 'comments': 'comment', 'article': 'margin'
+}
+
+
+def normalize_covered(value: str) -> str:
+    """Map the spellings of Yes/Partial/No to the canonical value (unknown values are returned as is)"""
+    return COVERED_ALIASES.get(value.strip().lower(), value.strip())
+
+
+def gap_rows_tool(with_margin: bool = False) -> dict:
+    """
+    Tool definition for recording gap analysis rows
+
+    The definition is provider-neutral (name, description, input_schema);
+    the LLM clients convert it to their API's tool format.
+
+    Args:
+        with_margin: Add a margin field (multi-article requests)
+
+    Returns:
+        Tool definition dictionary
+    """
+    properties = {
+        "requirement": {"type": "string", "description": "What the regulatory article requires (30-60 words)"},
+        "covered": {"type": "string", "enum": list(COVERED_VALUES)},
+        "reference": {"type": "string", "description": "Section of the company document, or \"-\""},
+        "comment": {"type": "string", "description": "Detailed assessment (at least 30 words)"}
+    }
+    required = ["requirement", "covered", "reference", "comment"]
+    if with_margin:
+        properties = dict(margin={"type": "string", "description": "Margin number of the article"}, **properties)
+        required = ["margin"] + required
+
+    return {
+        "name": GAP_ROWS_TOOL_NAME,
+        "description": "Record every requirement of the regulatory article(s) with its coverage assessment.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "rows": {
+                    "type": "array",
+                    "items": {"type": "object", "properties": properties, "required": required}
+                }
+            },
+            "required": ["rows"]
+        }
+    }
+
+
+def validate_row(item, with_margin: bool = False) -> Tuple[Optional[dict], str]:
+    """
+    Validate one row object and repair what can be repaired locally
+
+    Args:
+        item: Row object from the tool input
+        with_margin: The row must carry a margin
+
+    Returns:
+        Tuple (row dict with requirement/covered/reference/comment[/margin], status) where status is
+        "ok", "repaired" (fixed locally), "broken" (needs a re-ask; the partial row is returned)
+        or "dropped" (not a row - the row is None)
+    """
+    if not isinstance(item, dict):
+        return None, "dropped"
+
+    repaired = False
+    row = {}
+    for key, value in item.items():
+        name = str(key).strip().lower()
+        if name in FIELD_ALIASES:
+            name = FIELD_ALIASES[name]
+            repaired = True
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            value = str(value)
+            repaired = True
+        row[name] = value.strip()
+
+    # Same rule as the table parser: no (or a too short) requirement is not a row
+    if len(row.get('requirement', '')) < 5:
+        return None, "dropped"
+
+    broken = False
+    covered = normalize_covered(row.get('covered', ''))
+    if covered != row.get('covered'):
+        repaired = True
+    row['covered'] = covered
+    if covered not in COVERED_VALUES:
+        broken = True
+    if 'reference' not in row:
+        row['reference'] = '-'
+        repaired = True
+    if not row.get('comment'):
+        broken = True
+    if with_margin and not row.get('margin'):
+        broken = True
+
+    if broken:
+        return row, "broken"
+    return row, "repaired" if repaired else "ok"
+
+
+class JsonRowParser:
+    """
+    Emits the row objects of a streamed tool input as soon as each one is complete
+
+    Scans the JSON text once, tracking nesting and strings, and decodes every
+    object that closes at the depth of the rows array. Works on truncated or
+    otherwise malformed JSON, so it is also used to salvage rows after a failed
+    json.loads. Has the same feed/close/restart interface as the table parser.
+    """
+    def __init__(self, on_item, on_restart=None, row_depth: int = 2):
+        """
+        Args:
+            on_item: Called with every decoded row object
+            on_restart: Called when the response starts over (retried request)
+            row_depth: Nesting depth at which row objects open (2 for {"rows": [...]}, 1 for a bare list)
+        """
+        self.on_item = on_item
+        self.on_restart = on_restart
+        self.row_depth = row_depth
+        self._reset_state()
+
+    def _reset_state(self):
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object = None  # characters of the row object being read
+
+    def feed(self, text: str):
+        """Scan a chunk of the JSON text"""
+        for char in text:
+            if self._object is not None:
+                self._object.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                if char == '{' and self._depth == self.row_depth and self._object is None:
+                    self._object = [char]
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._object is not None and self._depth == self.row_depth:
+                    self._emit(''.join(self._object))
+                    self._object = None
+
+    def close(self):
+        """End of response - an unfinished row object is discarded"""
+        self._reset_state()
+
+    def restart(self):
+        """Discard the partial response; the rows emitted so far are withdrawn through on_restart"""
+        self._reset_state()
+        if self.on_restart:
+            self.on_restart()
+
+    def _emit(self, text):
+        try:
+            item = json.loads(text)
+        except ValueError:
+            return
+        self.on_item(item)
+
+
+def _strip_code_fence(text: str) -> str:
+    """Remove a ```json fence and any text around the JSON value"""
+    text = text.strip()
+    starts = [position for position in (text.find('{'), text.find('[')) if position >= 0]
+    return text[min(starts):] if starts else text
+
+
+def parse_row_items(text: str) -> Tuple[List, bool]:
+    """
+    Decode the row objects of a tool input
+
+    Args:
+        text: JSON text ({"rows": [...]} or a bare list)
+
+    Returns:
+        Tuple (row items, parse_failed) - on malformed JSON the complete row
+        objects are salvaged and parse_failed is True
+    """
+    text = _strip_code_fence(text or '')
+    try:
+        value = json.loads(text)
+    except ValueError:
+        value = None
+
+    if isinstance(value, dict) and isinstance(value.get('rows'), list):
+        return value['rows'], False
+    if isinstance(value, list):
+        return value, False
+
+    items = []
+    parser = JsonRowParser(items.append, row_depth=1 if text.startswith('[') else 2)
+    parser.feed(text)
+    return items, True
@@ -0,0 +1,118 @@
+"""
+Token budgeting for gap analysis prompts
+
+Token counts are estimated from the text length (the same estimate the LLM
+scheduler uses for its tokens/min bucket), since the Messages API has no
+local tokenizer. The estimate is only used to size prompts and max_tokens;
+actual usage is taken from the API responses.
+"""
+
+import os
+from typing import List, Tuple
+
+from modules.model.rate_limiter import CHARS_PER_TOKEN
+
+# Input token budget for one gap prompt (template + article + retrieved chunks; 0 = no limit)
+GAP_INPUT_TOKEN_BUDGET = int(os.getenv("GAP_INPUT_TOKEN_BUDGET", "6000"))
+# Chunks that would be cut below this many tokens are dropped instead
+MIN_CHUNK_TOKENS = 100
+
+# Adaptive max_tokens: base + factor x article tokens, within [minimum, GAP_MAX_TOKENS]
+GAP_ADAPTIVE_MAX_TOKENS = os.getenv("GAP_ADAPTIVE_MAX_TOKENS", "true").lower() == "true"
+GAP_MIN_OUTPUT_TOKENS = int(os.getenv("GAP_MIN_OUTPUT_TOKENS", "800"))
+OUTPUT_TOKENS_BASE = 400
+OUTPUT_TOKENS_PER_ARTICLE_TOKEN = 4
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimated number of tokens in a text
+
+    Args:
+        text: Input text
+
+    Returns:
+        Token estimate (at least 1 for non-empty text)
+    """
+    if not text:
+        return 0
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut a text to about max_tokens, at a word boundary
+
+    Args:
+        text: Input text
+        max_tokens: Token limit
+
+    Returns:
+        The text itself if it fits, otherwise its beginning followed by " ..."
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    space = cut.rfind(' ')
+    if space > max_chars // 2:
+        cut = cut[:space]
+    return cut + ' ...'
+
+
+def fit_chunks_to_budget(texts: List[str], budget_tokens: int, min_chunk_tokens: int = MIN_CHUNK_TOKENS) -> Tuple[List[str], int, int]:
+    """
+    Keep the most relevant chunks that fit into a token budget
+
+    Chunks are taken in the given order (most relevant first). The first chunk
+    that does not fit is truncated to the remaining budget, or dropped when
+    less than min_chunk_tokens would remain; all less relevant chunks after it
+    are dropped. The most relevant chunk is always kept (truncated if needed),
+    so the prompt never loses its context entirely.
+
+    Args:
+        texts: Chunk texts ordered by descending relevance
+        budget_tokens: Tokens available for the chunks (<= 0 keeps only the truncated top chunk)
+        min_chunk_tokens: Minimum size of a truncated chunk
+
+    Returns:
+        Tuple (kept texts, number of dropped chunks, number of truncated chunks)
+    """
+    kept = []
+    truncated = 0
+    remaining = budget_tokens
+    for position, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if tokens <= remaining:
+            kept.append(text)
+            remaining -= tokens
+            continue
+
+        allowance = max(remaining, min_chunk_tokens) if position == 0 else remaining
+        if allowance >= min_chunk_tokens:
+            kept.append(truncate_to_tokens(text, allowance))
+            truncated += 1
+        break
+
+    return kept, len(texts) - len(kept), truncated
+
+
+def adaptive_max_tokens(article_text: str, maximum: int, minimum: int = GAP_MIN_OUTPUT_TOKENS) -> int:
+    """
+    Completion token limit sized to the article
+
+    Short articles have few requirements, so they get a smaller output budget;
+    long articles get up to the configured maximum.
+
+    Args:
+        article_text: Regulation article text
+        maximum: Upper limit (GAP_MAX_TOKENS)
+        minimum: Lower limit
+
+    Returns:
+        max_tokens for the request (maximum when GAP_ADAPTIVE_MAX_TOKENS=false)
+    """
+    if not GAP_ADAPTIVE_MAX_TOKENS:
+        return maximum
+    estimate = OUTPUT_TOKENS_BASE + OUTPUT_TOKENS_PER_ARTICLE_TOKEN * count_tokens(article_text)
+    return int(min(maximum, max(minimum, estimate)))
@@ -0,0 +1,317 @@
+"""
+Managed lifecycle for per-upload Chroma indexes
+
+Every uploaded document used to get a fresh vectorestores/chroma_db_temp_upload_<uuid>
+directory that was never deleted. UploadIndexManager instead keys each index
+by a hash of the document content (plus embedding model), so re-uploading the
+same document reuses its index, and evicts old indexes by:
+
+- TTL: indexes unused for longer than ttl_seconds
+- LRU: least recently used indexes beyond max_entries
+- disk budget: least recently used indexes until the total size fits max_disk_mb
+
+The manifest and the active leases live in a SQLite file next to the indexes,
+so sessions in other threads or processes never have an index deleted while
+they are using it. Evicted directories are renamed to "*.deleting-<uuid>"
+tombstones inside the manifest transaction and deleted afterwards, so a
+rebuild of the same document into the same path is never hit by a late delete.
+A background sweeper thread applies the policy periodically.
+"""
+
+import glob
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+DEFAULT_INDEX_ROOT = os.getenv("UPLOAD_INDEX_ROOT", "vectorestores/uploads")
+DEFAULT_TTL_HOURS = float(os.getenv("UPLOAD_INDEX_TTL_HOURS", "24"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("UPLOAD_INDEX_MAX_ENTRIES", "50"))
+DEFAULT_MAX_DISK_MB = float(os.getenv("UPLOAD_INDEX_MAX_DISK_MB", "2048"))
+DEFAULT_SWEEP_SECONDS = float(os.getenv("UPLOAD_INDEX_SWEEP_SECONDS", "600"))
+
+# Unmanaged directories left behind by the old create_vectorstore
+LEGACY_PATTERN = "vectorestores/chroma_db_temp_upload*"
+
+# A lease older than this is treated as abandoned (crashed session/process)
+LEASE_TIMEOUT_SECONDS = 6 * 3600
+
+
+def document_content_hash(data: bytes, model_name: str = "") -> str:
+    """
+    Hash an uploaded document together with the embedding model name
+
+    Args:
+        data: Raw document bytes
+        model_name: Embedding model used to build the index
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def directory_size(path: str) -> int:
+    """Total size in bytes of all files below path"""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+class UploadIndexManager:
+    """
+    Content-addressed upload indexes with LRU + TTL eviction and a disk budget
+    """
+    def __init__(self, root: str = DEFAULT_INDEX_ROOT, ttl_seconds: float = DEFAULT_TTL_HOURS * 3600,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, max_disk_mb: float = DEFAULT_MAX_DISK_MB,
+                 legacy_pattern: str = LEGACY_PATTERN):
+        """
+        Initialize the manager
+
+        Args:
+            root: Directory holding the managed indexes and the manifest
+            ttl_seconds: Remove indexes not used for this long
+            max_entries: Maximum number of indexes kept
+            max_disk_mb: Maximum total size of all indexes
+            legacy_pattern: Glob of unmanaged old upload directories to clean up after the TTL
+        """
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self.legacy_pattern = legacy_pattern
+        self._build_locks = {}
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._stop_event = threading.Event()
+
+        os.makedirs(root, exist_ok=True)
+        self._db_path = os.path.join(root, "manifest.sqlite3")
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS indexes (
+                    content_hash TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    size_bytes INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    lease_id TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    acquired REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        """Open a manifest connection (one per call, so it is safe from any thread)"""
+        conn = sqlite3.connect(self._db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return _Transaction(conn)
+
+    def _index_path(self, content_hash):
+        return os.path.join(self.root, content_hash[:32])
+
+    def _tombstone_path(self, path):
+        """Unique name an index directory is renamed to before it is deleted"""
+        return f"{path}.deleting-{uuid.uuid4().hex}"
+
+    def _remove_tombstones(self) -> list:
+        """Delete directories renamed for deletion (no manifest row points at them any more)"""
+        removed = []
+        for tombstone in glob.glob(os.path.join(self.root, "*.deleting-*")):
+            shutil.rmtree(tombstone, ignore_errors=True)
+            removed.append(tombstone)
+        return removed
+
+    def acquire(self, content_hash: str, build_fn) -> tuple:
+        """
+        Get the index directory for a document, building it if needed, and lease it
+
+        Args:
+            content_hash: Value from document_content_hash
+            build_fn: Callable(path) that creates the index in an empty directory
+
+        Returns:
+            Tuple (index path, lease id) - pass the lease id to release()
+        """
+        lease_id = uuid.uuid4().hex
+        path = self._index_path(content_hash)
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT path FROM indexes WHERE content_hash = ?", (content_hash,)).fetchone()
+            if row is not None and os.path.isdir(row[0]):
+                now = time.time()
+                conn.execute("UPDATE indexes SET last_used = ? WHERE content_hash = ?", (now, content_hash))
+                conn.execute("INSERT INTO leases VALUES (?, ?, ?)", (lease_id, content_hash, now))
+                return row[0], lease_id
+
+        # Build outside the manifest transaction; one builder per document in this process
+        with self._lock:
+            build_lock = self._build_locks.setdefault(content_hash, threading.Lock())
+
+        with build_lock:
+            with self._connect() as conn:
+                row = conn.execute("SELECT path FROM indexes WHERE content_hash = ?", (content_hash,)).fetchone()
+                if row is not None and os.path.isdir(row[0]):
+                    now = time.time()
+                    conn.execute("UPDATE indexes SET last_used = ? WHERE content_hash = ?", (now, content_hash))
+                    conn.execute("INSERT INTO leases VALUES (?, ?, ?)", (lease_id, content_hash, now))
+                    return row[0], lease_id
+
+            # Build into a temporary directory, then move it into place and register it in one
+            # manifest transaction, so a concurrent sweep() never sees the directory without its row
+            temp_path = f"{path}.building-{uuid.uuid4().hex[:8]}"
+            try:
+                build_fn(temp_path)
+                size_bytes = directory_size(temp_path)
+                with self._connect() as conn:
+                    now = time.time()
+                    row = conn.execute("SELECT path FROM indexes WHERE content_hash = ?", (content_hash,)).fetchone()
+                    if row is not None and os.path.isdir(row[0]):
+                        # Another process registered this document meanwhile; use its index
+                        conn.execute("UPDATE indexes SET last_used = ? WHERE content_hash = ?", (now, content_hash))
+                        conn.execute("INSERT INTO leases VALUES (?, ?, ?)", (lease_id, content_hash, now))
+                        return row[0], lease_id
+                    if os.path.isdir(path):
+                        os.replace(path, self._tombstone_path(path))
+                    os.replace(temp_path, path)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO indexes VALUES (?, ?, ?, ?, ?)",
+                        (content_hash, path, now, now, size_bytes)
+                    )
+                    conn.execute("INSERT INTO leases VALUES (?, ?, ?)", (lease_id, content_hash, now))
+            finally:
+                if os.path.isdir(temp_path):
+                    shutil.rmtree(temp_path, ignore_errors=True)
+            self._remove_tombstones()
+
+        return path, lease_id
+
+    def release(self, lease_id: str):
+        """Release a lease taken with acquire()"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT content_hash FROM leases WHERE lease_id = ?", (lease_id,)).fetchone()
+            conn.execute("DELETE FROM leases WHERE lease_id = ?", (lease_id,))
+            if row is not None:
+                conn.execute("UPDATE indexes SET last_used = ? WHERE content_hash = ?", (time.time(), row[0]))
+
+    @contextmanager
+    def lease(self, content_hash: str, build_fn):
+        """Context manager around acquire()/release() yielding the index path"""
+        path, lease_id = self.acquire(content_hash, build_fn)
+        try:
+            yield path
+        finally:
+            self.release(lease_id)
+
+    def sweep(self) -> list:
+        """
+        Apply the TTL, LRU and disk budget policies to unleased indexes
+
+        Returns:
+            List of removed directories
+        """
+        now = time.time()
+        removed_paths = []
+
+        with self._connect() as conn:
+            conn.execute("DELETE FROM leases WHERE acquired < ?", (now - LEASE_TIMEOUT_SECONDS,))
+            leased = {row[0] for row in conn.execute("SELECT DISTINCT content_hash FROM leases")}
+            entries = conn.execute(
+                "SELECT content_hash, path, last_used, size_bytes FROM indexes ORDER BY last_used ASC"
+            ).fetchall()
+
+            total_size = sum(entry[3] for entry in entries)
+            remaining = len(entries)
+            to_remove = []
+            for content_hash, path, last_used, size_bytes in entries:
+                if content_hash in leased:
+                    continue
+                expired = last_used < now - self.ttl_seconds
+                over_budget = remaining > self.max_entries or total_size > self.max_disk_bytes
+                if expired or over_budget:
+                    to_remove.append((content_hash, path))
+                    total_size -= size_bytes
+                    remaining -= 1
+
+            # Forget the entries and rename their directories to tombstones inside the transaction:
+            # an acquire() that rebuilds the same document afterwards moves its fresh index into
+            # the original path, which the deletion below can no longer touch
+            conn.executemany("DELETE FROM indexes WHERE content_hash = ?", [(h,) for h, _ in to_remove])
+            for _, path in to_remove:
+                if os.path.isdir(path):
+                    os.replace(path, self._tombstone_path(path))
+                removed_paths.append(path)
+
+        self._remove_tombstones()
+
+        # Leftovers from interrupted builds and the old unmanaged upload directories
+        stale_paths = glob.glob(os.path.join(self.root, "*.building-*"))
+        if self.legacy_pattern:
+            stale_paths += glob.glob(self.legacy_pattern)
+        for path in stale_paths:
+            try:
+                if os.path.isdir(path) and os.path.getmtime(path) < now - self.ttl_seconds:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed_paths.append(path)
+            except OSError:
+                pass
+
+        if removed_paths:
+            print(f"Upload index sweep removed {len(removed_paths)} director{'y' if len(removed_paths) == 1 else 'ies'}")
+        return removed_paths
+
+    def start_sweeper(self, interval_seconds: float = DEFAULT_SWEEP_SECONDS):
+        """Start the background sweeper thread (no-op if it is already running)"""
+        with self._lock:
+            if self._sweeper is not None and self._sweeper.is_alive():
+                return
+            self._stop_event.clear()
+            self._sweeper = threading.Thread(
+                target=self._sweep_loop, args=(interval_seconds,), name="upload-index-sweeper", daemon=True
+            )
+            self._sweeper.start()
+
+    def stop_sweeper(self):
+        """Stop the background sweeper thread"""
+        self._stop_event.set()
+
+    def _sweep_loop(self, interval_seconds):
+        while not self._stop_event.wait(interval_seconds):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Upload index sweep failed: {e}")
+
+
+class _Transaction:
+    """Run a block inside BEGIN IMMEDIATE ... COMMIT and close the connection"""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.conn.close()
+        return False
@@ -1,11 +1,12 @@
 import streamlit as st
 import pandas as pd
-from modules.model.open_source_llm import create_embeddings, get_llm
+from modules.resources import registry, get_embeddings, get_llm_client
 from modules.UI.general import hide_sidebar,show_logo, rotate_circle, button_design,upload_button_design
 from modules.UI.regulation_list import choose_reg
 from modules.UI.dropdown_styling import apply_dropdown_styling
 from modules.design_excel import write_to_excel
 from modules.gap_analyzer_claude import perform_gap_analysis
+from modules.regulation_store import REGULATION_FILES
 import os
 
 st.set_page_config(page_title="Gap Analysis", page_icon="design/logo/logo2.png",layout="wide")
@@ -26,6 +27,15 @@ unsafe_allow_html=True)
 
 
 
+@st.cache_resource(show_spinner="Loading AI models...")
+def load_shared_resources():
+    """Warm the process-wide embedding model and LLM client once per server process"""
+    get_embeddings()
+    get_llm_client()
+    return registry.stats()
+
+load_shared_resources()
+
 # Initialize session state variables
 for key, default in [("regbox", False), ("reg_is_seleceted", False), ("doc_is_uploaded", False), ("disabled", True), ("uploaded_file", None), ("regulation_file", None)]:
     if key not in st.session_state:
@@ -104,23 +114,24 @@ if right.button("**GAP-Analyzer**", help='Perform your gap analysis based on AI'
     regulation_name = st.session_state.get('regulation_anlyz', '')
     
     # Map regulation name to file path
-    regulation_files = {
-        'Circular 2023/1 Operational risks and resilience – banks': 'Data/Finma_EN/splitted/finma_optional.xlsx',
-        'Circular 2017/1 Corporate governance - banks': 'Data/Finma_EN/splitted/finma2017_open_source_embeddings.xlsx',
-        'Circular 2013/8 Market conduct rules': 'Data/Finma_EN/splitted/finma2013_market_conduct_embeddings.xlsx',
-    }
-    
-    regulation_file = regulation_files.get(regulation_name)
+    regulation_file = REGULATION_FILES.get(regulation_name)
     
     if regulation_file and os.path.exists(regulation_file):
         try:
-            # Perform gap analysis
-            with st.spinner('Analyzing your document with Claude AI...'):
-                df_results = perform_gap_analysis(
-                    uploaded_file=st.session_state['uploaded_file'],
-                    regulation_file=regulation_file,
-                    regulation_name=regulation_name
-                )
+            # Perform gap analysis (the results table fills in while the responses stream in)
+            df_results = perform_gap_analysis(
+                uploaded_file=st.session_state['uploaded_file'],
+                regulation_file=regulation_file,
+                regulation_name=regulation_name
+            )
+            
+            run_metrics = df_results.attrs.get("run_metrics", {})
+            if run_metrics.get("resumed_articles"):
+                st.info(f"Resumed an interrupted run: {run_metrics['resumed_articles']} of "
+                        f"{run_metrics['articles']} articles were taken from its checkpoints.")
+            if run_metrics.get("failed_articles"):
+                st.warning(f"{run_metrics['failed_articles']} articles failed. Run the analysis again "
+                           "to retry only those articles.")
             
             # Generate Excel file
             excel_file = write_to_excel(df_results)
@@ -3,6 +3,7 @@ import pandas as pd
 from modules.UI.general import hide_sidebar
 from modules.UI.regulation_list import choose_reg
 from modules.UI.dropdown_styling import apply_dropdown_styling
+from modules.regulation_store import REGULATION_FILES, load_regulation
 
 st.set_page_config(page_title="Regulatory Repository", page_icon="design/logo/logo2.png", layout="wide")
 is_reg_rep = True
@@ -13,13 +14,10 @@ apply_dropdown_styling()
 choose_reg(True)
 
 if st.session_state['regulation_rep'] != "Select a Regulation":
-    # Mapping sipas përzgjedhjes
-    if st.session_state['regulation_rep'] == "Circular 2023/1 Operational risks and resilience – banks":
-        df = pd.read_excel('Data/Finma_EN/splitted/finma_optional.xlsx')
-    elif st.session_state['regulation_rep'] == "Circular 2017/1 Corporate governance - banks":
-        df = pd.read_excel('Data/Finma_EN/splitted/finma2017_open_source_embeddings.xlsx')
-    elif st.session_state['regulation_rep'] == "Circular 2013/8 Market conduct rules":
-        df = pd.read_excel('Data/Finma_EN/splitted/finma2013_market_conduct_embeddings.xlsx')
+    # Mapping sipas përzgjedhjes (compiled store when available, Excel otherwise)
+    regulation_file = REGULATION_FILES.get(st.session_state['regulation_rep'])
+    if regulation_file:
+        df, _ = load_regulation(regulation_file)
     else:
         df = None
 